@@ -50,6 +50,13 @@ man_pages = [
         [author],
         1,
     ),
+    (
+        "man1/flux-rabbittimeline",
+        "flux-rabbittimeline",
+        "flux-coral2 commands",
+        [author],
+        1,
+    ),
     (
         "man1/flux-dws2jgf",
         "flux-dws2jgf",
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""Script to summarize where time goes in the rabbit lifecycle of jobs."""
+
+import argparse
+import sys
+import json
+
+import flux
+import flux.constants
+import flux.job
+from flux.job import JobID
+from flux_k8s import timeline
+
+
+def read_args():
+    """Read in command-line args."""
+    parser = argparse.ArgumentParser(
+        formatter_class=flux.util.help_formatter(),
+        description=(
+            "Summarize the rabbit timelines of jobs, showing the time spent "
+            "between consecutive events of each job."
+        ),
+    )
+    parser.add_argument(
+        "-n",
+        "--count",
+        type=int,
+        default=100,
+        metavar="N",
+        help="summarize the N most recent inactive jobs if no jobids are given",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="print the summary as JSON",
+    )
+    parser.add_argument(
+        "jobids",
+        nargs="*",
+        metavar="JOBID",
+        help="jobids whose timelines to summarize",
+    )
+    return parser.parse_args()
+
+
+def fetch_timelines(handle, jobids):
+    """Return the decoded timelines of the jobs that have one."""
+    timelines = []
+    for jobid in jobids:
+        try:
+            response = flux.job.job_kvs_lookup(
+                handle, jobid, keys=[timeline.TIMELINE_KEY], decode=False
+            )
+        except Exception as exc:
+            sys.exit(f"Lookup of job {jobid} failed: {exc}")
+        if response is None:
+            sys.exit(f"Could not find job {jobid}")
+        eventlog = response.get(timeline.TIMELINE_KEY)
+        if eventlog:
+            timelines.append(timeline.decode(eventlog))
+    return timelines
+
+
+def print_table(title, rows):
+    """Print statistics of rows of (label, stats) pairs."""
+    print(
+        f"{title:<48} {'COUNT':>6} {'TOTAL':>10} {'MEAN':>8} "
+        f"{'P50':>8} {'P90':>8} {'MAX':>8}"
+    )
+    for label, stats in rows:
+        print(
+            f"{label:<48} {stats['count']:>6} {stats['total']:>10.3f} "
+            f"{stats['mean']:>8.3f} {stats['p50']:>8.3f} {stats['p90']:>8.3f} "
+            f"{stats['max']:>8.3f}"
+        )
+
+
+def main():
+    """Summarize timelines of the given or most recent jobs."""
+    args = read_args()
+    handle = flux.Flux()
+    if args.jobids:
+        jobids = [JobID(jobid) for jobid in args.jobids]
+    else:
+        jobids = [
+            job["id"]
+            for job in flux.job.job_list(
+                handle,
+                max_entries=args.count,
+                attrs=[],
+                userid=flux.constants.FLUX_USERID_UNKNOWN,
+                states=flux.constants.FLUX_JOB_STATE_INACTIVE,
+            ).get_jobs()
+        ]
+    timelines = fetch_timelines(handle, jobids)
+    if not timelines:
+        sys.exit("No rabbit timelines found")
+    summary = timeline.summarize(timelines)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "jobs": len(timelines),
+                    "phases": [
+                        {"from": start, "to": end, **stats}
+                        for (start, end), stats in summary["phases"].items()
+                    ],
+                    "details": [
+                        {"field": field, "event": event, **stats}
+                        for (field, event), stats in summary["details"].items()
+                    ],
+                }
+            )
+        )
+        return
+    print(f"{len(timelines)} jobs with rabbit timelines, times in seconds\n")
+    print_table(
+        "PHASE",
+        (
+            (f"{start} -> {end}", stats)
+            for (start, end), stats in summary["phases"].items()
+        ),
+    )
+    print()
+    print_table(
+        "DETAIL",
+        (
+            (f"{field} of {event}", stats)
+            for (field, event), stats in summary["details"].items()
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,15 +9,16 @@ Data Workflow Services is DWS for short.
 
 import os
 import sys
+import concurrent.futures
 import syslog
 import json
 import functools
 import argparse
 import logging
-import pwd
 import time
 import re
 import contextlib
+import contextvars
 from datetime import datetime
 import base64
 import cProfile
@@ -25,8 +26,6 @@ import pstats
 import io
 import faulthandler
 
-import kubernetes
-import kubernetes.client
 from kubernetes.client.rest import ApiException
 import urllib3
 
@@ -36,23 +35,43 @@ from flux.job.JobID import id_parse
 from flux.constants import FLUX_MSGTYPE_REQUEST
 from flux.future import Future
 import flux_k8s
-from flux_k8s import crd
+from flux_k8s import client, config, crd
+from flux_k8s import fastjson
 from flux_k8s.watch import Watchers, Watch
 from flux_k8s import directivebreakdown
 from flux_k8s import cleanup
 from flux_k8s import storage
+from flux_k8s import reconcile
+from flux_k8s import metrics
+from flux_k8s import usercache
+from flux_k8s import keyed
+from flux_k8s import standby
+from flux_k8s.ratelimit import Priority, priority
 import flux_k8s.systemstatus
 from flux_k8s.workflow import (
+    StateMachine,
+    Timing,
+    Transition,
+    TransitionContext,
     TransientConditionInfo,
     WorkflowInfo,
     save_workflow_to_kvs,
+    label_existing_workflows,
+    staging_directives,
     WorkflowState,
 )
 
 
 LOGGER = logging.getLogger(__name__)
 WORKFLOWS_IN_TC = {}  # tc for TransientCondition
+# threads for issuing independent k8s requests of a single callback at once
+_REQUEST_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="k8s-request"
+)
+# makes blocking requests for different workflows at once, in order per workflow
+_WORKFLOW_EXECUTOR = keyed.KeyedExecutor()
 _MIN_ALLOCATION_SIZE = 4  # minimum rabbit allocation size
+_EVICT_INTERVAL = 60  # seconds between evictions of expired WorkflowInfo objects
 _EXITCODE_NORESTART = 3  # exit code indicating to systemd not to restart
 CLIENTMOUNT_NAME = re.compile(r"-computes$")
 
@@ -104,8 +123,10 @@ def message_callback_wrapper(func):
         try:
             func(handle, arg, msg, k8s_api)
         except UserError as exc:
+            metrics.RPC_ERRORS.labels(msg.topic).inc()
             handle.respond(msg, {"success": False, "errstr": str(exc)})
         except Exception as exc:
+            metrics.RPC_ERRORS.labels(msg.topic).inc()
             try:
                 jobid = msg.payload["jobid"]
                 topic = msg.topic
@@ -126,75 +147,111 @@ def message_callback_wrapper(func):
     return wrapper
 
 
-def save_elapsed_time_to_kvs(handle, jobid, workflow):
-    """Save the elapsedTime field to a job's KVS, ignoring errors."""
-    try:
-        timing = workflow["status"]["elapsedTimeLastState"]
-        state = workflow["status"]["state"].lower()
-    except KeyError:
+def rpc_metrics_wrapper(func, topic):
+    """Wrap a msg_watcher callback to count and time the RPCs it handles."""
+
+    @functools.wraps(func)
+    def wrapper(handle, arg, msg, args):
+        start = time.monotonic()
+        try:
+            func(handle, arg, msg, args)
+        finally:
+            metrics.RPC_REQUESTS.labels(topic).inc()
+            metrics.RPC_DURATION.labels(topic).observe(time.monotonic() - start)
+
+    return wrapper
+
+
+def submit_request(func, *args):
+    """Call ``func(*args)`` on a request thread, in a copy of the current context.
+
+    The copied context carries the priority class of the requests ``func``
+    makes. ``func`` must only make kubernetes requests: Flux handles are
+    not thread-safe and must stay on the reactor.
+    """
+    return _REQUEST_EXECUTOR.submit(contextvars.copy_context().run, func, *args)
+
+
+def run_concurrently(calls):
+    """Call every function in ``calls`` at once, in separate threads.
+
+    Wait for all of them to finish; if any raised, re-raise the first
+    exception (in the order of ``calls``).
+    """
+    if len(calls) == 1:
+        calls[0]()
         return
-    try:
-        with flux.job.job_kvs(handle, jobid) as kvsdir:
-            kvsdir[f"rabbit_{state}_timing"] = timing
-    except Exception:
-        LOGGER.exception(
-            "Failed to update KVS for job %s: workflow is %s", jobid, workflow
-        )
+    futures = [submit_request(call) for call in calls]
+    concurrent.futures.wait(futures)
+    for future in futures:
+        future.result()
 
 
-def owner_uid(handle):
-    """Get instance owner UID"""
-    try:
-        return int(handle.attr_get("security.owner"))
-    except Exception:
-        return os.getuid()
+def read_workflow_token(secrets_api, token):
+    """Read the secret named by a workflow's `workflowToken` and decode it."""
+    secret = secrets_api.read_namespaced_secret(
+        token["secretName"], token["secretNamespace"]
+    )
+    return base64.b64decode(secret.data["token"]).decode("utf8")
+
+
+def prefetch_workflow_token(secrets_api, winfo, workflow):
+    """Begin reading a workflow's token secret as soon as DWS reports it.
+
+    The token is needed when PreRun completes, right before the job starts,
+    so read it on a worker thread ahead of time.
+    """
+    if winfo.token is not None:
+        return
+    token = workflow["status"].get("workflowToken")
+    if token is not None:
+        winfo.token = submit_request(read_workflow_token, secrets_api, token)
 
 
-def fetch_job_environment(secrets_api, workflow):
-    """Fetch the variables to be exported to a user's job."""
+def fetch_job_environment(secrets_api, workflow, prefetched=None):
+    """Fetch the variables to be exported to a user's job.
+
+    :param prefetched: future for the workflow token, if it was prefetched;
+        if the prefetch failed or has not finished, the secret is read again
+        rather than waiting on the worker thread
+    """
     variables = workflow["status"].get("env", {})
     token = workflow["status"].get("workflowToken")
     if token is None:
         return variables
     # if the workflow requires a secret, fetch it
-    secret = secrets_api.read_namespaced_secret(
-        token["secretName"], token["secretNamespace"]
-    )
-    variables["DW_WORKFLOW_TOKEN"] = base64.b64decode(secret.data["token"]).decode(
-        "utf8"
-    )
+    result = "read"
+    if prefetched is not None and not prefetched.done():
+        result = "pending"
+    elif prefetched is not None:
+        try:
+            variables["DW_WORKFLOW_TOKEN"] = prefetched.result()
+        except Exception:
+            LOGGER.warning("Prefetching workflow token failed, reading it again")
+        else:
+            metrics.TOKEN_FETCHES.labels("prefetched").inc()
+            return variables
+    metrics.TOKEN_FETCHES.labels(result).inc()
+    variables["DW_WORKFLOW_TOKEN"] = read_workflow_token(secrets_api, token)
     return variables
 
 
-def expand_str_directive(directive, presets):
-    """Expand a directive string into a list of one or more individual directives.
+def parse_dw_directives(dw_directives, presets):
+    """Convert potentially composite DW directives into a list of singletons.
 
-    Check if the string is one of the presets, and if so replace it.
+    ``presets`` is either the `rabbit.presets` table or a ConfigSnapshot,
+    in which case its precompiled presets and memoized expansions are used.
     """
-    if directive.strip() in presets:
-        preset = presets[directive.strip()]
-        if isinstance(preset, list):
-            # if a preset is a list, the entries must be individual #DW strings
-            return preset
-        if not isinstance(preset, str):
-            raise TypeError(
-                f"presets must be list or str but preset {directive} is {type(preset)}"
-            )
-        directive = preset
-    # the string may contain multiple #DW directives
-    dw_directives = directive.split("#DW ")
-    # remove any blank entries that resulted and add back "#DW "
-    return ["#DW " + dw.strip() for dw in dw_directives if dw.strip()]
-
-
-def parse_dw_directives(dw_directives, presets):
-    """Convert potentially composite DW directives into a list of singletons."""
+    if isinstance(presets, config.ConfigSnapshot):
+        expand = presets.expand
+    else:
+        expand = functools.partial(config.expand_directive, presets=presets)
     if isinstance(dw_directives, str):
-        expanded_directives = expand_str_directive(dw_directives, presets)
+        expanded_directives = list(expand(dw_directives))
     elif isinstance(dw_directives, list):
         expanded_directives = []
         for directive in dw_directives:
-            expanded_directives.extend(expand_str_directive(directive, presets))
+            expanded_directives.extend(expand(directive))
     else:
         raise UserError(
             f"Malformed #DW directives, not list or string: {dw_directives!r}"
@@ -203,21 +260,20 @@ def parse_dw_directives(dw_directives, presets):
 
 
 @message_callback_wrapper
-def create_cb(handle, _t, msg, k8s_api):
+def create_cb(handle, _t, msg, args):
     """dws.create RPC callback. Creates a k8s Workflow object for a job.
 
     Triggered when a new job with a jobdw directive is submitted.
     """
+    received = time.time()
+    k8s_api, group_cache = args
     jobid = msg.payload["jobid"]
     userid = msg.payload["userid"]
-    dw_directives = parse_dw_directives(
-        msg.payload["dw_directives"], handle.conf_get("rabbit.presets", {})
-    )
+    snapshot = config.current()
+    dw_directives = parse_dw_directives(msg.payload["dw_directives"], snapshot)
     for directive in dw_directives:
-        if "create_persistent" in directive and handle.conf_get(
-            "rabbit.restrict_persistent", True
-        ):
-            if userid != owner_uid(handle):
+        if "create_persistent" in directive and snapshot.restrict_persistent:
+            if userid != snapshot.owner_uid:
                 raise UserError(
                     "only the instance owner can create persistent file systems"
                 )
@@ -227,7 +283,7 @@ def create_cb(handle, _t, msg, k8s_api):
         "dwDirectives": dw_directives,
         "jobID": flux.job.JobID(jobid).f58plain,
         "userID": userid,
-        "groupID": pwd.getpwuid(userid).pw_gid,
+        "groupID": group_cache.gid(userid),
         "wlmID": "flux",
     }
     body = {
@@ -238,8 +294,10 @@ def create_cb(handle, _t, msg, k8s_api):
             "name": workflow_name,
             "namespace": crd.WORKFLOW_CRD.namespace,
             "finalizers": [cleanup.FINALIZER],
+            "labels": WorkflowInfo.LABELS,
         },
     }
+    created = time.time()
     try:
         k8s_api.create_namespaced_custom_object(
             *crd.WORKFLOW_CRD,
@@ -255,12 +313,20 @@ def create_cb(handle, _t, msg, k8s_api):
         or int(msg.payload["failure_tolerance"]) < 0
     ):
         raise UserError("dw_failure_tolerance must be a positive integer")
-    WorkflowInfo.add(
+    winfo = WorkflowInfo.add(
         jobid,
         workflow_name,
         msg.payload["resources"],
         int(msg.payload["failure_tolerance"]),
     )
+    winfo.staging = staging_directives(dw_directives)
+    winfo.timeline.record("rpc", received, topic=msg.topic)
+    winfo.timeline.record(
+        "desired",
+        created,
+        state=WorkflowState.PROPOSAL.value,
+        latency=round(time.time() - created, 6),
+    )
     # submit a memo providing the name of the workflow
     handle.rpc(
         "job-manager.memo",
@@ -269,7 +335,7 @@ def create_cb(handle, _t, msg, k8s_api):
 
 
 @timer_callback_wrapper
-def prerun_timeout_cb(handle, k8s_api, winfo, rabbit_manager):
+def prerun_timeout_cb(handle, k8s_api, winfo, ctx):
     """Check for mount failures and take action.
 
     This callback fires after a workflow has been in PreRun for a configurable
@@ -279,7 +345,7 @@ def prerun_timeout_cb(handle, k8s_api, winfo, rabbit_manager):
         handle.job_raise(winfo.jobid, "dws-timeout", 0, "timed out waiting for mounts")
         return
     not_mounted = get_clientmounts_not_in_state(k8s_api, winfo.name, "mounted")
-    rabbit_manager.set_property(not_mounted, f"{winfo.jobid} timed out in PreRun")
+    ctx.rabbit_manager.set_property(not_mounted, f"{winfo.jobid} timed out in PreRun")
     try:
         winfo.notify_of_node_failure(handle, not_mounted, k8s_api)
     except ValueError:
@@ -330,9 +396,11 @@ def setup_cb(handle, _t, msg, args):
     """
     k8s_api, rabbit_manager = args
     jobid = msg.payload["jobid"]
+    winfo = WorkflowInfo.get(jobid)
+    winfo.timeline.record("rpc", topic=msg.topic)
     hlist = Hostlist(msg.payload["R"]["execution"]["nodelist"]).uniq()
     workflow_name = WorkflowInfo.get_name(jobid)
-    workflow = k8s_api.get_namespaced_custom_object(*crd.WORKFLOW_CRD, workflow_name)
+    workflow = fastjson.get_namespaced(k8s_api, crd.WORKFLOW_CRD, workflow_name)
     nodes_per_nnf = {}
     compute_node_count = 0
     for hostname in hlist:
@@ -350,6 +418,10 @@ def setup_cb(handle, _t, msg, args):
         },
     ).then(log_rpc_response, jobid)
     lustre = False
+    # the Servers resources must be filled in before the move to Setup, but
+    # are independent of each other and of the Computes resource, so patch
+    # them all at once
+    patches = []
     for breakdown in directivebreakdown.fetch_breakdowns(k8s_api, workflow):
         # if a breakdown doesn't have a storage field (e.g. persistentdw) directives
         # ignore it and proceed
@@ -361,19 +433,29 @@ def setup_cb(handle, _t, msg, args):
                 compute_node_count,
                 _MIN_ALLOCATION_SIZE,
             )
-            k8s_api.patch_namespaced_custom_object(
-                crd.SERVER_CRD.group,
-                crd.SERVER_CRD.version,
-                breakdown["status"]["storage"]["reference"]["namespace"],
-                crd.SERVER_CRD.plural,
-                breakdown["status"]["storage"]["reference"]["name"],
-                {"spec": {"allocationSets": allocation_sets}},
+            patches.append(
+                functools.partial(
+                    k8s_api.patch_namespaced_custom_object,
+                    crd.SERVER_CRD.group,
+                    crd.SERVER_CRD.version,
+                    breakdown["status"]["storage"]["reference"]["namespace"],
+                    crd.SERVER_CRD.plural,
+                    breakdown["status"]["storage"]["reference"]["name"],
+                    {"spec": {"allocationSets": allocation_sets}},
+                )
             )
             lustre = directivebreakdown.check_is_lustre(breakdown_alloc_sets)
-    winfo = WorkflowInfo.get(jobid)
     winfo.hlist = hlist
+    if "computes" in workflow["status"]:
+        # only the kubernetes request leaves the reactor
+        computes = winfo.pending_computes(handle)
+        if computes is not None:
+            patches.append(
+                functools.partial(winfo.write_computes, k8s_api, workflow, computes)
+            )
+    run_concurrently(patches)
     winfo.move_desiredstate(WorkflowState.SETUP, k8s_api)
-    setup_timeout = handle.conf_get("rabbit.setup_timeout", 0)
+    setup_timeout = config.current().setup_timeout
     # create a timer watcher to check for failures and set forceReady
     if setup_timeout > 0:
         winfo.state_timer = handle.timer_watcher_create(
@@ -385,7 +467,8 @@ def setup_cb(handle, _t, msg, args):
 
 def drain_nodes_with_mounts(handle, k8s_api, winfo):
     """Drain all nodes that have not yet unmounted."""
-    to_drain = get_clientmounts_not_in_state(k8s_api, winfo.name, "unmounted")
+    with priority(Priority.TEARDOWN):
+        to_drain = get_clientmounts_not_in_state(k8s_api, winfo.name, "unmounted")
     if to_drain:
         encoded_hostlist = Hostlist(to_drain).uniq().encode()
         LOGGER.debug(
@@ -402,14 +485,29 @@ def drain_nodes_with_mounts(handle, k8s_api, winfo):
             },
             nodeid=0,
         ).then(log_rpc_response, winfo.jobid)
+        metrics.DRAINS.labels("unmount").inc()
+        metrics.DRAINED_NODES.labels("unmount").inc(len(to_drain))
     return to_drain
 
 
 def check_existence_and_move_to_teardown(handle, k8s_api, winfo):
-    """Check that a workflow exists and move it to Teardown if so."""
+    """Check that a workflow exists and move it to Teardown if so.
+
+    If a request for the workflow is in progress, wait for it to complete,
+    so that the workflow cannot be moved back out of Teardown by it.
+    """
+    _WORKFLOW_EXECUTOR.run(
+        winfo.jobid, _check_existence_and_move_to_teardown, handle, k8s_api, winfo
+    )
+
+
+def _check_existence_and_move_to_teardown(handle, k8s_api, winfo):
     jobid = winfo.jobid
+    if winfo.toredown:
+        return
     try:
-        workflow = k8s_api.get_namespaced_custom_object(*crd.WORKFLOW_CRD, winfo.name)
+        with priority(Priority.TEARDOWN):
+            workflow = fastjson.get_namespaced(k8s_api, crd.WORKFLOW_CRD, winfo.name)
     except ApiException as api_err:
         if api_err.status != 404:
             raise
@@ -418,6 +516,8 @@ def check_existence_and_move_to_teardown(handle, k8s_api, winfo):
         handle.rpc("job-manager.dws.epilog-remove", payload={"id": jobid}).then(
             log_rpc_response, jobid
         )
+        winfo.timeline.record("epilog-remove")
+        winfo.timeline.save(handle, jobid)
     else:
         # workflow does exist
         winfo.move_to_teardown(handle, k8s_api, workflow)
@@ -462,6 +562,7 @@ def post_run_cb(handle, _t, msg, args):
     k8s_api, system_status = args
     jobid = msg.payload["jobid"]
     winfo = WorkflowInfo.get(jobid)
+    winfo.timeline.record("rpc", topic=msg.topic)
     run_started = msg.payload["run_started"]
     if winfo.toredown:
         # workflow has already been transitioned to 'teardown', do nothing
@@ -472,20 +573,43 @@ def post_run_cb(handle, _t, msg, args):
         check_existence_and_move_to_teardown(handle, k8s_api, winfo)
     else:
         winfo.move_desiredstate(WorkflowState.POSTRUN, k8s_api)
-        teardown_after = handle.conf_get("rabbit.teardown_after", 0.0)
-        # create a timer watcher to move the workflow to teardown
-        if teardown_after > 0:
-            winfo._teardown_after_timer = handle.timer_watcher_create(
-                teardown_after, teardown_after_timer_cb, args=(handle, k8s_api, winfo)
-            ).start()  # store it on winfo so it isn't garbage collected
-        postrun_timeout = handle.conf_get("rabbit.postrun_timeout", 0.0)
-        # create a timer watcher to abandon mounts and move to teardown
-        if postrun_timeout > 0:
-            winfo.state_timer = handle.timer_watcher_create(
-                postrun_timeout,
-                postrun_timeout_cb,
-                args=(handle, k8s_api, winfo, system_status),
-            ).start()
+        set_postrun_timers(handle, k8s_api, winfo, system_status)
+
+
+def set_postrun_timers(handle, k8s_api, winfo, system_status, elapsed=0.0):
+    """Set the timers of a workflow in PostRun, ``elapsed`` seconds in."""
+    snapshot = config.current()
+    teardown_after = snapshot.teardown_after
+    # create a timer watcher to move the workflow to teardown
+    if teardown_after > 0:
+        winfo.teardown_timer = handle.timer_watcher_create(
+            max(teardown_after - elapsed, 0.0),
+            teardown_after_timer_cb,
+            args=(handle, k8s_api, winfo),
+        ).start()  # store it on winfo so it isn't garbage collected
+    postrun_timeout = snapshot.postrun_timeout
+    # create a timer watcher to abandon mounts and move to teardown
+    if postrun_timeout > 0:
+        winfo.state_timer = handle.timer_watcher_create(
+            max(postrun_timeout - elapsed, 0.0),
+            postrun_timeout_cb,
+            args=(handle, k8s_api, winfo, system_status),
+        ).start()
+
+
+def resume_timers(ctx, workflow, winfo, elapsed, system_status):
+    """Restore the timers set by a previous instance for a workflow in PostRun.
+
+    The timer of PreRun is declared in TRANSITIONS, so the state machine
+    restores it. The timer of Setup is not restored, since it needs the
+    job's resources.
+    """
+    if (
+        workflow["spec"]["desiredState"] == WorkflowState.POSTRUN
+        and winfo.state_timer is None
+        and winfo.teardown_timer is None
+    ):
+        set_postrun_timers(ctx.handle, ctx.k8s_api, winfo, system_status, elapsed)
 
 
 @message_callback_wrapper
@@ -499,6 +623,7 @@ def teardown_cb(handle, _t, msg, k8s_api):
     """
     jobid = msg.payload["jobid"]
     winfo = WorkflowInfo.get(jobid)
+    winfo.timeline.record("rpc", topic=msg.topic)
     if not winfo.toredown:
         check_existence_and_move_to_teardown(handle, k8s_api, winfo)
 
@@ -518,6 +643,7 @@ def abort_cb(handle, _t, msg, args):
     k8s_api, system_status = args
     jobid = msg.payload["jobid"]
     winfo = WorkflowInfo.get(jobid)
+    winfo.timeline.record("rpc", topic=msg.topic)
     winfo.epilog_removed = True
     if not winfo.toredown:
         check_existence_and_move_to_teardown(handle, k8s_api, winfo)
@@ -546,15 +672,43 @@ def abort_cb(handle, _t, msg, args):
         )
 
 
-def status_cb(handle, _arg, msg, _):
+def metrics_cb(handle, _arg, msg, _args):
+    """dws.metrics RPC callback. Returns metrics in Prometheus text format."""
+    try:
+        text = metrics.REGISTRY.expose()
+    except Exception as exc:
+        handle.respond(msg, {"success": False, "errstr": repr(exc)})
+        LOGGER.exception("Error in responding to dws.metrics RPC:")
+    else:
+        handle.respond(msg, {"success": True, "metrics": text})
+
+
+def write_metrics_cb(_reactor, _watcher, _r, path):
+    """Timer callback writing metrics to a file for a textfile collector."""
+    try:
+        metrics.REGISTRY.write_textfile(path)
+    except OSError as exc:
+        LOGGER.warning("Failed to write metrics to %s: %s", path, exc)
+
+
+def status_cb(handle, _arg, msg, reconciler):
     """dws.status RPC callback. Returns some status info."""
     try:
-        workflows = list(WorkflowInfo.known_workflows())
+        status = {
+            "workflows": list(WorkflowInfo.known_workflows()),
+            "workflow_registry": WorkflowInfo.stats(),
+            "k8s_connections": client.get_factory().pool_stats(),
+            "k8s_ratelimit": client.get_factory().limiter_stats(),
+            "k8s_breaker": client.get_factory().breaker_stats(),
+            "cleanup": cleanup.stats(),
+            "reconciler": reconciler.stats(),
+            "workflow_executor": _WORKFLOW_EXECUTOR.stats(),
+        }
     except Exception as exc:
         handle.respond(msg, {"success": False, "errstr": repr(exc)})
         LOGGER.exception("Error in responding to dws.status RPC:")
     else:
-        handle.respond(msg, {"success": True, "workflows": workflows})
+        handle.respond(msg, {"success": True, **status})
 
 
 def get_clientmounts_not_in_state(k8s_api, workflow_name, desired_state):
@@ -563,10 +717,9 @@ def get_clientmounts_not_in_state(k8s_api, workflow_name, desired_state):
     The job is specified by the name of the workflow.
     """
     try:
-        clientmounts = k8s_api.list_cluster_custom_object(
-            group=crd.CLIENTMOUNT_CRD.group,
-            version=crd.CLIENTMOUNT_CRD.version,
-            plural=crd.CLIENTMOUNT_CRD.plural,
+        clientmounts = fastjson.list_cluster(
+            k8s_api,
+            crd.CLIENTMOUNT_CRD,
             label_selector=(f"{crd.DWS_GROUP}/workflow.name={workflow_name}"),
         )["items"]
     except Exception as exc:
@@ -632,10 +785,9 @@ def get_servers_with_condition(k8s_api, workflow_name, condition):
     field of the Servers resource.
     """
     try:
-        servers = k8s_api.list_cluster_custom_object(
-            group=crd.SERVER_CRD.group,
-            version=crd.SERVER_CRD.version,
-            plural=crd.SERVER_CRD.plural,
+        servers = fastjson.list_cluster(
+            k8s_api,
+            crd.SERVER_CRD,
             label_selector=(f"{crd.DWS_GROUP}/workflow.name={workflow_name}"),
         )["items"]
     except Exception as exc:
@@ -677,9 +829,7 @@ def state_active(workflow, state):
     return workflow["spec"]["desiredState"] == workflow["status"]["state"] == state
 
 
-def workflow_state_change_cb(
-    event, handle, k8s_api, disable_fluxion, secrets_api, rabbit_manager
-):
+def workflow_state_change_cb(event, machine):
     """Exception-catching wrapper around _workflow_state_change_cb_inner."""
     try:
         workflow = event["object"]
@@ -691,46 +841,50 @@ def workflow_state_change_cb(
     if not WorkflowInfo.is_recognized(workflow_name):
         LOGGER.warning("unrecognized workflow '%s' in event stream", workflow_name)
         return
+    # wait for requests made for earlier events of the workflow
+    _WORKFLOW_EXECUTOR.run(jobid, _workflow_event_cb, event, workflow, jobid, machine)
+
+
+def _workflow_event_cb(event, workflow, jobid, machine):
+    """Handle an event of a workflow once earlier events have been handled."""
+    workflow_name = workflow["metadata"]["name"]
     winfo = WorkflowInfo.get(jobid)
     if event.get("TYPE") == "DELETED" or event.get("type") == "DELETED":
         # the workflow has been deleted, we can forget about it
         WorkflowInfo.remove(jobid)
+        machine.forget(jobid)
         return
+    if not winfo.deleted:
+        winfo.keep()  # the workflow exists, so keep its information
     try:
-        _workflow_state_change_cb_inner(
-            workflow,
-            winfo,
-            handle,
-            k8s_api,
-            disable_fluxion,
-            secrets_api,
-            rabbit_manager,
-        )
+        _workflow_state_change_cb_inner(workflow, winfo, machine)
     except Exception:
         LOGGER.exception(
             "Failed to process event update for workflow '%s' with jobid %s:",
             workflow_name,
             jobid,
         )
-        try:
-            winfo.move_to_teardown(handle, k8s_api, workflow)
-        except ApiException:
-            LOGGER.exception(
-                "Failed to move workflow '%s' with jobid %s to 'teardown' "
-                "state after error: ",
-                workflow_name,
-                jobid,
-            )
-        else:
-            winfo.toredown = True
-        handle.job_raise(jobid, "exception", 0, "DWS/Rabbit interactions failed")
+        abandon_workflow(machine.ctx, workflow, winfo)
 
 
-def _workflow_state_change_cb_inner(
-    workflow, winfo, handle, k8s_api, disable_fluxion, secrets_api, rabbit_manager
-):
+def abandon_workflow(ctx, workflow, winfo):
+    """Move a workflow that hit an error to Teardown and raise a job exception."""
+    try:
+        winfo.move_to_teardown(ctx.handle, ctx.k8s_api, workflow)
+    except ApiException:
+        LOGGER.exception(
+            "Failed to move workflow '%s' with jobid %s to 'teardown' "
+            "state after error: ",
+            winfo.name,
+            winfo.jobid,
+        )
+    else:
+        winfo.toredown = True
+    ctx.handle.job_raise(winfo.jobid, "exception", 0, "DWS/Rabbit interactions failed")
+
+
+def _workflow_state_change_cb_inner(workflow, winfo, machine):
     """Handle workflow state transitions."""
-    jobid = winfo.jobid
     if "state" not in workflow["status"]:
         # workflow was just submitted, DWS still needs to give workflow
         # a state of 'Proposal'
@@ -738,71 +892,102 @@ def _workflow_state_change_cb_inner(
     if winfo.deleted:
         # deletion request has been submitted, nothing to do
         return
+    ctx = machine.ctx
+    winfo.timeline.observe(workflow)
+    prefetch_workflow_token(ctx.secrets_api, winfo, workflow)
     if state_active(workflow, WorkflowState.TEARDOWN) and not state_complete(
         workflow, WorkflowState.TEARDOWN
     ):
         # Remove the finalizer as soon as the workflow begins working on its
         # teardown state.
-        cleanup.remove_finalizer(winfo.name, k8s_api, workflow)
-    elif state_complete(workflow, WorkflowState.TEARDOWN):
-        # Delete workflow object and tell DWS jobtap plugin that the job is done.
-        # Attempt to remove the finalizer again in case the state transitioned
-        # too quickly for it to be noticed earlier.
-        if not winfo.epilog_removed:
-            # if the 'dws.abort' RPC was received, epilog already removed
-            handle.rpc("job-manager.dws.epilog-remove", payload={"id": jobid}).then(
-                log_rpc_response, jobid
-            )
-        rabbit_manager.mark_rabbits_free(jobid, handle)
-        save_elapsed_time_to_kvs(handle, jobid, workflow)
-        cleanup.delete_workflow(workflow)
-        winfo.deleted = True
-    elif winfo.toredown:
-        # in the event of an exception, the workflow will skip to 'teardown'.
-        # Without this early 'return', this function may try to
-        # move a 'teardown' workflow to an earlier state because the
-        # 'teardown' update is still in the k8s update queue.
-        return
-    elif state_complete(workflow, WorkflowState.PROPOSAL):
-        handle_proposal_state(workflow, winfo, handle, k8s_api, disable_fluxion)
-    elif state_complete(workflow, WorkflowState.SETUP):
-        # move workflow to next stage, DataIn
-        winfo.move_desiredstate(WorkflowState.DATAIN, k8s_api)
-        save_elapsed_time_to_kvs(handle, jobid, workflow)
-        winfo.patch_computes_object(handle, k8s_api, workflow)
-    elif state_complete(workflow, WorkflowState.DATAIN):
-        # move workflow to next stage, PreRun
-        winfo.move_desiredstate(WorkflowState.PRERUN, k8s_api)
-        save_elapsed_time_to_kvs(handle, jobid, workflow)
-        prerun_timeout = handle.conf_get("rabbit.prerun_timeout", 0.0)
-        # create a timer watcher to abandon mounts and move to teardown
-        if prerun_timeout > 0:
-            winfo.state_timer = handle.timer_watcher_create(
-                prerun_timeout,
-                prerun_timeout_cb,
-                args=(handle, k8s_api, winfo, rabbit_manager),
-            ).start()
-    elif state_complete(workflow, WorkflowState.PRERUN):
-        # tell DWS jobtap plugin that the job can start
-        variables = fetch_job_environment(secrets_api, workflow)
-        handle.rpc(
-            "job-manager.dws.prolog-remove",
-            payload={
-                "id": jobid,
-                "variables": variables,
-            },
-        ).then(log_rpc_response, jobid)
-        if winfo.state_timer is not None:
-            winfo.state_timer.stop()
-        save_elapsed_time_to_kvs(handle, jobid, workflow)
-    elif state_complete(workflow, WorkflowState.POSTRUN):
-        # move workflow to next stage, DataOut
-        winfo.move_desiredstate(WorkflowState.DATAOUT, k8s_api)
-        save_elapsed_time_to_kvs(handle, jobid, workflow)
-    elif state_complete(workflow, WorkflowState.DATAOUT):
-        # move workflow to next stage, teardown
-        winfo.move_to_teardown(handle, k8s_api, workflow)
-    handle_workflow_errors(workflow, winfo, handle)
+        with priority(Priority.TEARDOWN):
+            cleanup.remove_finalizer(winfo.name, ctx.k8s_api, workflow)
+    machine.advance(workflow, winfo)
+    handle_workflow_errors(workflow, winfo, ctx.handle)
+
+
+def proposal_action(ctx, workflow, winfo):
+    """Update the job's resources once the workflow's Proposal is complete."""
+    handle_proposal_state(workflow, winfo, ctx.handle, ctx.k8s_api, ctx.disable_fluxion)
+
+
+def patch_computes_action(ctx, workflow, winfo):
+    """Patch the Computes object again if nodes failed in Setup."""
+    # patched during dws.setup; only patched again if nodes failed in Setup
+    winfo.patch_computes_object(ctx.handle, ctx.k8s_api, workflow)
+
+
+def release_prolog_action(ctx, workflow, winfo):
+    """Tell the DWS jobtap plugin that the job can start."""
+    variables = fetch_job_environment(ctx.secrets_api, workflow, winfo.token)
+    ctx.handle.rpc(
+        "job-manager.dws.prolog-remove",
+        payload={
+            "id": winfo.jobid,
+            "variables": variables,
+        },
+    ).then(log_rpc_response, winfo.jobid)
+    winfo.timeline.record("prolog-remove")
+
+
+def release_epilog_action(ctx, workflow, winfo):
+    """Free the job's rabbits and tell the DWS jobtap plugin that it is done."""
+    if not winfo.epilog_removed:
+        # if the 'dws.abort' RPC was received, epilog already removed
+        ctx.handle.rpc(
+            "job-manager.dws.epilog-remove", payload={"id": winfo.jobid}
+        ).then(log_rpc_response, winfo.jobid)
+        winfo.timeline.record("epilog-remove")
+    ctx.rabbit_manager.mark_rabbits_free(winfo.jobid, ctx.handle)
+
+
+def delete_workflow_action(ctx, workflow, winfo):
+    """Save the job's timeline and delete the workflow object."""
+    winfo.timeline.save(ctx.handle, winfo.jobid)
+    cleanup.delete_workflow(workflow)
+    winfo.deleted = True
+    winfo.expire()  # in case the DELETED event is missed
+
+
+# What to do when a workflow completes each state. DWS does not allow DataIn
+# to be skipped, but without copy_in directives it completes at once, so the
+# Setup timing is saved along with the DataIn timing. DWS allows a move to
+# Teardown from any state, so DataOut is skipped without copy_out directives;
+# move_to_teardown saves the PostRun timing then.
+TRANSITIONS = (
+    Transition(WorkflowState.PROPOSAL, actions=[proposal_action]),
+    Transition(
+        WorkflowState.SETUP,
+        WorkflowState.DATAIN,
+        actions=[patch_computes_action],
+        timing=Timing.SAVE,
+        empty_unless="copy_in",
+    ),
+    Transition(
+        WorkflowState.DATAIN,
+        WorkflowState.PRERUN,
+        timing=Timing.SAVE,
+        # abandon mounts and move to teardown if PreRun takes too long
+        timeout="prerun_timeout",
+        on_timeout=prerun_timeout_cb,
+    ),
+    Transition(
+        WorkflowState.PRERUN, actions=[release_prolog_action], timing=Timing.SAVE
+    ),
+    Transition(
+        WorkflowState.POSTRUN,
+        WorkflowState.DATAOUT,
+        timing=Timing.SAVE,
+        empty_unless="copy_out",
+        skippable=True,
+    ),
+    Transition(WorkflowState.DATAOUT, WorkflowState.TEARDOWN),
+    Transition(
+        WorkflowState.TEARDOWN,
+        actions=[release_epilog_action, delete_workflow_action],
+        timing=Timing.SAVE,
+    ),
+)
 
 
 def handle_proposal_state(workflow, winfo, handle, k8s_api, disable_fluxion):
@@ -831,7 +1016,7 @@ def handle_proposal_state(workflow, winfo, handle, k8s_api, disable_fluxion):
                 {"not": [{"properties": [storage.ALLOCATED_PROPERTY]}]},
             ]
         }
-    elif not handle.conf_get("rabbit.drain_compute_nodes", True):
+    elif not config.current().drain_compute_nodes:
         new_constraint = {"not": [{"properties": [storage.EXCLUDE_PROPERTY]}]}
     else:
         new_constraint = None
@@ -867,6 +1052,12 @@ def handle_workflow_errors(workflow, winfo, handle):
         # a potentially fatal error has occurred, but may resolve itself
         message = workflow["status"].get("message", "")
         if winfo.jobid not in WORKFLOWS_IN_TC:
+            metrics.TRANSIENT_CONDITIONS.labels(
+                workflow["status"]["state"].lower()
+            ).inc()
+            winfo.timeline.record(
+                "transient-condition", state=workflow["status"]["state"]
+            )
             WORKFLOWS_IN_TC[winfo.jobid] = TransientConditionInfo(
                 time.time(), message, prerun
             )
@@ -885,15 +1076,17 @@ def kill_workflows_in_tc(_reactor, watcher, _r, args):
     """Callback firing every (tc_timeout / 2) seconds.
 
     Raise exceptions on jobs stuck in TransientCondition for more than
-    tc_timeout seconds.
+    tc_timeout seconds, as currently configured.
     """
-    tc_timeout, k8s_api, manager = args
+    k8s_api, manager = args
+    tc_timeout = config.current().tc_timeout
     curr_time = time.time()
     # iterate over a copy of the set
     # otherwise an exception occurs because we modify the set as we
     # iterate over it.
     for jobid, trans_cond in list(WORKFLOWS_IN_TC.items()):
         if curr_time - trans_cond.last_time > tc_timeout:
+            metrics.TRANSIENT_CONDITION_TIMEOUTS.inc()
             if trans_cond.prerun:
                 # if a job is in prerun, a mount is probably failing
                 # in this case check what nodes have failed to mount and set
@@ -921,6 +1114,14 @@ def kill_workflows_in_tc(_reactor, watcher, _r, args):
             del WORKFLOWS_IN_TC[jobid]
 
 
+def evict_workflows_cb(_reactor, _watcher, _r, machine):
+    """Callback firing periodically, forgetting workflows no longer needed."""
+    evicted = WorkflowInfo.evict_expired()
+    if evicted:
+        machine.prune(WorkflowInfo.known_workflows())
+        LOGGER.debug("Evicted %i workflows, %s", evicted, WorkflowInfo.stats())
+
+
 def heartbeat_cb(_reactor, watcher, _r, profiler):
     """Callback firing every hour, emitting heartbeat message and profile data."""
     LOGGER.info("Service is still alive")
@@ -930,6 +1131,7 @@ def heartbeat_cb(_reactor, watcher, _r, profiler):
         len(known_workflows),
         known_workflows[:3],
     )
+    LOGGER.debug("Kubernetes connection pool: %s", client.get_factory().pool_stats())
     stream = io.StringIO()
     profiler.disable()
     ps = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
@@ -940,6 +1142,30 @@ def heartbeat_cb(_reactor, watcher, _r, profiler):
     profiler.enable()
 
 
+def _setup_metrics_watchers(handle):
+    """Set up metrics collected at exposition time, and the textfile collector.
+
+    If `rabbit.metrics_textfile` is set, write the metrics to that file
+    every `rabbit.metrics_textfile_interval` seconds.
+    """
+    metrics.CLEANUP_PENDING.function = lambda: {
+        (kind,): count for kind, count in cleanup.stats()["pending"].items()
+    }
+    metrics.WORKFLOW_REGISTRY_ENTRIES.function = lambda: {
+        (): len(WorkflowInfo.known_workflows())
+    }
+    metrics.WORKFLOW_REGISTRY_BYTES.function = lambda: {
+        (): WorkflowInfo.stats()["bytes"]
+    }
+    path = handle.conf_get("rabbit.metrics_textfile")
+    if not path:
+        return ()
+    interval = handle.conf_get("rabbit.metrics_textfile_interval", 60)
+    return (
+        handle.timer_watcher_create(0, write_metrics_cb, repeat=interval, args=path),
+    )
+
+
 def _setup_heartbeat_watchers(handle, profiler):
     """Set up watchers meant to monitor the status of the service.
 
@@ -975,7 +1201,7 @@ def setup_parsing():
         "-w",
         type=int,
         default=5,
-        help="Interval in seconds to issue k8s watch requests",
+        help="Delay in seconds before reopening a k8s watch after an error",
     )
     parser.add_argument(
         "--verbose",
@@ -1007,10 +1233,15 @@ def setup_parsing():
         default=10,
         type=float,
         help=(
-            "Seconds to wait after a kubernetes call fails, doubling each time "
-            "failures occur back-to-back"
+            "Seconds to reject kubernetes calls after repeated failures, "
+            "doubling each time the next trial call also fails"
         ),
     )
+    parser.add_argument(
+        "--standby",
+        action="store_true",
+        help=("Run as a hot standby, taking over as soon as the active instance exits"),
+    )
     return parser
 
 
@@ -1039,24 +1270,38 @@ def config_logging(args):
         logging.getLogger(flux_k8s.__name__).propagate = False
 
 
-def register_services(handle, k8s_api, system_status, rabbit_manager):
-    """register dws.create, dws.setup, and dws.post_run services."""
-    serv_reg_fut = handle.service_register("dws")
+def register_services(
+    handle,
+    k8s_api,
+    system_status,
+    rabbit_manager,
+    reconciler,
+    group_cache,
+    registered=False,
+):
+    """register dws.create, dws.setup, and dws.post_run services.
+
+    Every RPC handled is counted and timed in the ``flux_k8s.metrics`` registry.
+    If ``registered``, the ``dws`` service name is already ours.
+    """
+    serv_reg_fut = None if registered else handle.service_register("dws")
     for service_name, cb, args in (
-        ("create", create_cb, k8s_api),
+        ("create", create_cb, (k8s_api, group_cache)),
         ("setup", setup_cb, (k8s_api, rabbit_manager)),
         ("post_run", post_run_cb, (k8s_api, system_status)),
         ("teardown", teardown_cb, k8s_api),
         ("abort", abort_cb, (k8s_api, system_status)),
-        ("status", status_cb, None),
+        ("status", status_cb, reconciler),
+        ("metrics", metrics_cb, None),
     ):
         yield handle.msg_watcher_create(
-            cb,
+            rpc_metrics_wrapper(cb, f"dws.{service_name}"),
             FLUX_MSGTYPE_REQUEST,
             f"dws.{service_name}",
             args=args,
         )
-    serv_reg_fut.get()
+    if serv_reg_fut is not None:
+        serv_reg_fut.get()
 
 
 def raise_self_exception(handle):
@@ -1075,71 +1320,31 @@ def raise_self_exception(handle):
     Future(handle.job_raise(jobid, "exception", 7, "dws watchers setup")).get()
 
 
-def kubernetes_backoff(handle, orig_retry_delay):
-    """Wrapper around reactor_run to back off if k8s is unresponsive."""
-    retry_delay = orig_retry_delay
-    last_error = 0
+def run_reactor(handle):
+    """Wrapper around reactor_run to keep running if k8s is unresponsive.
+
+    Requests to k8s are retried individually, and rejected outright while the
+    circuit breaker of the shared client is open (see ``flux_k8s.retry``), so
+    there is no need to pause the whole service when kubernetes errors escape
+    a callback.
+    """
     while True:
         try:
             handle.reactor_run()
         except urllib3.exceptions.HTTPError as k8s_err:
             LOGGER.warning(
-                "Hit an exception: '%s' while contacting kubernetes, "
-                "sleeping for %s seconds",
+                "Hit an exception: '%s' while contacting kubernetes: %s",
                 k8s_err,
-                retry_delay,
-            )
-            now = time.time()
-            if now - last_error < retry_delay + 5:
-                # double the retry delay if we hit an error within
-                # five seconds of trying again
-                retry_delay = min(retry_delay * 2, 300)  # max out at 5 min
-            else:
-                retry_delay = orig_retry_delay
-            last_error = now
-            time.sleep(retry_delay)
-
-
-def validate_config(config):
-    """Validate the `rabbit` config table."""
-    accepted_keys = {
-        "save_datamovements",
-        "kubeconfig",
-        "tc_timeout",
-        "drain_compute_nodes",
-        "restrict_persistent_creation",
-        "policy",
-        "presets",
-        "mapping",
-        "soft_drain",
-        "setup_timeout",
-        "prerun_timeout",
-        "postrun_timeout",
-        "teardown_after",
-        "prolog_timeout",
-    }
-    keys = set(config.keys())
-    if not keys <= accepted_keys:
-        LOGGER.warning(
-            "misconfiguration: unrecognized `rabbit.%s` key in Flux config, "
-            "accepted keys are %s",
-            (keys - accepted_keys).pop(),
-            accepted_keys,
-        )
-    if "policy" in config:
-        if len(config["policy"]) != 1 or "maximums" not in config["policy"]:
-            LOGGER.warning("`rabbit.policy` config table muxt have a `maximums` table")
-        keys = set(config["policy"]["maximums"].keys())
-        accepted_keys = set(directivebreakdown.ResourceLimits.TYPES)
-        if not keys <= accepted_keys:
-            LOGGER.warning(
-                "misconfiguration: unrecognized `rabbit.policy.maximums.%s` key in "
-                "Flux config, accepted keys are %s",
-                (keys - accepted_keys).pop(),
-                accepted_keys,
+                client.get_factory().breaker_stats(),
             )
 
 
+def reload_config(snapshot):
+    """Apply settings from a reloaded config snapshot."""
+    WorkflowInfo.save_datamovements = snapshot.save_datamovements
+    WorkflowInfo.ttl = snapshot.workflow_info_ttl
+
+
 def main():
     """Init script, begin processing of services."""
     profiler = cProfile.Profile()
@@ -1154,8 +1359,11 @@ def main():
     if "FLUX_KVS_NAMESPACE" in os.environ:
         del os.environ["FLUX_KVS_NAMESPACE"]
     handle = flux.Flux()
-    validate_config(handle.conf_get("rabbit", {}))
-    WorkflowInfo.save_datamovements = handle.conf_get("rabbit.save_datamovements", 0)
+    try:
+        reload_config(config.load(handle))
+    except ValueError as exc:
+        LOGGER.critical("Invalid Flux config, shutting down: %s", exc)
+        sys.exit(_EXITCODE_NORESTART)
     # set the maximum allowable allocation sizes on the ResourceLimits class
     for fs_type in directivebreakdown.ResourceLimits.TYPES:
         setattr(
@@ -1163,6 +1371,24 @@ def main():
             fs_type,
             handle.conf_get(f"rabbit.policy.maximums.{fs_type}"),
         )
+    client.configure(
+        handle.conf_get("rabbit.kubeconfig"),
+        pool_size=handle.conf_get("rabbit.k8s_pool_size", client.DEFAULT_POOL_SIZE),
+        qps=handle.conf_get("rabbit.k8s_qps", client.DEFAULT_QPS),
+        burst=handle.conf_get("rabbit.k8s_burst", client.DEFAULT_BURST),
+        retries=handle.conf_get("rabbit.k8s_retries", client.DEFAULT_RETRIES),
+        failure_threshold=handle.conf_get(
+            "rabbit.k8s_failure_threshold", client.DEFAULT_FAILURE_THRESHOLD
+        ),
+        breaker_timeout=args.retry_delay,
+        keepalive=handle.conf_get("rabbit.k8s_keepalive", client.DEFAULT_KEEPALIVE),
+        request_timeout=handle.conf_get(
+            "rabbit.k8s_request_timeout", client.DEFAULT_REQUEST_TIMEOUT
+        ),
+        reactor_timeout=handle.conf_get(
+            "rabbit.k8s_reactor_timeout", client.DEFAULT_REACTOR_TIMEOUT
+        ),
+    )
     try:
         k8s_api = cleanup.get_k8s_api(handle.conf_get("rabbit.kubeconfig"))
     except Exception:
@@ -1171,52 +1397,161 @@ def main():
         )
         sys.exit(_EXITCODE_NORESTART)
     crd.determine_api_versions(handle, k8s_api)
-    secrets_api = kubernetes.client.CoreV1Api(
-        kubernetes.config.new_client_from_config(handle.conf_get("rabbit.kubeconfig"))
-    )
-    cleanup.setup_cleanup_thread(handle.conf_get("rabbit.kubeconfig"))
+    secrets_api = client.get_factory().core_v1_api()
+    # everything up to the start of the reactor only reads state, so that a
+    # standby instance may do it ahead of taking over
     storage.populate_rabbits_dict(k8s_api)
-    system_status = flux_k8s.systemstatus.SystemStatusManager(handle, k8s_api).start()
+    manager = storage.create_rabbit_manager(
+        handle, args.disable_fluxion, args.drain_queues
+    )
+    system_status = flux_k8s.systemstatus.SystemStatusManager(handle, k8s_api)
     # start watching k8s workflow resources and operate on them when updates occur
     # or new RPCs are received
-    with Watchers(handle, watch_interval=args.watch_interval) as watchers:
-        manager = storage.init_rabbits(
-            k8s_api,
-            handle,
-            watchers,
-            args.disable_fluxion,
-            args.drain_queues,
-        )
+    with Watchers(
+        handle,
+        watch_interval=args.watch_interval,
+        stats_interval=handle.conf_get("rabbit.watch_stats_interval", 300),
+    ) as watchers:
+        if args.standby:
+            # keep up with the watches, but only act on them after taking over
+            watchers.hold()
         # create a timer watcher for killing workflows that have been stuck in
         # the "Error" state for too long
-        tc_timeout = handle.conf_get("rabbit.tc_timeout", 10)
+        # the check interval is fixed, but the timeout itself may be reloaded
+        tc_timeout = config.current().tc_timeout
         timer_watcher = handle.timer_watcher_create(
             tc_timeout / 2,
             kill_workflows_in_tc,
             repeat=tc_timeout / 2,
-            args=(tc_timeout, k8s_api, manager),
+            args=(k8s_api, manager),
+        )
+        # drive workflows through their states
+        machine = StateMachine(
+            TRANSITIONS,
+            TransitionContext(
+                handle, k8s_api, secrets_api, manager, args.disable_fluxion
+            ),
+            on_error=abandon_workflow,
+            executor=_WORKFLOW_EXECUTOR,
+            resume=functools.partial(resume_timers, system_status=system_status),
+        )
+        # forget about workflows that are no longer needed
+        evict_watcher = handle.timer_watcher_create(
+            _EVICT_INTERVAL, evict_workflows_cb, repeat=_EVICT_INTERVAL, args=machine
         )
         heartbeat_watchers = _setup_heartbeat_watchers(handle, profiler)
+        # periodically reclaim workflows whose jobs are no longer active
+        reconciler = reconcile.WorkflowReconciler(
+            handle,
+            k8s_api,
+            functools.partial(workflow_state_change_cb, machine=machine),
+            interval=handle.conf_get(
+                "rabbit.reconcile_interval", reconcile.DEFAULT_INTERVAL
+            ),
+            page_size=handle.conf_get(
+                "rabbit.reconcile_page_size", reconcile.DEFAULT_PAGE_SIZE
+            ),
+            grace=handle.conf_get("rabbit.reconcile_grace", reconcile.DEFAULT_GRACE),
+        )
         with contextlib.ExitStack() as stack:
-            for watcher in (timer_watcher,) + heartbeat_watchers:
+            for watcher in heartbeat_watchers:
                 stack.enter_context(watcher)
-            for service in register_services(handle, k8s_api, system_status, manager):
-                stack.enter_context(service)
+            stack.enter_context(
+                config.ConfigWatcher(
+                    handle,
+                    interval=handle.conf_get(
+                        "rabbit.config_poll_interval", config.DEFAULT_POLL_INTERVAL
+                    ),
+                    on_reload=reload_config,
+                ).start()
+            )
+            stack.enter_context(
+                _WORKFLOW_EXECUTOR.start(
+                    handle,
+                    handle.conf_get("rabbit.workflow_workers", keyed.DEFAULT_WORKERS),
+                )
+            )
+            group_cache = usercache.GroupCache(
+                _REQUEST_EXECUTOR,
+                ttl=handle.conf_get("rabbit.user_cache_ttl", usercache.DEFAULT_TTL),
+            )
             watchers.add_watch(
                 Watch(
                     k8s_api,
                     crd.WORKFLOW_CRD,
                     0,
                     workflow_state_change_cb,
+                    machine,
+                    label_selector=WorkflowInfo.LABEL_SELECTOR,
+                )
+            )
+
+            def activate():
+                """Begin acting on workflows, rabbits, and RPCs."""
+                # resumes any cleanup requests left by a previous instance
+                cleanup.setup_cleanup_thread(
                     handle,
+                    handle.conf_get("rabbit.kubeconfig"),
+                    handle.conf_get(
+                        "rabbit.cleanup_parallelism", cleanup.DEFAULT_PARALLELISM
+                    ),
+                    config.current().pod_log_limits,
+                    handle.conf_get(
+                        "rabbit.delete_batch_interval",
+                        cleanup.DEFAULT_DELETE_BATCH_INTERVAL,
+                    ),
+                )
+                system_status.start()
+                storage.init_rabbits(
                     k8s_api,
+                    handle,
+                    watchers,
                     args.disable_fluxion,
-                    secrets_api,
+                    args.drain_queues,
+                    manager=manager,
+                )
+                timers = (timer_watcher, evict_watcher)
+                for watcher in timers + _setup_metrics_watchers(handle):
+                    stack.enter_context(watcher)
+                stack.enter_context(reconciler.start())
+                for service in register_services(
+                    handle,
+                    k8s_api,
+                    system_status,
                     manager,
+                    reconciler,
+                    group_cache,
+                    registered=args.standby,
+                ):
+                    stack.enter_context(service)
+                try:
+                    labeled = label_existing_workflows(k8s_api)
+                except Exception:
+                    LOGGER.exception("Failed to label existing workflows")
+                else:
+                    if labeled:
+                        LOGGER.info("Labeled %i existing workflows", labeled)
+                watchers.release()
+
+            if args.standby:
+                LOGGER.info("Running on standby")
+                stack.enter_context(
+                    standby.ServiceHandoff(
+                        handle,
+                        "dws",
+                        activate,
+                        interval=handle.conf_get(
+                            "rabbit.standby_poll_interval", standby.DEFAULT_INTERVAL
+                        ),
+                    ).start()
                 )
-            )
+            else:
+                activate()
+            # from here on, requests made while handling events must not
+            # hold up the reactor with retries
+            client.set_reactor_thread()
             raise_self_exception(handle)
-            kubernetes_backoff(handle, args.retry_delay)
+            run_reactor(handle)
 
 
 if __name__ == "__main__":
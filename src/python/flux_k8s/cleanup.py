@@ -1,21 +1,82 @@
-"""Module defining cleanup routines for the coral2_dws service."""
+"""Module defining cleanup routines for the coral2_dws service.
+
+Cleanup requests are coroutines running on an asyncio loop in a dedicated
+thread. The blocking kubernetes calls they make are run on a thread pool,
+so that up to ``parallelism`` requests make progress at once and a slow
+deletion does not hold up the teardowns queued behind it.
+
+Every request is recorded in a journal in the KVS until it completes, and
+the journal is replayed when the cleanup thread starts, so that requests
+outstanding when the service stopped are carried out after it restarts.
+"""
 
 import asyncio
+import base64
+import collections
+import concurrent.futures
 import logging
 import threading
+import time
+import zlib
 
-import kubernetes as k8s
 from kubernetes.client.rest import ApiException
 from kubernetes.config.config_exception import ConfigException
 
-from flux_k8s import crd
+from flux_k8s import client, crd, fastjson
+from flux_k8s.config import DEFAULT_POD_LOG_LIMITS
+from flux_k8s.ratelimit import Priority, priority
 import flux_k8s.workflow
 import flux
 import flux.job
+import flux.kvs
 
 LOGGER = logging.getLogger(__name__)
 FINALIZER = "flux-framework.readthedocs.io/workflow"
+# label marking workflows to be deleted by the next collection delete
+DELETE_LABEL = "flux-framework.readthedocs.io/delete"
 CLEANUP_LOOP = asyncio.get_event_loop()
+DEFAULT_PARALLELISM = 8  # maximum number of concurrent blocking cleanup calls
+_EXECUTOR = None  # thread pool for blocking calls, created by setup_cleanup_thread
+_PARALLELISM = 0  # number of threads in _EXECUTOR
+_PENDING = collections.Counter()  # number of submitted requests by type
+_LATENCIES = {}  # maps request types and k8s operations to _LatencyStats
+_STATS_LOCK = threading.Lock()
+JOURNAL_DIR = "dws.cleanup-journal"  # KVS directory of outstanding requests
+_JOURNAL = {}  # maps workflow names to journaled request types
+_JOURNAL_LOCK = threading.Lock()  # guards _JOURNAL
+_JOURNAL_HANDLE = None  # reactor's Flux handle, used to journal submitted requests
+DEFAULT_DELETE_BATCH_INTERVAL = 5.0  # seconds between collection deletes
+_DELETE_BATCH_INTERVAL = DEFAULT_DELETE_BATCH_INTERVAL
+_DELETE_BATCH = []  # futures of workflows awaiting a collection delete, loop only
+_DELETE_STATS = collections.Counter()  # counts of batched and fallback deletions
+
+_POD_LOG_LIMITS = DEFAULT_POD_LOG_LIMITS
+
+
+class _LatencyStats:
+    """Running count, total, and maximum of durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def asdict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+def _record_latency(name, duration):
+    with _STATS_LOCK:
+        _LATENCIES.setdefault(name, _LatencyStats()).add(duration)
 
 
 def remove_finalizer(workflow_name, crd_api, workflow):
@@ -54,14 +115,16 @@ def _remove_finalizer(workflow_name, crd_api, workflow):
 
 
 def get_k8s_api(kubeconfig):
-    """Return a handle to the k8s cluster's CustomObjectsApi."""
+    """Return a handle to the k8s cluster's CustomObjectsApi.
+
+    The handle shares its connection pool with every other API object created
+    by the process-wide ``flux_k8s.client.ClientFactory``.
+    """
     try:
-        k8s_client = k8s.config.new_client_from_config(kubeconfig)
+        crd_api = client.get_factory(kubeconfig).custom_objects_api()
     except ConfigException:
         LOGGER.exception("Kubernetes misconfigured")
         raise
-    try:
-        crd_api = k8s.client.CustomObjectsApi(k8s_client)
     except ApiException as rest_exception:
         if rest_exception.status == 403:
             LOGGER.exception(
@@ -81,16 +144,244 @@ def log_error(fut):
         LOGGER.exception("Exception in cleanup routine")
 
 
+def _submit(coro, kind):
+    """Submit a coroutine to the cleanup loop, keeping count of pending requests."""
+    submitted = time.monotonic()
+
+    def done_cb(fut):
+        with _STATS_LOCK:
+            _PENDING[kind] -= 1
+        _record_latency(kind, time.monotonic() - submitted)
+        log_error(fut)
+
+    with _STATS_LOCK:
+        _PENDING[kind] += 1
+    asyncio.run_coroutine_threadsafe(coro, CLEANUP_LOOP).add_done_callback(done_cb)
+
+
+def _journal_key(workflow_name):
+    return f"{JOURNAL_DIR}.{workflow_name}"
+
+
+def _journal_add(workflow_name, kind, submit):
+    """Record a cleanup request in the KVS journal, then call ``submit``.
+
+    Must be called from the reactor thread. The entry is committed
+    asynchronously, and the request is queued by ``submit`` once the commit
+    completes, so that a request still waiting for its turn is replayed if
+    the service dies. A deletion supersedes a teardown of the same workflow,
+    since the entries share a key.
+    """
+    with _JOURNAL_LOCK:
+        _JOURNAL[workflow_name] = kind
+    if _JOURNAL_HANDLE is None:
+        submit()  # the cleanup thread has not been set up
+        return
+    try:
+        flux.kvs.put(_JOURNAL_HANDLE, _journal_key(workflow_name), {"type": kind})
+        flux.kvs.commit_async(_JOURNAL_HANDLE).then(
+            _journal_added_cb, workflow_name, kind, submit
+        )
+    except Exception:
+        LOGGER.exception("Failed to journal %s of workflow %s", kind, workflow_name)
+        submit()
+
+
+def _journal_added_cb(future, workflow_name, kind, submit):
+    """Queue a request once its journal entry has been committed."""
+    try:
+        future.get()
+    except Exception:
+        LOGGER.exception("Failed to journal %s of workflow %s", kind, workflow_name)
+    submit()
+
+
+def _journal_remove(workflow_name, kind):
+    """Remove a completed request from the KVS journal.
+
+    Nothing is done if the entry has since been superseded by another request.
+    Must be called from the cleanup thread.
+    """
+    handle = threading.current_thread().flux_handle
+    with _JOURNAL_LOCK:
+        if _JOURNAL.get(workflow_name) != kind:
+            return
+        del _JOURNAL[workflow_name]
+    try:
+        flux.kvs.put_unlink(handle, _journal_key(workflow_name))
+        flux.kvs.commit(handle)
+        # a superseding request journaled by the reactor while the unlink
+        # was in flight may have been committed first, so journal it again
+        with _JOURNAL_LOCK:
+            superseding = _JOURNAL.get(workflow_name)
+        if superseding is not None:
+            flux.kvs.put(handle, _journal_key(workflow_name), {"type": superseding})
+            flux.kvs.commit(handle)
+    except Exception:
+        LOGGER.exception(
+            "Failed to remove %s of workflow %s from journal", kind, workflow_name
+        )
+
+
+async def _journaled(workflow_name, kind, coro):
+    """Run ``coro``, then remove its journal entry, added when it was submitted.
+
+    If ``coro`` raises, the entry is left in place to be replayed on restart.
+    """
+    await coro
+    _journal_remove(workflow_name, kind)
+
+
+async def _run_blocking(operation, func, *args):
+    """Run ``func(*args)`` on the thread pool, recording its latency."""
+    start = time.monotonic()
+    try:
+        return await CLEANUP_LOOP.run_in_executor(_EXECUTOR, func, *args)
+    finally:
+        _record_latency(operation, time.monotonic() - start)
+
+
+def stats():
+    """Return cleanup queue depth and latency statistics.
+
+    ``pending`` counts submitted requests not yet completed, by type.
+    ``latency`` gives the end-to-end latency of completed requests by type
+    and the latency of individual kubernetes operations.
+    """
+    with _STATS_LOCK:
+        return {
+            "parallelism": _PARALLELISM,
+            "journaled": len(_JOURNAL),
+            "deletes": dict(_DELETE_STATS),
+            "pending": dict(_PENDING),
+            "latency": {name: lat.asdict() for name, lat in _LATENCIES.items()},
+        }
+
+
+def _delete(name, crd_api, workflow):
+    """Remove the finalizer from a workflow and delete it."""
+    with priority(Priority.TEARDOWN):
+        remove_finalizer(name, crd_api, workflow)
+        crd_api.delete_namespaced_custom_object(*crd.WORKFLOW_CRD, name)
+
+
+def _patch_mark_for_deletion(name, crd_api, workflow):
+    try:
+        workflow["metadata"]["finalizers"].remove(FINALIZER)
+    except ValueError:
+        pass
+    crd_api.patch_namespaced_custom_object(
+        *crd.WORKFLOW_CRD,
+        name,
+        {
+            "metadata": {
+                "labels": {DELETE_LABEL: "true"},
+                "finalizers": workflow["metadata"]["finalizers"],
+            }
+        },
+    )
+
+
+def _mark_for_deletion(name, crd_api, workflow):
+    """Label a workflow for collection deletion and remove the finalizer.
+
+    Both are done in a single patch. As with ``remove_finalizer``, an
+    outdated list of finalizers is refreshed and the patch tried again.
+    """
+    with priority(Priority.TEARDOWN):
+        try:
+            _patch_mark_for_deletion(name, crd_api, workflow)
+        except ApiException as exc:
+            if exc.status == 404:
+                raise
+            workflow = crd_api.get_namespaced_custom_object(*crd.WORKFLOW_CRD, name)
+            _patch_mark_for_deletion(name, crd_api, workflow)
+
+
+def _delete_collection(crd_api):
+    """Delete every workflow marked with DELETE_LABEL."""
+    with priority(Priority.TEARDOWN):
+        crd_api.delete_collection_namespaced_custom_object(
+            *crd.WORKFLOW_CRD, label_selector=f"{DELETE_LABEL}=true"
+        )
+
+
+async def _flush_delete_batch():
+    """Delete every marked workflow with one request and wake their waiters.
+
+    Waiters receive True if the collection delete succeeded and False if they
+    should delete their workflow individually.
+    """
+    await asyncio.sleep(_DELETE_BATCH_INTERVAL)
+    batch = list(_DELETE_BATCH)
+    _DELETE_BATCH.clear()
+    try:
+        await _run_blocking(
+            "k8s_delete_collection",
+            _delete_collection,
+            threading.current_thread().crd_api,
+        )
+    except Exception as exc:
+        LOGGER.warning(
+            "Failed to delete %i workflows as a collection, "
+            "deleting them individually. Error is %s",
+            len(batch),
+            exc,
+        )
+        succeeded = False
+    else:
+        succeeded = True
+    for fut in batch:
+        if not fut.done():
+            fut.set_result(succeeded)
+
+
+async def _batch_delete(name, crd_api, workflow):
+    """Mark a workflow for deletion and wait for the next collection delete.
+
+    Return True if the workflow was deleted (or was already gone), False if
+    it should be deleted individually instead.
+    """
+    try:
+        await _run_blocking(
+            "k8s_mark_for_deletion", _mark_for_deletion, name, crd_api, workflow
+        )
+    except ApiException as exc:
+        if exc.status == 404:
+            return True
+        LOGGER.debug("Failed to mark workflow %s for deletion: %s", name, exc)
+        return False
+    except Exception as exc:
+        LOGGER.debug("Failed to mark workflow %s for deletion: %s", name, exc)
+        return False
+    fut = CLEANUP_LOOP.create_future()
+    if not _DELETE_BATCH:
+        # first workflow of a new batch, so schedule the collection delete
+        CLEANUP_LOOP.create_task(_flush_delete_batch())
+    _DELETE_BATCH.append(fut)
+    return await fut
+
+
 async def delete_workflow_coro(workflow):
-    """Delete a workflow, retrying indefinitely (with backoff) upon error."""
+    """Delete a workflow, retrying indefinitely (with backoff) upon error.
+
+    Workflows are deleted in batches by label, unless batching is disabled
+    or the batch deletion fails, in which case they are deleted individually.
+    """
     crd_api = threading.current_thread().crd_api
     attempts = 0
     name = workflow["metadata"]["name"]
+    if _DELETE_BATCH_INTERVAL > 0:
+        if await _batch_delete(name, crd_api, workflow):
+            with _STATS_LOCK:
+                _DELETE_STATS["batched"] += 1
+            return
+        with _STATS_LOCK:
+            _DELETE_STATS["individual"] += 1
     # attempt to delete the workflow in a loop
     while True:
         try:
-            remove_finalizer(name, crd_api, workflow)
-            crd_api.delete_namespaced_custom_object(*crd.WORKFLOW_CRD, name)
+            await _run_blocking("k8s_delete", _delete, name, crd_api, workflow)
         except Exception as gen_exc:
             if isinstance(gen_exc, ApiException) and gen_exc.status == 404:
                 # workflow was not found, presume it was deleted already
@@ -110,31 +401,95 @@ async def delete_workflow_coro(workflow):
 
 def delete_workflow(workflow):
     """Submit a deletion request to the cleanup loop."""
-    asyncio.run_coroutine_threadsafe(
-        delete_workflow_coro(workflow), CLEANUP_LOOP
-    ).add_done_callback(log_error)
+    name = workflow["metadata"]["name"]
+    _journal_add(
+        name,
+        "delete",
+        lambda: _submit(
+            _journaled(name, "delete", delete_workflow_coro(workflow)), "delete"
+        ),
+    )
 
 
-def save_pod_log(workflow_name, jobid, core_api, handle):
-    """Save the logs for a pod associated with a workflow to the KVS.
+def tail_bytes(chunks, max_bytes, chunk_size=65536):
+    """Return the last ``max_bytes`` bytes of an iterable of byte strings.
+
+    At most ``max_bytes + chunk_size`` bytes are held in memory at once.
+    """
+    tail = bytearray()
+    for chunk in chunks:
+        tail += chunk
+        if len(tail) > max_bytes + chunk_size:
+            del tail[: len(tail) - max_bytes]
+    del tail[: max(0, len(tail) - max_bytes)]
+    return bytes(tail)
+
+
+def fetch_pod_log(workflow_name, core_api, limits):
+    """Return the tail of the logs for a pod associated with a workflow, or None.
 
     Not all jobs have a pod, only those with a `#DW container` directive.
+    Only the last ``limits.max_lines`` lines are requested, and the response
+    is streamed so that no more than the bytes to be saved are kept. If no
+    bytes are to be saved, nothing is fetched.
+    """
+    max_bytes = max(limits.max_bytes, limits.compressed_bytes)
+    if max_bytes == 0:
+        return None
+    with priority(Priority.BOOKKEEPING):
+        api_response = core_api.list_namespaced_pod(
+            "default",
+            limit=1,
+            label_selector=(
+                f"{crd.DWS_GROUP}/workflow.name={workflow_name},"
+                f"{crd.DWS_GROUP}/workflow.namespace=default"
+            ),
+        )
+        if not api_response.items:
+            return None
+        response = core_api.read_namespaced_pod_log(
+            api_response.items[0].metadata.name,
+            namespace="default",
+            tail_lines=limits.max_lines or None,
+            _preload_content=False,
+        )
+    try:
+        return tail_bytes(response.stream(65536), max_bytes)
+    finally:
+        response.release_conn()
+
+
+def save_pod_log(log, jobid, handle, limits):
+    """Save the log tail fetched by ``fetch_pod_log`` to the KVS.
+
+    The last ``limits.max_bytes`` bytes are stored as text under
+    ``rabbit_container_log``. If ``limits.compressed_bytes`` is larger, the
+    last ``limits.compressed_bytes`` bytes are also stored, zlib-compressed
+    and base64-encoded, under ``rabbit_container_log_zlib``.
     """
-    api_response = core_api.list_namespaced_pod(
-        "default",
-        limit=1,
-        label_selector=(
-            f"{crd.DWS_GROUP}/workflow.name={workflow_name},"
-            f"{crd.DWS_GROUP}/workflow.namespace=default"
-        ),
-    )
-    if not api_response.items:
-        return
-    log = core_api.read_namespaced_pod_log(
-        api_response.items[0].metadata.name, namespace="default"
-    )
     with flux.job.job_kvs(handle, jobid) as kvsdir:
-        kvsdir["rabbit_container_log"] = log[-50000:]
+        # log[-0:] would be the whole log
+        if limits.max_bytes > 0:
+            kvsdir["rabbit_container_log"] = log[-limits.max_bytes :].decode(
+                "utf-8", errors="replace"
+            )
+        if limits.compressed_bytes > limits.max_bytes:
+            kvsdir["rabbit_container_log_zlib"] = base64.b64encode(
+                zlib.compress(log[-limits.compressed_bytes :])
+            ).decode("ascii")
+
+
+def _patch_teardown(name, crd_api, finalizers):
+    """Move a workflow to Teardown, updating its finalizers."""
+    with priority(Priority.TEARDOWN):
+        crd_api.patch_namespaced_custom_object(
+            *crd.WORKFLOW_CRD,
+            name,
+            {
+                "spec": {"desiredState": flux_k8s.workflow.WorkflowState.TEARDOWN},
+                "metadata": {"finalizers": finalizers},
+            },
+        )
 
 
 async def teardown_workflow_coro(workflow):
@@ -148,23 +503,31 @@ async def teardown_workflow_coro(workflow):
         pass
     # attempt to teardown the workflow in a loop
     try:
-        save_pod_log(
+        log = await _run_blocking(
+            "k8s_pod_log",
+            fetch_pod_log,
             name,
-            flux.job.JobID(workflow["spec"]["jobID"]),
             threading.current_thread().core_api,
-            threading.current_thread().flux_handle,
+            _POD_LOG_LIMITS,
         )
+        if log is not None:
+            # the flux handle belongs to this thread, so write from here
+            save_pod_log(
+                log,
+                flux.job.JobID(workflow["spec"]["jobID"]),
+                threading.current_thread().flux_handle,
+                _POD_LOG_LIMITS,
+            )
     except Exception:
         LOGGER.exception("Failed to fetch pod logs for workflow %s", name)
     while True:
         try:
-            crd_api.patch_namespaced_custom_object(
-                *crd.WORKFLOW_CRD,
+            await _run_blocking(
+                "k8s_teardown",
+                _patch_teardown,
                 name,
-                {
-                    "spec": {"desiredState": flux_k8s.workflow.WorkflowState.TEARDOWN},
-                    "metadata": {"finalizers": workflow["metadata"]["finalizers"]},
-                },
+                crd_api,
+                workflow["metadata"]["finalizers"],
             )
         except Exception as gen_exc:
             if isinstance(gen_exc, ApiException) and gen_exc.status == 404:
@@ -185,26 +548,126 @@ async def teardown_workflow_coro(workflow):
 
 def teardown_workflow(workflow):
     """Submit a teardown request to the cleanup loop."""
-    asyncio.run_coroutine_threadsafe(
-        teardown_workflow_coro(workflow), CLEANUP_LOOP
-    ).add_done_callback(log_error)
+    name = workflow["metadata"]["name"]
+    _journal_add(
+        name,
+        "teardown",
+        lambda: _submit(
+            _journaled(name, "teardown", teardown_workflow_coro(workflow)), "teardown"
+        ),
+    )
+
+
+def _get_workflow(name, crd_api):
+    with priority(Priority.TEARDOWN):
+        return fastjson.get_namespaced(crd_api, crd.WORKFLOW_CRD, name)
+
+
+async def replay_coro(workflow_name, kind):
+    """Carry out a journaled request, fetching the current workflow first.
+
+    The journal does not store the workflow itself, since by the time
+    the request is replayed it may be stale.
+    """
+    crd_api = threading.current_thread().crd_api
+    attempts = 0
+    while True:
+        try:
+            workflow = await _run_blocking(
+                "k8s_get", _get_workflow, workflow_name, crd_api
+            )
+        except Exception as gen_exc:
+            if isinstance(gen_exc, ApiException) and gen_exc.status == 404:
+                # workflow is gone, so the request has nothing left to do
+                _journal_remove(workflow_name, kind)
+                return
+            attempts += 1
+            if attempts >= 5:
+                LOGGER.warning(
+                    "Failed to fetch workflow %s after %i attempts. Error is %s",
+                    workflow_name,
+                    attempts,
+                    gen_exc,
+                )
+            await asyncio.sleep(5 * 2 ** (attempts - 1))
+        else:
+            break
+    if kind == "delete":
+        coro = delete_workflow_coro(workflow)
+    else:
+        coro = teardown_workflow_coro(workflow)
+    await _journaled(workflow_name, kind, coro)
+
+
+def replay_journal(handle):
+    """Resubmit every request left in the KVS journal by a previous instance.
+
+    Replayed requests are idempotent: tearing down a workflow already in
+    teardown, or deleting a workflow that no longer exists, does nothing.
+    """
+    if not flux.kvs.exists(handle, JOURNAL_DIR):
+        return 0
+    journal = flux.kvs.get_dir(handle, JOURNAL_DIR)
+    count = 0
+    for workflow_name in journal:
+        kind = journal[workflow_name].get("type")
+        if kind not in ("delete", "teardown"):
+            LOGGER.warning(
+                "Ignoring journal entry %s for workflow %s", kind, workflow_name
+            )
+            continue
+        with _JOURNAL_LOCK:
+            if workflow_name in _JOURNAL:
+                continue  # already submitted again since startup
+            _JOURNAL[workflow_name] = kind
+        _submit(replay_coro(workflow_name, kind), kind)
+        count += 1
+    if count:
+        LOGGER.info("Replaying %i cleanup requests from the journal", count)
+    return count
 
 
 def cleanup_target(kubeconfig):
     """Run the asyncio event loop indefinitely."""
     curr_thread = threading.current_thread()
-    curr_thread.k8s_client = k8s.config.new_client_from_config(kubeconfig)
     curr_thread.crd_api = get_k8s_api(kubeconfig)
-    curr_thread.core_api = k8s.client.CoreV1Api(curr_thread.k8s_client)
+    curr_thread.core_api = client.get_factory(kubeconfig).core_v1_api()
     curr_thread.flux_handle = flux.Flux()
+    try:
+        replay_journal(curr_thread.flux_handle)
+    except Exception:
+        LOGGER.exception("Failed to replay the cleanup journal")
     try:
         CLEANUP_LOOP.run_forever()
     finally:
         CLEANUP_LOOP.close()
 
 
-def setup_cleanup_thread(kubeconfig):
-    """Start the thread that will run cleanup actions on workflows."""
+def setup_cleanup_thread(
+    handle,
+    kubeconfig,
+    parallelism=DEFAULT_PARALLELISM,
+    pod_log_limits=DEFAULT_POD_LOG_LIMITS,
+    delete_batch_interval=DEFAULT_DELETE_BATCH_INTERVAL,
+):
+    """Start the thread that will run cleanup actions on workflows.
+
+    Cleanup requests are submitted and journaled on the reactor thread,
+    whose Flux handle is ``handle``. At most ``parallelism`` blocking
+    kubernetes calls are made at once. Container logs saved during teardown
+    are bounded by ``pod_log_limits``, a ``config.PodLogLimits``. Workflows
+    are deleted in batches every ``delete_batch_interval`` seconds, or
+    individually if it is 0.
+    """
+    global _EXECUTOR, _PARALLELISM, _POD_LOG_LIMITS, _DELETE_BATCH_INTERVAL
+    global _JOURNAL_HANDLE
+    _JOURNAL_HANDLE = handle
+    _PARALLELISM = parallelism
+    _POD_LOG_LIMITS = pod_log_limits
+    _DELETE_BATCH_INTERVAL = delete_batch_interval
+    _EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+        max_workers=parallelism, thread_name_prefix="workflow_cleanup_worker"
+    )
     cleanup_thread = threading.Thread(
         target=cleanup_target,
         args=(kubeconfig,),
@@ -0,0 +1,329 @@
+"""Module defining a shared, tuned kubernetes API client.
+
+Every component of the coral2_dws service (the reactor thread, the cleanup
+thread, and anything else that talks to kubernetes) should get its API objects
+from the one ``ClientFactory`` so that they share a single urllib3 connection
+pool, rather than each paying for their own TLS handshakes.
+
+Requests made on the reactor thread, which must never block for long, are
+not retried and are given a short timeout; their errors go straight back to
+the caller. Requests made on other threads are retried with backoff.
+"""
+
+import logging
+import socket
+import threading
+import time
+import urllib.parse
+
+import kubernetes as k8s
+from kubernetes.client.rest import ApiException
+from urllib3.connection import HTTPConnection
+
+from flux_k8s import metrics, ratelimit, retry
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 16  # maximum number of pooled connections per host
+DEFAULT_REQUEST_TIMEOUT = 60.0  # seconds, applied to requests without a timeout
+DEFAULT_REACTOR_TIMEOUT = 5.0  # seconds, the longest requests on the reactor may take
+DEFAULT_KEEPALIVE = True  # whether to enable TCP keep-alive on pooled sockets
+DEFAULT_QPS = 50.0  # sustained kubernetes requests per second, 0 for unlimited
+DEFAULT_BURST = 100  # requests that may be issued at once before throttling
+DEFAULT_RETRIES = 3  # retries of transient failures, per request
+DEFAULT_FAILURE_THRESHOLD = 5  # consecutive failures that open the circuit breaker
+DEFAULT_BREAKER_TIMEOUT = 10.0  # seconds the circuit breaker first stays open
+
+_FACTORY = None
+_FACTORY_LOCK = threading.Lock()
+_REACTOR_THREAD = None  # the thread running the Flux reactor, if set
+
+
+def set_reactor_thread(thread=None):
+    """Mark ``thread`` (by default, the current one) as running the reactor.
+
+    Requests made on that thread are never retried and are given at most
+    the reactor timeout of the ``ClientFactory``.
+    """
+    global _REACTOR_THREAD
+    _REACTOR_THREAD = threading.current_thread() if thread is None else thread
+
+
+def on_reactor():
+    """Return True if the current thread runs the reactor."""
+    return _REACTOR_THREAD is not None and threading.current_thread() is _REACTOR_THREAD
+
+
+def _keepalive_socket_options():
+    """Return urllib3 socket options enabling TCP keep-alive."""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    for name, value in (
+        ("TCP_KEEPIDLE", 30),
+        ("TCP_KEEPINTVL", 10),
+        ("TCP_KEEPCNT", 6),
+    ):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def _resource_of(url):
+    """Return the kind of resource (e.g. ``workflows``) a request URL is for."""
+    parts = urllib.parse.urlsplit(url).path.strip("/").split("/")
+    if parts[0] == "api":
+        parts = parts[2:]  # api/<version>
+    elif parts[0] == "apis":
+        parts = parts[3:]  # apis/<group>/<version>
+    else:
+        return "other"
+    if len(parts) > 2 and parts[0] == "namespaces":
+        parts = parts[2:]
+    return parts[0] if parts and parts[0] else "other"
+
+
+class _RESTClientWrapper:
+    """Wrap a kubernetes RESTClientObject, applying a default request timeout.
+
+    If a ``ratelimit.PriorityLimiter`` is given, every request must first
+    acquire a token from it, at the priority of the calling context.
+    If a ``retry.RetryPolicy`` is given, transient failures are retried
+    according to it, and if a ``retry.CircuitBreaker`` is given, requests
+    are rejected without being sent while it is open.
+
+    Requests made on the reactor thread (see ``set_reactor_thread``) fail on
+    the first error, without sleeping, and time out after at most
+    ``reactor_timeout`` seconds. They also wait at most that long for a rate
+    limiter token, raising ``ratelimit.ThrottledError`` otherwise.
+
+    Every request is counted in ``metrics.K8S_REQUESTS``, and its latency
+    including retries is recorded in ``metrics.K8S_DURATION``.
+
+    All attributes other than ``request`` are passed through to the wrapped object.
+    """
+
+    def __init__(
+        self,
+        rest_client,
+        request_timeout,
+        limiter=None,
+        policy=None,
+        breaker=None,
+        reactor_timeout=DEFAULT_REACTOR_TIMEOUT,
+    ):
+        self._rest_client = rest_client
+        self._request_timeout = request_timeout
+        self._reactor_timeout = reactor_timeout
+        self._limiter = limiter
+        self._policy = policy
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        return getattr(self._rest_client, name)
+
+    def request(self, method, url, *args, **kwargs):
+        """Issue a request through the wrapped client, recording metrics."""
+        verb = method.lower()
+        resource = _resource_of(url)
+        start = time.monotonic()
+        status = 0  # no response received
+        try:
+            response = self._request(method, url, *args, **kwargs)
+            status = getattr(response, "status", 0)
+            return response
+        except ApiException as exc:
+            status = exc.status or 0
+            raise
+        finally:
+            metrics.K8S_REQUESTS.labels(verb, resource, status).inc()
+            metrics.K8S_DURATION.labels(verb, resource).observe(
+                time.monotonic() - start
+            )
+
+    def _request(self, method, url, *args, **kwargs):
+        if kwargs.get("_request_timeout") is None and self._request_timeout:
+            kwargs["_request_timeout"] = self._request_timeout
+        policy = self._policy
+        limiter_timeout = None
+        if on_reactor():
+            policy = None
+            limiter_timeout = self._reactor_timeout or None
+            timeout = kwargs.get("_request_timeout")
+            if self._reactor_timeout and (
+                not isinstance(timeout, (int, float)) or timeout > self._reactor_timeout
+            ):
+                kwargs["_request_timeout"] = self._reactor_timeout
+        attempt = 0
+        while True:
+            if self._limiter is not None:
+                self._limiter.acquire(timeout=limiter_timeout)
+            if self._breaker is not None:
+                self._breaker.before_request()
+            try:
+                response = self._rest_client.request(method, url, *args, **kwargs)
+            except Exception as exc:
+                if self._breaker is not None:
+                    self._breaker.record_failure(exc)
+                if policy is None or not policy.should_retry(method, exc, attempt):
+                    raise
+                delay = policy.delay(attempt)
+                attempt += 1
+                LOGGER.debug(
+                    "Retrying %s %s in %.2fs after error: %s", method, url, delay, exc
+                )
+                time.sleep(delay)
+            else:
+                if self._breaker is not None:
+                    self._breaker.record_success()
+                return response
+
+
+class ClientFactory:
+    """Build kubernetes API objects that share one tuned connection pool.
+
+    :param kubeconfig: path to a kubeconfig file, or None for the default
+    :param pool_size: maximum number of connections kept open per host
+    :param keepalive: whether to enable TCP keep-alive on pooled connections
+    :param request_timeout: default timeout in seconds for requests that
+        do not specify their own ``_request_timeout``
+    :param reactor_timeout: maximum timeout in seconds for requests made on
+        the reactor thread, which are never retried
+    :param qps: sustained requests per second allowed, or 0 for no limit
+    :param burst: number of requests that may be issued at once before
+        requests are throttled to ``qps``
+    :param retries: number of times to retry requests that fail transiently
+    :param failure_threshold: consecutive transient failures that open the
+        circuit breaker, or 0 to disable the breaker
+    :param breaker_timeout: seconds the circuit breaker stays open the
+        first time it opens, doubling each time its trial request fails
+    """
+
+    def __init__(
+        self,
+        kubeconfig=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        keepalive=DEFAULT_KEEPALIVE,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        reactor_timeout=DEFAULT_REACTOR_TIMEOUT,
+        qps=DEFAULT_QPS,
+        burst=DEFAULT_BURST,
+        retries=DEFAULT_RETRIES,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        breaker_timeout=DEFAULT_BREAKER_TIMEOUT,
+    ):
+        self.kubeconfig = kubeconfig
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.request_timeout = request_timeout
+        self.reactor_timeout = reactor_timeout
+        self.limiter = None
+        if qps > 0:
+            self.limiter = ratelimit.PriorityLimiter(qps, burst)
+        self.retry_policy = retry.RetryPolicy(retries)
+        self.breaker = None
+        if failure_threshold > 0:
+            self.breaker = retry.CircuitBreaker(failure_threshold, breaker_timeout)
+        self._api_client = None
+        self._apis = {}
+        self._lock = threading.Lock()
+
+    def _build_api_client(self):
+        """Load the kubeconfig and create the shared ApiClient."""
+        configuration = k8s.client.Configuration()
+        k8s.config.load_kube_config(
+            config_file=self.kubeconfig, client_configuration=configuration
+        )
+        configuration.connection_pool_maxsize = self.pool_size
+        if self.keepalive:
+            configuration.socket_options = _keepalive_socket_options()
+        api_client = k8s.client.ApiClient(configuration)
+        api_client.rest_client = _RESTClientWrapper(
+            api_client.rest_client,
+            self.request_timeout,
+            self.limiter,
+            self.retry_policy,
+            self.breaker,
+            self.reactor_timeout,
+        )
+        return api_client
+
+    @property
+    def api_client(self):
+        """Return the shared ApiClient, creating it if necessary."""
+        with self._lock:
+            if self._api_client is None:
+                self._api_client = self._build_api_client()
+            return self._api_client
+
+    def _get_api(self, api_class):
+        """Return the shared instance of ``api_class``."""
+        api_client = self.api_client
+        with self._lock:
+            if api_class not in self._apis:
+                self._apis[api_class] = api_class(api_client)
+            return self._apis[api_class]
+
+    def custom_objects_api(self):
+        """Return the shared CustomObjectsApi."""
+        return self._get_api(k8s.client.CustomObjectsApi)
+
+    def core_v1_api(self):
+        """Return the shared CoreV1Api."""
+        return self._get_api(k8s.client.CoreV1Api)
+
+    def pool_stats(self):
+        """Return connection reuse statistics for the shared pool.
+
+        ``connections`` is the number of connections (and therefore TLS
+        handshakes) opened, ``requests`` the number of requests issued over them.
+        """
+        stats = {"pools": 0, "connections": 0, "requests": 0, "reuse_ratio": 0.0}
+        with self._lock:
+            if self._api_client is None:
+                return stats
+            pools = self._api_client.rest_client.pool_manager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["pools"] += 1
+            stats["connections"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+        if stats["requests"]:
+            stats["reuse_ratio"] = 1 - stats["connections"] / stats["requests"]
+        return stats
+
+    def breaker_stats(self):
+        """Return circuit breaker statistics."""
+        if self.breaker is None:
+            return {"state": retry.BreakerState.CLOSED.value}
+        return self.breaker.stats()
+
+    def limiter_stats(self):
+        """Return rate limiter and read coalescing statistics."""
+        stats = {"coalesced_reads": ratelimit.COALESCER.coalesced}
+        if self.limiter is not None:
+            stats.update(self.limiter.stats())
+        return stats
+
+
+def configure(kubeconfig=None, **kwargs):
+    """Create the process-wide ClientFactory.
+
+    Keyword arguments are passed to ``ClientFactory``. Must be called before
+    ``get_factory`` for the arguments to take effect.
+    """
+    global _FACTORY
+    with _FACTORY_LOCK:
+        _FACTORY = ClientFactory(kubeconfig, **kwargs)
+        return _FACTORY
+
+
+def get_factory(kubeconfig=None):
+    """Return the process-wide ClientFactory, creating a default one if needed."""
+    global _FACTORY
+    with _FACTORY_LOCK:
+        if _FACTORY is None:
+            _FACTORY = ClientFactory(kubeconfig)
+        return _FACTORY
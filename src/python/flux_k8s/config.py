@@ -0,0 +1,379 @@
+"""Module defining snapshots of the Flux configuration used by coral2_dws.
+
+Rather than look up the `rabbit` config table on every RPC and watch event,
+the service builds a ``ConfigSnapshot`` at startup, with keys read on hot paths
+validated and stored as typed attributes, presets precompiled into lists of
+individual #DW directives, and the instance owner resolved. The snapshot is
+replaced, never modified, when the Flux config is reloaded: a
+``ConfigWatcher`` polls the broker's config and also reloads it on request
+through the ``dws.config_reload`` RPC. Each snapshot has a generation number,
+incremented on every reload, and memoizes the expansion of #DW strings.
+"""
+
+import collections
+import logging
+import os
+
+from flux.constants import FLUX_MSGTYPE_REQUEST
+from flux_k8s import directivebreakdown
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 60.0  # seconds between checks for a changed config
+_MAX_EXPANSIONS = 1024  # distinct #DW strings memoized per snapshot
+# workflow states whose number of workflows may be limited
+LIMITED_STATES = ("DataIn", "PreRun", "DataOut")
+# maps keys still honored, but deprecated, to the keys replacing them
+DEPRECATED_KEYS = {"restrict_persistent": "restrict_persistent_creation"}
+
+# limits on the container logs saved to the KVS
+PodLogLimits = collections.namedtuple(
+    "PodLogLimits", ["max_bytes", "max_lines", "compressed_bytes"]
+)
+DEFAULT_POD_LOG_LIMITS = PodLogLimits(
+    max_bytes=50000,  # bytes of log tail stored as text, 0 to disable
+    max_lines=10000,  # lines of log tail requested from kubernetes, 0 for all
+    compressed_bytes=0,  # bytes of log tail stored compressed, 0 to disable
+)
+
+_CURRENT = None  # the current ConfigSnapshot
+
+
+def split_directives(directives):
+    """Split a string that may hold several #DW directives into a list of them."""
+    return ["#DW " + dw.strip() for dw in directives.split("#DW ") if dw.strip()]
+
+
+def compile_presets(presets):
+    """Return a copy of the `rabbit.presets` table with strings pre-split.
+
+    Each preset becomes a list of individual #DW directives. Presets that are
+    neither lists nor strings are left alone, so that using one is an error.
+    """
+    compiled = {}
+    for name, preset in presets.items():
+        if isinstance(preset, str):
+            compiled[name] = split_directives(preset)
+        else:
+            if not isinstance(preset, list):
+                LOGGER.warning(
+                    "misconfiguration: `rabbit.presets.%s` must be list or str", name
+                )
+            compiled[name] = preset
+    return compiled
+
+
+def expand_directive(directive, presets):
+    """Expand a directive string into a list of one or more individual directives.
+
+    Check if the string is one of the presets, and if so replace it.
+    """
+    if directive.strip() in presets:
+        preset = presets[directive.strip()]
+        if isinstance(preset, list):
+            # if a preset is a list, the entries must be individual #DW strings
+            return preset
+        if not isinstance(preset, str):
+            raise TypeError(
+                f"presets must be list or str but preset {directive} is {type(preset)}"
+            )
+        directive = preset
+    # the string may contain multiple #DW directives
+    return split_directives(directive)
+
+
+def validate_config(rabbit):
+    """Warn of unrecognized keys in the `rabbit` config table."""
+    accepted_keys = {
+        "save_datamovements",
+        "kubeconfig",
+        "tc_timeout",
+        "drain_compute_nodes",
+        "restrict_persistent_creation",
+        "policy",
+        "presets",
+        "mapping",
+        "soft_drain",
+        "setup_timeout",
+        "prerun_timeout",
+        "postrun_timeout",
+        "teardown_after",
+        "prolog_timeout",
+        "k8s_pool_size",
+        "k8s_keepalive",
+        "k8s_request_timeout",
+        "k8s_reactor_timeout",
+        "k8s_qps",
+        "k8s_burst",
+        "k8s_retries",
+        "k8s_failure_threshold",
+        "cleanup_parallelism",
+        "reconcile_interval",
+        "reconcile_page_size",
+        "reconcile_grace",
+        "container_log_max_bytes",
+        "container_log_max_lines",
+        "container_log_compressed_bytes",
+        "delete_batch_interval",
+        "watch_stats_interval",
+        "metrics_textfile",
+        "metrics_textfile_interval",
+        "config_poll_interval",
+        "user_cache_ttl",
+        "workflow_info_ttl",
+        "transition_limits",
+        "workflow_workers",
+        "standby_poll_interval",
+    }
+    keys = set(rabbit.keys())
+    for key in keys & DEPRECATED_KEYS.keys():
+        LOGGER.warning(
+            "`rabbit.%s` is deprecated, use `rabbit.%s` instead",
+            key,
+            DEPRECATED_KEYS[key],
+        )
+    keys -= DEPRECATED_KEYS.keys()
+    if not keys <= accepted_keys:
+        LOGGER.warning(
+            "misconfiguration: unrecognized `rabbit.%s` key in Flux config, "
+            "accepted keys are %s",
+            (keys - accepted_keys).pop(),
+            accepted_keys,
+        )
+    if "policy" in rabbit:
+        if len(rabbit["policy"]) != 1 or "maximums" not in rabbit["policy"]:
+            LOGGER.warning("`rabbit.policy` config table muxt have a `maximums` table")
+        keys = set(rabbit["policy"]["maximums"].keys())
+        accepted_keys = set(directivebreakdown.ResourceLimits.TYPES)
+        if not keys <= accepted_keys:
+            LOGGER.warning(
+                "misconfiguration: unrecognized `rabbit.policy.maximums.%s` key in "
+                "Flux config, accepted keys are %s",
+                (keys - accepted_keys).pop(),
+                accepted_keys,
+            )
+
+
+def _typed(rabbit, key, kind, default):
+    """Return `rabbit.key` checked against ``kind``, or ``default`` if unset.
+
+    Integers are accepted for floats, but booleans never count as numbers.
+    Numbers must not be negative. Raise ValueError otherwise.
+    """
+    value = rabbit.get(key, default)
+    if kind is bool:
+        valid = isinstance(value, bool)
+    else:
+        valid = (
+            isinstance(value, (int, float) if kind is float else int)
+            and not isinstance(value, bool)
+            and value >= 0
+        )
+    if not valid:
+        raise ValueError(
+            f"`rabbit.{key}` must be a {'' if kind is bool else 'non-negative '}"
+            f"{kind.__name__}, got {value!r}"
+        )
+    return kind(value)
+
+
+def _limits(rabbit):
+    """Return the `rabbit.transition_limits` table, checked.
+
+    Raise ValueError unless it maps states that may be limited to
+    non-negative integers.
+    """
+    limits = rabbit.get("transition_limits", {})
+    if not isinstance(limits, dict):
+        raise ValueError(f"`rabbit.transition_limits` must be a table, got {limits!r}")
+    for state, limit in limits.items():
+        if state not in LIMITED_STATES:
+            raise ValueError(
+                f"`rabbit.transition_limits.{state}` is not one of {LIMITED_STATES}"
+            )
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+            raise ValueError(
+                f"`rabbit.transition_limits.{state}` must be a non-negative int, "
+                f"got {limit!r}"
+            )
+    return dict(limits)
+
+
+def owner_uid(handle):
+    """Get instance owner UID"""
+    try:
+        return int(handle.attr_get("security.owner"))
+    except Exception:
+        return os.getuid()
+
+
+class ConfigSnapshot:
+    """An immutable view of the configuration, taken at one point in time.
+
+    Keys read while handling RPCs and watch events are validated and stored
+    as typed attributes, so that they need not be looked up on every event.
+
+    :param config: the whole Flux config, as returned by ``config.get``
+    :param owner: UID of the instance owner
+    :param generation: number of the snapshot, incremented on every reload
+
+    :raises ValueError: if a key has the wrong type
+    """
+
+    def __init__(self, config, owner, generation=1):
+        rabbit = config.get("rabbit", {})
+        validate_config(rabbit)
+        self.raw = config
+        self.generation = generation
+        self.owner_uid = owner
+        # `restrict_persistent` was read before the documented key was honored,
+        # so it is still accepted, with a deprecation warning
+        self.restrict_persistent = _typed(
+            rabbit,
+            "restrict_persistent_creation",
+            bool,
+            rabbit.get("restrict_persistent", True),
+        )
+        self.drain_compute_nodes = _typed(rabbit, "drain_compute_nodes", bool, True)
+        self.soft_drain = _typed(rabbit, "soft_drain", bool, True)
+        self.setup_timeout = _typed(rabbit, "setup_timeout", float, 0.0)
+        self.prerun_timeout = _typed(rabbit, "prerun_timeout", float, 0.0)
+        self.postrun_timeout = _typed(rabbit, "postrun_timeout", float, 0.0)
+        self.teardown_after = _typed(rabbit, "teardown_after", float, 0.0)
+        self.tc_timeout = _typed(rabbit, "tc_timeout", float, 10.0)
+        self.save_datamovements = _typed(rabbit, "save_datamovements", int, 0)
+        self.workflow_info_ttl = _typed(rabbit, "workflow_info_ttl", float, 3600.0)
+        self.transition_limits = _limits(rabbit)
+        self.pod_log_limits = PodLogLimits(
+            *(
+                _typed(rabbit, f"container_log_{field}", int, default)
+                for field, default in zip(PodLogLimits._fields, DEFAULT_POD_LOG_LIMITS)
+            )
+        )
+        self.presets = compile_presets(rabbit.get("presets", {}))
+        self._expansions = {}  # maps #DW strings to tuples of directives
+
+    def expand(self, directive):
+        """Return ``expand_directive(directive, self.presets)``, memoized.
+
+        The result is returned as a tuple, since it is shared between calls.
+        """
+        try:
+            return self._expansions[directive]
+        except KeyError:
+            pass
+        expanded = tuple(expand_directive(directive, self.presets))
+        if len(self._expansions) >= _MAX_EXPANSIONS:
+            self._expansions.clear()
+        self._expansions[directive] = expanded
+        return expanded
+
+
+def current():
+    """Return the current ConfigSnapshot."""
+    if _CURRENT is None:
+        raise RuntimeError("config has not been loaded")
+    return _CURRENT
+
+
+def load(handle, config=None):
+    """Build a new snapshot from ``config`` (by default, fetch it) and return it.
+
+    The new snapshot replaces the current one.
+    """
+    global _CURRENT
+    if config is None:
+        config = handle.conf_get(update=True)
+    if _CURRENT is None:
+        snapshot = ConfigSnapshot(config, owner_uid(handle))
+    else:
+        snapshot = ConfigSnapshot(config, _CURRENT.owner_uid, _CURRENT.generation + 1)
+    _CURRENT = snapshot
+    return snapshot
+
+
+class ConfigWatcher:
+    """Reload the config snapshot when the Flux config changes.
+
+    Flux does not notify clients other than broker modules of config
+    reloads, so poll the broker's config every ``interval`` seconds (never,
+    if 0), and reload it immediately on a ``dws.config_reload`` RPC.
+
+    :param handle: Flux handle
+    :param interval: seconds between polls of the broker's config
+    :param on_reload: callable taking the new snapshot, called on every reload
+    """
+
+    def __init__(self, handle, interval=DEFAULT_POLL_INTERVAL, on_reload=None):
+        self.handle = handle
+        self.interval = interval
+        self.on_reload = on_reload
+        self._timer = None
+        self._msg_watcher = None
+
+    def start(self):
+        """Begin polling and serving the ``dws.config_reload`` RPC."""
+        if self.interval > 0:
+            self._timer = self.handle.timer_watcher_create(
+                self.interval, self._poll_cb, repeat=self.interval
+            ).start()
+        self._msg_watcher = self.handle.msg_watcher_create(
+            self._reload_cb, FLUX_MSGTYPE_REQUEST, "dws.config_reload"
+        ).start()
+        return self
+
+    def stop(self):
+        """Stop polling and serving RPCs."""
+        for watcher in (self._timer, self._msg_watcher):
+            if watcher is not None:
+                watcher.stop()
+        self._timer = self._msg_watcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _reload(self, config):
+        snapshot = load(self.handle, config)
+        LOGGER.info("Loaded config generation %i", snapshot.generation)
+        if self.on_reload is not None:
+            self.on_reload(snapshot)
+        return snapshot
+
+    def _poll_cb(self, _reactor, _watcher, _r, _args):
+        self.handle.rpc("config.get").then(self._config_cb)
+
+    def _config_cb(self, future):
+        try:
+            config = future.get()
+        except OSError as exc:
+            LOGGER.warning("Failed to fetch Flux config: %s", exc)
+            return
+        if config == current().raw:
+            return
+        try:
+            self._reload(config)
+        except ValueError as exc:
+            LOGGER.error(
+                "Keeping config generation %i, new config is invalid: %s",
+                current().generation,
+                exc,
+            )
+
+    def _reload_cb(self, handle, _t, msg, _arg):
+        handle.rpc("config.get").then(self._reload_config_cb, msg)
+
+    def _reload_config_cb(self, future, msg):
+        """Reload the fetched config and respond to a ``dws.config_reload`` RPC."""
+        try:
+            snapshot = self._reload(future.get())
+        except Exception as exc:
+            self.handle.respond(msg, {"success": False, "errstr": repr(exc)})
+            LOGGER.exception("Error in responding to dws.config_reload RPC:")
+        else:
+            self.handle.respond(
+                msg, {"success": True, "generation": snapshot.generation}
+            )
@@ -0,0 +1,119 @@
+"""Module defining fast JSON decoding of raw kubernetes responses.
+
+The kubernetes client deserializes every response through its generic path.
+For custom objects the result is always plain JSON, so the response can be
+fetched raw (``_preload_content=False``) and decoded directly, using ``orjson``
+if it is available and the standard library otherwise.
+"""
+
+import json
+import logging
+
+from kubernetes.watch.watch import iter_resp_lines
+
+from flux_k8s import client, ratelimit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+if orjson is not None:
+    BACKEND = "orjson"
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+    loads = json.loads
+
+# whether to fetch raw responses and decode them here; may be disabled
+# to fall back to the kubernetes client's own deserialization
+ENABLED = True
+
+
+# API methods whose concurrent duplicates may be coalesced. Single-object
+# reads are not: callers read objects back after writing to them, and a read
+# that joined one already in flight could return the object as it was before
+# the write.
+_COALESCED_PREFIXES = ("list_",)
+
+
+def _fetch_raw(api_method, args, kwargs):
+    """Call ``api_method`` and return the raw body of the response."""
+    response = api_method(*args, _preload_content=False, **kwargs)
+    try:
+        return response.data
+    finally:
+        response.release_conn()
+
+
+def call(api_method, *args, **kwargs):
+    """Call a kubernetes API method, decoding the response with ``loads``.
+
+    ``api_method`` should be a bound method of a kubernetes API object
+    that returns a JSON object, e.g. ``CustomObjectsApi.get_namespaced_custom_object``.
+
+    Identical list requests issued concurrently (e.g. from different threads)
+    are coalesced into a single request, so a list may reflect the state of
+    the API server from shortly before the call was made. Single-object reads
+    (``get_*`` and ``read_*``) are always sent, and so observe every write
+    the caller completed before making them. Lists made on the reactor thread
+    are also always sent, since the reactor must not wait on a request issued
+    by another thread, which is retried and not bound by the reactor timeout.
+    Every caller decodes its own copy of the response, so callers may freely
+    modify the objects returned.
+    """
+    if not ENABLED:
+        return api_method(*args, **kwargs)
+    if (
+        api_method.__name__.startswith(_COALESCED_PREFIXES)
+        and not kwargs.get("watch")
+        and not client.on_reactor()
+    ):
+        key = (
+            id(api_method.__self__),
+            api_method.__name__,
+            repr(args),
+            repr(sorted(kwargs.items())),
+        )
+        data = ratelimit.COALESCER.run(key, _fetch_raw, api_method, args, kwargs)
+    else:
+        data = _fetch_raw(api_method, args, kwargs)
+    return loads(data)
+
+
+def list_namespaced(k8s_api, crd, **kwargs):
+    """List the namespaced custom objects described by a ``crd.CRD``."""
+    return call(k8s_api.list_namespaced_custom_object, *crd, **kwargs)
+
+
+def list_cluster(k8s_api, crd, **kwargs):
+    """List the custom objects described by a ``crd.CRD`` across namespaces."""
+    return call(
+        k8s_api.list_cluster_custom_object,
+        group=crd.group,
+        version=crd.version,
+        plural=crd.plural,
+        **kwargs,
+    )
+
+
+def get_namespaced(k8s_api, crd, name):
+    """Get a single namespaced custom object described by a ``crd.CRD``."""
+    return call(k8s_api.get_namespaced_custom_object, *crd, name)
+
+
+def stream_events(response):
+    """Yield decoded watch events from a raw streaming response.
+
+    Each line of a watch response is a complete JSON event.
+    """
+    try:
+        for line in iter_resp_lines(response):
+            if line:
+                yield loads(line)
+    finally:
+        response.close()
+        response.release_conn()
@@ -0,0 +1,185 @@
+"""Module defining an executor that orders work per key, e.g. per workflow.
+
+Workflow events and RPCs are handled on the single reactor thread, so a
+blocking k8s request made while handling one workflow holds up every other.
+A ``KeyedExecutor`` runs such requests on a thread pool instead, in parallel
+for different keys (jobids) but one at a time, in order, for the same key.
+The result of each request is committed back on the reactor, which is the
+only thread that may use the Flux handle or modify per-workflow state.
+
+Reactor work for a key that arrives while a request for the key is still in
+progress, such as the next event of the workflow, is held and run once the
+request has been committed. Each workflow is therefore handled exactly as
+though every request had been made synchronously, in the same order.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import queue
+
+from flux.constants import FLUX_POLLIN
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8  # threads making requests for different keys at once
+
+
+def _wakeup_cb(_handle, _watcher, fd, _revents, executor):
+    """Drain the wakeup pipe and commit the results of finished requests."""
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+    executor.process()
+
+
+class KeyedExecutor:
+    """Run blocking work on a thread pool, in order per key.
+
+    Until ``start`` is called (or if it is called with no workers), work is
+    done synchronously on the calling thread, with the same ordering.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._workers = 0
+        self._done = queue.SimpleQueue()  # (key, future, commit) of finished work
+        # maps keys with work in progress to the tasks waiting behind it, as
+        # (work, func) pairs: reactor-only tasks have no work
+        self._waiting = {}
+        self._read_fd = self._write_fd = None
+        self._fd_watcher = None
+        self.submitted = 0  # tasks run on the pool
+        self.held = 0  # tasks which had to wait for work on their key
+
+    def start(self, handle, workers=DEFAULT_WORKERS):
+        """Begin running work on ``workers`` threads, if any."""
+        if workers <= 0:
+            return self
+        self._workers = workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="keyed-worker"
+        )
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self._fd_watcher = handle.fd_watcher_create(
+            self._read_fd, _wakeup_cb, events=FLUX_POLLIN, args=self
+        ).start()
+        return self
+
+    def stop(self):
+        """Stop running work on the thread pool; work in progress is dropped."""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._fd_watcher.stop()
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self._pool = self._fd_watcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def busy(self, key):
+        """Return True if work for ``key`` is in progress."""
+        return key in self._waiting
+
+    def run(self, key, func, *args):
+        """Call ``func(*args)`` on this thread once earlier work for ``key`` is done.
+
+        If no work for ``key`` is in progress, ``func`` is called at once.
+        """
+        if key in self._waiting:
+            self.held += 1
+            self._waiting[key].append((None, lambda: func(*args)))
+        else:
+            func(*args)
+
+    def submit(self, key, work, commit):
+        """Call ``work()`` on a worker thread, then ``commit(future)`` on this one.
+
+        ``work`` must not use the Flux handle. ``commit`` is passed a
+        ``concurrent.futures.Future`` holding the result of ``work``.
+        """
+        if key in self._waiting:
+            self.held += 1
+            self._waiting[key].append((work, commit))
+        else:
+            self._waiting[key] = collections.deque()
+            self._dispatch(key, work, commit)
+
+    def _dispatch(self, key, work, commit):
+        if self._pool is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(work())
+            except Exception as exc:
+                future.set_exception(exc)
+            self._commit(key, future, commit)
+            return
+        self.submitted += 1
+        self._pool.submit(work).add_done_callback(
+            lambda future: self._finished(key, future, commit)
+        )
+
+    def _finished(self, key, future, commit):
+        """Queue a finished request and wake the reactor; called from workers."""
+        if self._pool is None:
+            return  # the executor was stopped
+        self._done.put((key, future, commit))
+        try:
+            os.write(self._write_fd, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full, so the reactor will wake anyway
+
+    def process(self):
+        """Commit the results of every finished request."""
+        while True:
+            try:
+                key, future, commit = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._commit(key, future, commit)
+
+    def _commit(self, key, future, commit):
+        try:
+            commit(future)
+        except Exception:
+            LOGGER.exception("Failed to commit work for %s", key)
+        self._resume(key)
+
+    def _resume(self, key):
+        """Run the tasks held for ``key`` until one needs a worker."""
+        waiting = self._waiting.pop(key)
+        while waiting:
+            work, func = waiting.popleft()
+            if work is not None:
+                self._waiting[key] = waiting
+                self._dispatch(key, work, func)
+                return
+            try:
+                func()
+            except Exception:
+                LOGGER.exception("Failed to run held work for %s", key)
+            if key in self._waiting:
+                # func submitted work; what was held must wait behind it
+                self._waiting[key].extend(waiting)
+                return
+
+    def stats(self):
+        """Return the number of keys with work in progress and of held tasks."""
+        return {
+            "workers": self._workers if self._pool is not None else 0,
+            "busy_keys": len(self._waiting),
+            "waiting": sum(len(waiting) for waiting in self._waiting.values()),
+            "submitted": self.submitted,
+            "held": self.held,
+        }
@@ -0,0 +1,540 @@
+"""Module defining lightweight metrics for the coral2_dws service.
+
+The metrics here are cheap enough to update on every kubernetes event and
+are reported as plain dictionaries, suitable for RPC responses and logs.
+
+The service-wide metrics at the bottom of the module are collected in
+``REGISTRY``, which renders them in the Prometheus text exposition format
+for the ``dws.metrics`` RPC and the optional textfile collector.
+"""
+
+import bisect
+import collections
+import datetime
+import os
+import re
+import tempfile
+import threading
+import time
+
+
+# default histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Count observations in buckets, tracking their sum and maximum.
+
+    :param buckets: increasing upper bounds of the buckets; observations
+        above the last bound are counted in an overflow bucket
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record an observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    @property
+    def count(self):
+        with self._lock:
+            return sum(self._counts)
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket holding the given quantile.
+
+        Return ``inf`` if the quantile falls in the overflow bucket, and 0.0
+        if there are no observations.
+        """
+        with self._lock:
+            counts = list(self._counts)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = fraction * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        """Return a dictionary describing the histogram."""
+        with self._lock:
+            counts = list(self._counts)
+            total, max_value = self._sum, self._max
+        count = sum(counts)
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = count
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+            "max": max_value,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class RateCounter:
+    """Count events, and their rate over a sliding window.
+
+    :param window: length of the window in seconds
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self.total = 0
+        self._seconds = collections.deque()  # (second, count) pairs
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._seconds and self._seconds[0][0] <= now - self.window:
+            self._seconds.popleft()
+
+    def add(self, count=1):
+        """Record ``count`` events."""
+        now = int(time.monotonic())
+        with self._lock:
+            self.total += count
+            if self._seconds and self._seconds[-1][0] == now:
+                self._seconds[-1][1] += count
+            else:
+                self._seconds.append([now, count])
+            self._expire(now)
+
+    def rate(self):
+        """Return the average number of events per second over the window."""
+        with self._lock:
+            self._expire(int(time.monotonic()))
+            return sum(count for _, count in self._seconds) / self.window
+
+
+def parse_timestamp(timestamp):
+    """Return a k8s RFC 3339 timestamp in seconds since the epoch.
+
+    Both whole-second (``2026-01-01T00:00:00Z``) and fractional-second
+    (``2026-01-01T00:00:00.123456Z``) timestamps are accepted.
+    """
+    timestamp = timestamp.rstrip("Z")
+    if "." in timestamp:
+        timestamp, fraction = timestamp.split(".", 1)
+        fraction = float("0." + fraction)
+    else:
+        fraction = 0.0
+    parsed = datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp() + fraction
+
+
+_DURATION_UNITS = {
+    "ns": 1e-9,
+    "us": 1e-6,
+    "µs": 1e-6,
+    "ms": 1e-3,
+    "s": 1.0,
+    "m": 60.0,
+    "h": 3600.0,
+}
+_DURATION_RE = re.compile(r"([0-9]*\.?[0-9]+)(ns|us|µs|ms|s|m|h)")
+
+
+def parse_duration(duration):
+    """Return a Go duration string such as ``1m2.5s`` in seconds.
+
+    Raise ValueError if the string is not a valid duration.
+    """
+    matches = list(_DURATION_RE.finditer(duration))
+    if not matches or "".join(match.group(0) for match in matches) != duration:
+        raise ValueError(f"invalid duration {duration!r}")
+    return sum(
+        float(match.group(1)) * _DURATION_UNITS[match.group(2)] for match in matches
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""),
+        )
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+class _Value:
+    """A number that may be incremented or set from any thread."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = float(value)
+
+    def get(self):
+        with self._lock:
+            return self._value
+
+
+class Metric:
+    """Base class of a family of metrics sharing a name and label names.
+
+    The individual metrics of the family are returned by ``labels``, one per
+    distinct combination of label values. A family without label names has
+    a single metric, whose methods may also be called on the family itself.
+
+    :param name: metric name, e.g. ``dws_rpc_requests_total``
+    :param documentation: one-line description of the metric
+    :param labelnames: names of the labels distinguishing the metrics
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Return the metric of this family with the given label values."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {values}"
+            )
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def samples(self):
+        """Yield ``(name, labels, value)`` for every sample of the family."""
+        for key, child in self._items():
+            yield self.name, tuple(zip(self.labelnames, key)), child.get()
+
+    def expose(self):
+        """Return the family in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A family of monotonically increasing counts."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        """Increment the unlabeled counter."""
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A family of values that may go up and down.
+
+    Instead of being set, a gauge may be given a ``function`` called at
+    exposition time, which returns a mapping from tuples of label values
+    to the values of the gauge.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        """Set the unlabeled gauge."""
+        self.labels().set(value)
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+        try:
+            values = self.function()
+        except Exception:
+            return
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class LabeledHistogram(Metric):
+    """A family of ``Histogram`` instances.
+
+    :param buckets: increasing upper bounds of the buckets of every histogram
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return Histogram(self.buckets)
+
+    def observe(self, value):
+        """Record an observation in the unlabeled histogram."""
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in self._items():
+            labels = tuple(zip(self.labelnames, key))
+            snapshot = child.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                yield self.name + "_bucket", labels + (("le", bound),), count
+            yield self.name + "_sum", labels, snapshot["sum"]
+            yield self.name + "_count", labels, snapshot["count"]
+
+
+class Registry:
+    """A collection of metric families, exposed together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric family to the registry and return it."""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return "".join(metric.expose() for _, metric in metrics)
+
+    def write_textfile(self, path):
+        """Atomically write all metrics to ``path``.
+
+        The file is suitable for the textfile collector of the Prometheus
+        node exporter, which requires a ``.prom`` suffix.
+        """
+        directory, basename = os.path.split(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{basename}.", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                tmp.write(self.expose())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+REGISTRY = Registry()
+
+# seconds an RPC callback or kubernetes request takes
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# seconds a workflow spends in a state
+STATE_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+RPC_REQUESTS = REGISTRY.register(
+    Counter("dws_rpc_requests_total", "RPC requests handled, by topic.", ["topic"])
+)
+RPC_ERRORS = REGISTRY.register(
+    Counter("dws_rpc_errors_total", "RPC requests answered with an error.", ["topic"])
+)
+RPC_DURATION = REGISTRY.register(
+    LabeledHistogram(
+        "dws_rpc_duration_seconds",
+        "Time spent in RPC callbacks, by topic.",
+        ["topic"],
+        LATENCY_BUCKETS,
+    )
+)
+K8S_REQUESTS = REGISTRY.register(
+    Counter(
+        "dws_k8s_requests_total",
+        "Kubernetes API requests, by verb, resource, and HTTP status "
+        "(0 if no response was received).",
+        ["verb", "resource", "status"],
+    )
+)
+K8S_DURATION = REGISTRY.register(
+    LabeledHistogram(
+        "dws_k8s_request_duration_seconds",
+        "Kubernetes API request latency, including retries, by verb and resource.",
+        ["verb", "resource"],
+        LATENCY_BUCKETS,
+    )
+)
+WORKFLOW_STATE_DURATION = REGISTRY.register(
+    LabeledHistogram(
+        "dws_workflow_state_duration_seconds",
+        "Time workflows took to complete each state, as reported by DWS.",
+        ["state"],
+        STATE_BUCKETS,
+    )
+)
+TRANSIENT_CONDITIONS = REGISTRY.register(
+    Counter(
+        "dws_transient_conditions_total",
+        "Workflows entering TransientCondition, by state.",
+        ["state"],
+    )
+)
+TRANSIENT_CONDITION_TIMEOUTS = REGISTRY.register(
+    Counter(
+        "dws_transient_condition_timeouts_total",
+        "Workflows left in TransientCondition longer than tc_timeout.",
+    )
+)
+DRAINS = REGISTRY.register(
+    Counter(
+        "dws_drains_total",
+        "resource.drain requests issued, by reason.",
+        ["reason"],
+    )
+)
+DRAINED_NODES = REGISTRY.register(
+    Counter(
+        "dws_drained_nodes_total",
+        "Nodes included in resource.drain requests, by reason.",
+        ["reason"],
+    )
+)
+CLEANUP_PENDING = REGISTRY.register(
+    Gauge(
+        "dws_cleanup_pending",
+        "Cleanup requests submitted but not yet completed, by type.",
+        ["type"],
+    )
+)
+USER_LOOKUPS = REGISTRY.register(
+    Counter(
+        "dws_user_lookups_total",
+        "Lookups of users' primary groups, by result (hit, stale, or miss).",
+        ["result"],
+    )
+)
+TOKEN_FETCHES = REGISTRY.register(
+    Counter(
+        "dws_token_fetches_total",
+        "Workflow tokens needed at PreRun completion, by whether they had been "
+        "prefetched, were still being prefetched (pending) and so were read "
+        "again, or had to be read.",
+        ["result"],
+    )
+)
+WORKFLOW_REGISTRY_ENTRIES = REGISTRY.register(
+    Gauge(
+        "dws_workflow_registry_entries",
+        "WorkflowInfo objects held by the service.",
+    )
+)
+WORKFLOW_REGISTRY_BYTES = REGISTRY.register(
+    Gauge(
+        "dws_workflow_registry_bytes",
+        "Approximate memory used by WorkflowInfo objects.",
+    )
+)
+TRANSITION_DURATION = REGISTRY.register(
+    LabeledHistogram(
+        "dws_transition_duration_seconds",
+        "Time taken by the service to act on the completion of each state.",
+        ["state"],
+        LATENCY_BUCKETS,
+    )
+)
+TRANSITIONS_HELD = REGISTRY.register(
+    Counter(
+        "dws_transitions_held_total",
+        "Transitions held because the target state was at its limit, by target.",
+        ["state"],
+    )
+)
+RECONCILE_SWEEPS = REGISTRY.register(
+    Counter(
+        "dws_reconcile_sweeps_total",
+        "Reconciliation sweeps finished, including those abandoned on error.",
+    )
+)
+RECONCILE_PAGES = REGISTRY.register(
+    Counter(
+        "dws_reconcile_pages_total",
+        "Pages of workflows fetched by reconciliation sweeps.",
+    )
+)
+RECONCILE_SCANNED = REGISTRY.register(
+    Counter(
+        "dws_reconcile_scanned_total",
+        "Workflows created by Flux examined by reconciliation sweeps.",
+    )
+)
+RECONCILE_ACTIONS = REGISTRY.register(
+    Counter(
+        "dws_reconcile_actions_total",
+        "Actions taken by reconciliation sweeps, by action (torn_down, resynced, "
+        "or expired).",
+        ["action"],
+    )
+)
+RECONCILE_ERRORS = REGISTRY.register(
+    Counter(
+        "dws_reconcile_errors_total",
+        "Errors listing jobs or workflows, or reconciling a workflow.",
+    )
+)
+RECONCILE_SWEEP_DURATION = REGISTRY.register(
+    Gauge(
+        "dws_reconcile_last_sweep_duration_seconds",
+        "Time taken by the last reconciliation sweep.",
+    )
+)
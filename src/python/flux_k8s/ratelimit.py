@@ -0,0 +1,204 @@
+"""Module defining client-side rate limiting of kubernetes API requests.
+
+Requests are throttled by a token bucket shared by every thread in the
+process. When requests have to wait for tokens, they are served in order of
+priority and then in order of arrival, so that teardown work (which frees
+nodes) is not stuck behind a burst of bookkeeping requests.
+
+Identical concurrent reads may also be coalesced, so that only one of them
+is sent to the API server and the others share its response.
+"""
+
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import urllib3
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """Priority classes for kubernetes API requests, most urgent first."""
+
+    TEARDOWN = 0  # teardown and finalizer removal, which free nodes and rabbits
+    WORKFLOW = 1  # proposal, setup, and other requests that advance jobs
+    BOOKKEEPING = 2  # datamovement fetches, pod logs, and other bookkeeping
+
+
+class ThrottledError(urllib3.exceptions.HTTPError):
+    """Raised when a request could not get a token within its timeout."""
+
+
+_PRIORITY = contextvars.ContextVar("k8s_request_priority", default=Priority.WORKFLOW)
+
+
+def current_priority():
+    """Return the priority class of requests issued from the current context."""
+    return _PRIORITY.get()
+
+
+@contextlib.contextmanager
+def priority(prio):
+    """Context manager setting the priority class of requests issued within it.
+
+    The context must not span an ``await``, since the priority would then leak
+    into whatever other coroutine runs in the meantime.
+    """
+    token = _PRIORITY.set(prio)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+class PriorityLimiter:
+    """Token bucket granting tokens to waiters in priority order.
+
+    :param rate: tokens added to the bucket per second
+    :param burst: maximum number of tokens the bucket can hold
+    """
+
+    def __init__(self, rate, burst):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, sequence number) tickets
+        self._sequence = itertools.count()
+        self._granted = {prio.name: 0 for prio in Priority}
+        self._throttled = {prio.name: 0 for prio in Priority}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def acquire(self, prio=None, timeout=None):
+        """Block until a token is available for a request of priority ``prio``.
+
+        If ``timeout`` is given and no token is granted within that many
+        seconds, give up and raise ``ThrottledError``.
+
+        Return the number of seconds spent waiting.
+        """
+        if prio is None:
+            prio = current_priority()
+        prio = Priority(prio)
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            ticket = (prio, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                self._refill()
+                if self._waiting[0] == ticket and self._tokens >= 1:
+                    heapq.heappop(self._waiting)
+                    self._tokens -= 1
+                    self._granted[prio.name] += 1
+                    # wake the next waiter, which may now be at the head
+                    self._cond.notify_all()
+                    break
+                if self._waiting[0] == ticket:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = None  # woken up when the head is granted
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        self._throttled[prio.name] += 1
+                        # the next waiter may now be at the head
+                        self._cond.notify_all()
+                        raise ThrottledError(
+                            f"no {prio.name} request token within {timeout}s"
+                        )
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            with self._cond:
+                self._throttled[prio.name] += 1
+        return waited
+
+    @property
+    def queue_depth(self):
+        """Number of requests currently waiting for a token."""
+        with self._cond:
+            return len(self._waiting)
+
+    def stats(self):
+        """Return a dictionary of limiter statistics."""
+        with self._cond:
+            self._refill()
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": self._tokens,
+                "waiting": len(self._waiting),
+                "granted": dict(self._granted),
+                "throttled": dict(self._throttled),
+            }
+
+
+class _InFlight:
+    """A request being performed on behalf of several callers."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class Coalescer:
+    """Share the result of identical concurrent calls.
+
+    The first caller for a given key performs the call. Callers arriving
+    with the same key while it is in progress wait for it and receive the same
+    result (or exception). Results are not cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.coalesced = 0  # number of calls answered by another caller's request
+
+    def run(self, key, func, *args, **kwargs):
+        """Call ``func(*args, **kwargs)`` unless a call for ``key`` is in flight."""
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            in_flight.event.wait()
+            if in_flight.exception is not None:
+                raise in_flight.exception
+            return in_flight.result
+        try:
+            in_flight.result = func(*args, **kwargs)
+        except BaseException as exc:
+            in_flight.exception = exc
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.event.set()
+        return in_flight.result
+
+
+COALESCER = Coalescer()
@@ -0,0 +1,266 @@
+"""Module defining a periodic sweep for orphaned fluxjob workflows.
+
+If the service crashes or misses a watch event, a workflow may outlive its
+job and hold rabbit storage indefinitely. The ``WorkflowReconciler``
+periodically compares the ``fluxjob-*`` workflows in kubernetes against the
+set of active Flux jobs and reclaims the workflows of inactive jobs. It also
+expires the ``WorkflowInfo`` of inactive jobs whose workflows no longer exist.
+
+Each sweep issues a single ``job-list.list`` RPC for the active jobs and then
+fetches workflows one page per tick, at bookkeeping priority, so that a sweep
+never competes seriously with the requests of running jobs.
+"""
+
+import datetime
+import errno
+import logging
+import time
+
+import flux
+import flux.constants
+import flux.job
+
+from flux_k8s import cleanup, crd, fastjson, metrics
+from flux_k8s.ratelimit import Priority, priority
+from flux_k8s.workflow import WorkflowInfo, WorkflowState
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 600.0  # seconds between the starts of sweeps, 0 to disable
+DEFAULT_PAGE_SIZE = 100  # workflows fetched per page
+DEFAULT_PAGE_INTERVAL = 1.0  # seconds between page fetches within a sweep
+DEFAULT_GRACE = 300.0  # minimum age in seconds of a workflow to be reclaimed
+# metrics exporting the statistics of the reconciler
+_METRICS = {
+    "sweeps": metrics.RECONCILE_SWEEPS,
+    "pages": metrics.RECONCILE_PAGES,
+    "scanned": metrics.RECONCILE_SCANNED,
+    "torn_down": metrics.RECONCILE_ACTIONS.labels("torn_down"),
+    "resynced": metrics.RECONCILE_ACTIONS.labels("resynced"),
+    "expired": metrics.RECONCILE_ACTIONS.labels("expired"),
+    "errors": metrics.RECONCILE_ERRORS,
+}
+
+
+def _creation_time(workflow):
+    """Return the creation time of a k8s object in seconds since the epoch."""
+    created = datetime.datetime.strptime(
+        workflow["metadata"]["creationTimestamp"], "%Y-%m-%dT%H:%M:%SZ"
+    )
+    return created.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class WorkflowReconciler:
+    """Periodically reclaim workflows whose jobs are no longer active.
+
+    Stale workflows not yet in Teardown are moved to Teardown. Stale workflows
+    already in Teardown are passed to ``resync_cb`` as if a watch event had
+    been received for them, so that they are finished off (rabbits freed and
+    the workflow deleted) by the same code that handles watch events. After a
+    complete sweep, the ``WorkflowInfo`` of inactive jobs without a workflow
+    is set to expire.
+
+    :param handle: Flux handle
+    :param k8s_api: kubernetes CustomObjectsApi
+    :param resync_cb: callable taking a watch event for a workflow
+    :param interval: seconds between the starts of sweeps
+    :param page_size: workflows fetched per page
+    :param page_interval: seconds between page fetches within a sweep
+    :param grace: minimum age in seconds of a workflow to be reclaimed; also
+        protects workflows created after the sweep's list of active jobs
+    """
+
+    def __init__(
+        self,
+        handle,
+        k8s_api,
+        resync_cb,
+        interval=DEFAULT_INTERVAL,
+        page_size=DEFAULT_PAGE_SIZE,
+        page_interval=DEFAULT_PAGE_INTERVAL,
+        grace=DEFAULT_GRACE,
+    ):
+        self.handle = handle
+        self.k8s_api = k8s_api
+        self.resync_cb = resync_cb
+        self.interval = interval
+        self.page_size = page_size
+        self.page_interval = page_interval
+        self.grace = grace
+        self._sweep_timer = None
+        self._page_timer = None
+        self._active = None  # set of active jobids for the current sweep
+        self._known = None  # jobids with a WorkflowInfo when the sweep began
+        self._seen = None  # jobids of the workflows fetched in the current sweep
+        self._sweep_start = None  # time the current sweep began, if any
+        self._continue = None  # continue token for the next page
+        self._stats = {
+            "sweeps": 0,
+            "pages": 0,
+            "scanned": 0,
+            "torn_down": 0,
+            "resynced": 0,
+            "expired": 0,
+            "errors": 0,
+            "last_sweep_duration": 0.0,
+        }
+
+    def start(self):
+        """Begin sweeping periodically; do nothing if the interval is 0."""
+        if self.interval > 0:
+            self._sweep_timer = self.handle.timer_watcher_create(
+                self.interval, self._sweep_cb, repeat=self.interval
+            ).start()
+        return self
+
+    def stop(self):
+        """Stop sweeping, abandoning any sweep in progress."""
+        for timer in (self._sweep_timer, self._page_timer):
+            if timer is not None:
+                timer.stop()
+        self._sweep_timer = self._page_timer = None
+        self._active = self._sweep_start = self._known = self._seen = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """Return a dictionary of reconciler statistics."""
+        return dict(self._stats, in_progress=self._sweep_start is not None)
+
+    def _count(self, stat):
+        """Increment a statistic, and the metric exporting it."""
+        self._stats[stat] += 1
+        _METRICS[stat].inc()
+
+    def _sweep_cb(self, _reactor, _watcher, _r, _args):
+        """Begin a sweep by listing the active jobs."""
+        if self._sweep_start is not None:
+            LOGGER.debug("Previous workflow reconciliation sweep still in progress")
+            return
+        self._sweep_start = time.time()
+        self._active = set()
+        self._seen = set()
+        self._known = set(WorkflowInfo.known_workflows())
+        flux.job.job_list(
+            self.handle,
+            max_entries=0,
+            attrs=[],
+            userid=flux.constants.FLUX_USERID_UNKNOWN,
+            states=flux.constants.FLUX_JOB_STATE_ACTIVE,
+        ).then(self._job_list_cb)
+
+    def _job_list_cb(self, future):
+        """Record the active jobs and, once all have arrived, fetch workflows.
+
+        The response may be streamed, in which case it ends with ENODATA.
+        """
+        try:
+            response = future.get()
+        except OSError as exc:
+            if exc.errno != errno.ENODATA:
+                LOGGER.warning("Failed to list active jobs for reconciliation: %s", exc)
+                self._count("errors")
+                self._active = self._sweep_start = self._known = self._seen = None
+                return
+        else:
+            self._active.update(job["id"] for job in response["jobs"])
+            if response.get("version", 0) != 0:
+                future.reset()
+                return
+        self._continue = None
+        self._page_timer = self.handle.timer_watcher_create(
+            0, self._page_cb, repeat=self.page_interval
+        ).start()
+
+    def _finish_sweep(self, complete=True):
+        self._page_timer.stop()
+        self._page_timer = None
+        if complete:
+            self._expire_unseen()
+        self._active = self._known = self._seen = None
+        self._count("sweeps")
+        self._stats["last_sweep_duration"] = time.time() - self._sweep_start
+        metrics.RECONCILE_SWEEP_DURATION.set(self._stats["last_sweep_duration"])
+        self._sweep_start = None
+
+    def _page_cb(self, _reactor, _watcher, _r, _args):
+        """Fetch and reconcile one page of workflows."""
+        kwargs = {
+            "limit": self.page_size,
+            "label_selector": WorkflowInfo.LABEL_SELECTOR,
+        }
+        if self._continue:
+            kwargs["_continue"] = self._continue
+        try:
+            with priority(Priority.BOOKKEEPING):
+                response = fastjson.list_namespaced(
+                    self.k8s_api, crd.WORKFLOW_CRD, **kwargs
+                )
+        except Exception:
+            # a continue token may expire, so abandon the sweep and try next time
+            LOGGER.exception("Failed to fetch workflows for reconciliation")
+            self._count("errors")
+            self._finish_sweep(complete=False)
+            return
+        self._count("pages")
+        for workflow in response["items"]:
+            try:
+                self._reconcile(workflow)
+            except Exception:
+                LOGGER.exception(
+                    "Failed to reconcile workflow %s", workflow["metadata"]["name"]
+                )
+                self._count("errors")
+        self._continue = response["metadata"].get("continue")
+        if not self._continue:
+            self._finish_sweep()
+
+    def _expire_unseen(self):
+        """Expire the WorkflowInfo of inactive jobs whose workflows are gone.
+
+        Only jobs known when the sweep began are considered, since any of
+        them that were active then are in the list of active jobs.
+        """
+        for jobid in self._known - self._active - self._seen:
+            if jobid in WorkflowInfo.known_workflows():
+                winfo = WorkflowInfo.get(jobid)
+                if winfo.expires is None:
+                    winfo.expire()
+                    self._count("expired")
+
+    def _reconcile(self, workflow):
+        """Reclaim a workflow if its job is no longer active."""
+        name = workflow["metadata"]["name"]
+        if not WorkflowInfo.is_recognized(name):
+            return
+        self._count("scanned")
+        jobid = int(flux.job.JobID(workflow["spec"]["jobID"]))
+        self._seen.add(jobid)
+        if jobid in self._active:
+            return
+        if _creation_time(workflow) > self._sweep_start - self.grace:
+            return
+        if jobid in WorkflowInfo.known_workflows():
+            winfo = WorkflowInfo.get(jobid)
+            if winfo.deleted:
+                return  # deletion already submitted
+        else:
+            winfo = None
+        status = workflow.get("status", {})
+        if status.get("state") == WorkflowState.TEARDOWN:
+            LOGGER.info("Reconciling workflow %s of inactive job %s", name, jobid)
+            self._count("resynced")
+            self.resync_cb({"type": "MODIFIED", "object": workflow})
+        elif workflow["spec"]["desiredState"] != WorkflowState.TEARDOWN:
+            if winfo is not None and winfo.toredown:
+                return
+            LOGGER.info("Tearing down orphaned workflow %s of job %s", name, jobid)
+            self._count("torn_down")
+            cleanup.teardown_workflow(workflow)
+            if winfo is not None:
+                winfo.toredown = True
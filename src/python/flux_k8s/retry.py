@@ -0,0 +1,176 @@
+"""Module defining per-request retries and a circuit breaker for kubernetes.
+
+Transient failures (connection errors, timeouts, and 429 or 5xx responses)
+are retried a few times with jittered exponential backoff. If requests keep
+failing, the circuit breaker opens and further requests fail immediately
+with ``CircuitOpenError`` instead of waiting on an unresponsive API server.
+After a cooldown, a single trial request is let through; if it succeeds
+the breaker closes, otherwise it opens again for twice as long.
+"""
+
+import enum
+import logging
+import random
+import threading
+import time
+
+import urllib3
+from kubernetes.client.rest import ApiException
+
+
+LOGGER = logging.getLogger(__name__)
+
+# HTTP statuses indicating the API server is overloaded or unavailable
+RETRYABLE_STATUSES = frozenset((0, 429, 500, 502, 503, 504))
+# HTTP methods that may safely be sent more than once
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+class CircuitOpenError(urllib3.exceptions.HTTPError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+def is_transient(exc):
+    """Return True if ``exc`` indicates a problem with the API server itself."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, ApiException):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, urllib3.exceptions.HTTPError)
+
+
+class RetryPolicy:
+    """Retry transient failures with jittered exponential backoff.
+
+    :param retries: number of times to retry a failed request
+    :param base_delay: delay in seconds before the first retry
+    :param max_delay: maximum delay in seconds between retries
+    """
+
+    def __init__(self, retries=3, base_delay=0.1, max_delay=2.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Return the delay before retry number ``attempt`` (counting from 0)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def should_retry(self, method, exc, attempt):
+        """Return True if a request that failed with ``exc`` should be retried."""
+        return (
+            attempt < self.retries
+            and method.upper() in IDEMPOTENT_METHODS
+            and is_transient(exc)
+        )
+
+
+class BreakerState(str, enum.Enum):
+    """States of a CircuitBreaker."""
+
+    CLOSED = "closed"  # requests flow normally
+    OPEN = "open"  # requests are rejected
+    HALF_OPEN = "half-open"  # a single trial request is in flight
+
+
+class CircuitBreaker:
+    """Stop sending requests to an API server that keeps failing.
+
+    :param failure_threshold: consecutive transient failures that open the breaker
+    :param reset_timeout: seconds the breaker stays open the first time it opens;
+        doubled (up to ``max_reset_timeout``) every time a trial request fails
+    :param max_reset_timeout: maximum time in seconds the breaker stays open
+    """
+
+    def __init__(
+        self, failure_threshold=5, reset_timeout=10.0, max_reset_timeout=300.0
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._current_timeout = reset_timeout
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self.trips = 0  # number of times the breaker has opened
+        self.rejected = 0  # number of requests rejected while open
+
+    @property
+    def state(self):
+        """Return the current BreakerState."""
+        with self._lock:
+            return self._state
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self._lock:
+            if self._state == BreakerState.CLOSED:
+                return
+            if (
+                self._state == BreakerState.OPEN
+                and time.monotonic() - self._opened_at >= self._current_timeout
+            ):
+                self._state = BreakerState.HALF_OPEN
+                LOGGER.info(
+                    "kubernetes circuit breaker half-open, sending trial request"
+                )
+                return
+            self.rejected += 1
+            state = self._state.value
+            remaining = max(
+                0.0, self._opened_at + self._current_timeout - time.monotonic()
+            )
+        raise CircuitOpenError(
+            f"kubernetes circuit breaker is {state}, retrying in {remaining:.1f}s"
+        )
+
+    def record_success(self):
+        """Record a request that reached the API server."""
+        with self._lock:
+            if self._state != BreakerState.CLOSED:
+                LOGGER.info("kubernetes circuit breaker closed")
+            self._state = BreakerState.CLOSED
+            self._failures = 0
+            self._current_timeout = self.reset_timeout
+
+    def record_failure(self, exc):
+        """Record a request that failed with ``exc``."""
+        if not is_transient(exc):
+            # the API server answered; it is up even though the request failed
+            self.record_success()
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == BreakerState.HALF_OPEN:
+                self._current_timeout = min(
+                    self._current_timeout * 2, self.max_reset_timeout
+                )
+            elif self._failures < self.failure_threshold:
+                return
+            self._state = BreakerState.OPEN
+            self._opened_at = time.monotonic()
+            self.trips += 1
+            timeout = self._current_timeout
+        LOGGER.warning(
+            "Hit an exception: '%s' while contacting kubernetes, "
+            "rejecting requests for %s seconds",
+            exc,
+            timeout,
+        )
+
+    def stats(self):
+        """Return a dictionary describing the breaker."""
+        with self._lock:
+            stats = {
+                "state": self._state.value,
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "reset_timeout": self._current_timeout,
+            }
+            if self._state == BreakerState.OPEN:
+                stats["retry_in"] = max(
+                    0.0, self._opened_at + self._current_timeout - time.monotonic()
+                )
+            return stats
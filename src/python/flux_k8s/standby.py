@@ -0,0 +1,88 @@
+"""Module defining the handoff of the dws service to a standby instance.
+
+Only one instance of coral2_dws may act on workflows and rabbits at once.
+That instance owns the ``dws`` Flux service name; the broker refuses to
+register a name that another client already owns, and releases it as soon
+as the owner disconnects, whether it exited or crashed. A standby instance
+therefore starts up, connects to Kubernetes, and opens its watches as the
+active instance does, but without acting on them, and tries to register the
+service every few tenths of a second. Once it succeeds, it takes over with
+warm caches, instead of waiting for systemd to restart the failed instance
+and for it to rediscover everything.
+"""
+
+import errno
+import logging
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.2  # seconds between attempts to register the service
+
+
+class ServiceHandoff:
+    """Register a Flux service as soon as its current owner goes away.
+
+    :param handle: Flux handle
+    :param service: name of the service to register
+    :param on_acquire: callable run on the reactor once the service is ours
+    :param interval: seconds between attempts to register the service
+    """
+
+    def __init__(self, handle, service, on_acquire, interval=DEFAULT_INTERVAL):
+        self.handle = handle
+        self.service = service
+        self.on_acquire = on_acquire
+        self.interval = interval
+        self.acquired = False
+        self.attempts = 0
+        self._since = None  # time of the first attempt
+        self._pending = False  # whether a registration request is in progress
+        self._timer = None
+
+    def start(self):
+        """Begin trying to register the service."""
+        self._since = time.monotonic()
+        self._timer = self.handle.timer_watcher_create(
+            0, self._attempt_cb, repeat=self.interval
+        ).start()
+        return self
+
+    def stop(self):
+        """Stop trying to register the service."""
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _attempt_cb(self, _reactor, _watcher, _r, _args):
+        if self._pending or self.acquired:
+            return
+        self._pending = True
+        self.attempts += 1
+        self.handle.service_register(self.service).then(self._registered_cb)
+
+    def _registered_cb(self, future):
+        self._pending = False
+        try:
+            future.get()
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                LOGGER.warning(
+                    "Failed to register the %s service: %s", self.service, exc
+                )
+            return
+        self.acquired = True
+        self.stop()
+        LOGGER.info(
+            "Took over the %s service after %.1fs on standby",
+            self.service,
+            time.monotonic() - self._since,
+        )
+        self.on_acquire()
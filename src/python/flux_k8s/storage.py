@@ -8,6 +8,9 @@ from flux.hostlist import Hostlist
 from flux.idset import IDset
 from flux_k8s import watch
 from flux_k8s import crd
+from flux_k8s import fastjson
+from flux_k8s import metrics
+from flux_k8s import config
 
 LOGGER = logging.getLogger(__name__)
 EXCLUDE_PROPERTY = "badrabbit"
@@ -90,8 +93,11 @@ class RabbitManager:
 
         Marks a rabbit as up or down.
         """
+        if event.get("type") == "DELETED" and "status" not in event["object"]:
+            # deletions found by relisting carry only the object's spec
+            return
         rabbit = event["object"]
-        if self.handle.conf_get("rabbit.drain_compute_nodes", True):
+        if config.current().drain_compute_nodes:
             # only drain compute nodes if allowed, admins may find it obnoxious
             self._drain_offline_nodes(rabbit)
         self._set_or_remove_property(rabbit)
@@ -119,6 +125,8 @@ class RabbitManager:
                 },
                 nodeid=0,
             ).then(log_rpc_response)
+            metrics.DRAINS.labels("pcie").inc()
+            metrics.DRAINED_NODES.labels("pcie").inc(len(offline_nodes))
 
     def _set_or_remove_property(self, rabbit):
         """Set or remove properties on compute nodes so rabbit jobs can avoid them.
@@ -132,12 +140,11 @@ class RabbitManager:
         all_nodes = set(RABBITS_TO_HOSTLISTS[name])
         down_nodes = set()
         status = _get_status(rabbit, "Disabled")
+        snapshot = config.current()
         if status != _READY_STATUS:
             # all nodes should be marked with the property
             down_nodes = all_nodes
-        elif not self.handle.conf_get(
-            "rabbit.drain_compute_nodes", True
-        ) and self.handle.conf_get("rabbit.soft_drain", True):
+        elif not snapshot.drain_compute_nodes and snapshot.soft_drain:
             # rabbit is up, draining disabled, individual nodes may be marked with property
             down_nodes = _get_offline_nodes(rabbit)
         up_nodes = all_nodes - down_nodes
@@ -285,6 +292,8 @@ class FluxionRabbitManager(RabbitManager):
 
         Runs superclass's method and also marks a rabbit as up or down.
         """
+        if event.get("type") == "DELETED" and "status" not in event["object"]:
+            return
         super().rabbit_state_change_cb(event)
         rabbit = event["object"]
         name = rabbit["metadata"]["name"]
@@ -329,10 +338,11 @@ class FluxionRabbitManager(RabbitManager):
         all_nodes = set(RABBITS_TO_HOSTLISTS[name])
         down_nodes = set()
         status = _get_status(rabbit, "Disabled")
+        snapshot = config.current()
         if (
             status == _READY_STATUS
-            and not self.handle.conf_get("rabbit.drain_compute_nodes", True)
-            and self.handle.conf_get("rabbit.soft_drain", True)
+            and not snapshot.drain_compute_nodes
+            and snapshot.soft_drain
         ):
             # rabbit is up, draining disabled, individual nodes may be marked with prop
             down_nodes = _get_offline_nodes(rabbit)
@@ -382,16 +392,12 @@ def populate_rabbits_dict(k8s_api):
         RABBITS_TO_HOSTLISTS[nnf["name"]] = hlist.uniq()
 
 
-def init_rabbits(k8s_api, handle, watchers, disable_fluxion, drain_queues):
-    """Watch every rabbit ('Storage' resources in k8s) known to k8s.
-
-    Return a `RabbitManager` instance for managing the rabbits, after adding
-    a watch on Storage resources.
+def create_rabbit_manager(handle, disable_fluxion, drain_queues):
+    """Return a `RabbitManager` instance for managing the rabbits.
 
-    To initialize, check the status of all rabbits and mark each one as up or
-    down, because status may have changed while this service was inactive.
+    Creating the manager only reads the instance's resources, so a standby
+    instance may do it ahead of taking over.
     """
-    api_response = k8s_api.list_namespaced_custom_object(*crd.RABBIT_CRD)
     if drain_queues is not None:
         rset = flux.resource.resource_list(handle).get().all
         allowlist = set(rset.copy_constraint({"properties": drain_queues}).nodelist)
@@ -402,18 +408,34 @@ def init_rabbits(k8s_api, handle, watchers, disable_fluxion, drain_queues):
     else:
         allowlist = None
     if disable_fluxion:
-        manager = RabbitManager(handle, allowlist)
-    else:
-        manager = FluxionRabbitManager(handle, allowlist)
+        return RabbitManager(handle, allowlist)
+    return FluxionRabbitManager(handle, allowlist)
+
+
+def init_rabbits(
+    k8s_api, handle, watchers, disable_fluxion, drain_queues, manager=None
+):
+    """Watch every rabbit ('Storage' resources in k8s) known to k8s.
+
+    Return a `RabbitManager` instance for managing the rabbits, after adding
+    a watch on Storage resources. If ``manager`` is given, use it rather than
+    creating one.
+
+    To initialize, check the status of all rabbits and mark each one as up or
+    down, because status may have changed while this service was inactive.
+    """
+    api_response = fastjson.list_namespaced(k8s_api, crd.RABBIT_CRD)
+    if manager is None:
+        manager = create_rabbit_manager(handle, disable_fluxion, drain_queues)
     resource_version = 0
     for rabbit in api_response["items"]:
         resource_version = rabbit["metadata"]["resourceVersion"]
         manager.rabbit_state_change_cb(
             {"object": rabbit},
         )
-    watchers.add_watch(
-        watch.Watch(
-            k8s_api, crd.RABBIT_CRD, resource_version, manager.rabbit_state_change_cb
-        )
+    rabbit_watch = watch.Watch(
+        k8s_api, crd.RABBIT_CRD, resource_version, manager.rabbit_state_change_cb
     )
+    rabbit_watch.prime(api_response["items"])
+    watchers.add_watch(rabbit_watch)
     return manager
@@ -0,0 +1,169 @@
+"""Module defining per-job timelines of rabbit-related events.
+
+DWS reports only how long each workflow state took on the rabbit side
+(``elapsedTimeLastState``). A ``Timeline`` additionally records when the
+service received each RPC for a job, when it requested each workflow state
+and how long the patch took, when it observed each state become ready and
+how long after DWS marked it ready, and when it released the job's prolog
+and epilog. The timeline is saved to the job's KVS directory as an eventlog
+under ``TIMELINE_KEY``, so that it may be read with
+``flux job eventlog -p rabbit_timeline JOBID``, and ``summarize`` aggregates
+the timelines of many jobs to show where rabbit overhead goes.
+"""
+
+import collections
+import json
+import logging
+import time
+
+import flux
+import flux.job
+
+from flux_k8s import metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+TIMELINE_KEY = "rabbit_timeline"
+
+
+class Timeline:
+    """Record timestamped events for a single job.
+
+    Events are kept in memory until ``save`` is called. Each event has a
+    name and a context dictionary, as in a Flux eventlog:
+
+    ``rpc``
+        an RPC (``topic``) for the job was received
+    ``desired``
+        the workflow was moved to desiredState ``state``; ``latency`` is the
+        duration of the request, if it was made synchronously
+    ``ready``
+        the workflow was seen to have completed ``state``; ``elapsed`` is the
+        time DWS reports the state took, and ``lag`` the delay between DWS
+        marking the state ready and the service observing it
+    ``prolog-remove``, ``epilog-remove``
+        the job's prolog or epilog was released
+    ``transient-condition``
+        the workflow entered TransientCondition while in ``state``
+    """
+
+    def __init__(self):
+        self.events = []
+        self._ready = set()  # states already recorded as ready
+
+    def record(self, name, timestamp=None, **context):
+        """Record an event, by default at the current time."""
+        if timestamp is None:
+            timestamp = time.time()
+        self.events.append((timestamp, name, context))
+
+    def observe(self, workflow):
+        """Record a ``ready`` event the first time a state is seen complete."""
+        status = workflow["status"]
+        state = status.get("state")
+        if (
+            state in self._ready
+            or not status.get("ready")
+            or workflow["spec"]["desiredState"] != state
+        ):
+            return
+        self._ready.add(state)
+        now = time.time()
+        context = {"state": state}
+        try:
+            context["elapsed"] = metrics.parse_duration(status["elapsedTimeLastState"])
+        except (KeyError, ValueError):
+            pass
+        try:
+            context["lag"] = round(
+                now - metrics.parse_timestamp(status["readyChange"]), 6
+            )
+        except (KeyError, ValueError):
+            pass
+        self.record("ready", now, **context)
+
+    def encode(self):
+        """Return the events as a Flux eventlog, one JSON object per line."""
+        return "".join(
+            json.dumps(
+                {"timestamp": round(timestamp, 6), "name": name, "context": context},
+                separators=(",", ":"),
+            )
+            + "\n"
+            for timestamp, name, context in self.events
+        )
+
+    def save(self, handle, jobid):
+        """Write the timeline to the job's KVS directory, ignoring errors."""
+        if not self.events:
+            return
+        try:
+            with flux.job.job_kvs(handle, jobid) as kvsdir:
+                # bytes are written raw, keeping the value a valid eventlog
+                kvsdir[TIMELINE_KEY] = self.encode().encode("utf-8")
+        except Exception:
+            LOGGER.exception("Failed to save rabbit timeline for job %s", jobid)
+
+
+def decode(eventlog):
+    """Return the events of an eventlog string as a list of dictionaries."""
+    return [json.loads(line) for line in eventlog.splitlines() if line.strip()]
+
+
+def _label(event):
+    """Return a short label for an event, e.g. ``ready:Setup``."""
+    context = event.get("context", {})
+    qualifier = context.get("state", context.get("topic"))
+    if qualifier is None:
+        return event["name"]
+    return f"{event['name']}:{qualifier}"
+
+
+def _quantile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _describe(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": _quantile(ordered, 0.5),
+        "p90": _quantile(ordered, 0.9),
+        "max": ordered[-1],
+    }
+
+
+def summarize(timelines):
+    """Aggregate the timelines of many jobs.
+
+    :param timelines: iterable of lists of events, as returned by ``decode``
+
+    Return a dictionary with two keys. ``phases`` maps each pair of
+    consecutive event labels, e.g. ``("ready:Setup", "desired:DataIn")``,
+    to statistics of the time between them. ``details`` maps each event
+    context field (``latency``, ``lag``, and ``elapsed``) and event label to
+    statistics of its values. Both are ordered by decreasing total time.
+    """
+    phases = collections.defaultdict(list)
+    details = collections.defaultdict(list)
+    for events in timelines:
+        events = sorted(events, key=lambda event: event["timestamp"])
+        for prev, event in zip(events, events[1:]):
+            phases[(_label(prev), _label(event))].append(
+                event["timestamp"] - prev["timestamp"]
+            )
+        for event in events:
+            for field in ("latency", "lag", "elapsed"):
+                if field in event.get("context", {}):
+                    details[(field, _label(event))].append(event["context"][field])
+
+    def ordered(samples):
+        described = {key: _describe(values) for key, values in samples.items()}
+        return dict(
+            sorted(described.items(), key=lambda item: item[1]["total"], reverse=True)
+        )
+
+    return {"phases": ordered(phases), "details": ordered(details)}
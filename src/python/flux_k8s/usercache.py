@@ -0,0 +1,97 @@
+"""Module defining a cache of the primary groups of users.
+
+Workflows must be created with the primary GID of the submitting user, and
+``pwd.getpwuid`` may go through NSS to LDAP or SSSD, taking tens of
+milliseconds, or seconds when the directory is slow. Since the service runs
+on a single reactor thread, a ``GroupCache`` keeps GIDs for a while so that
+only the first job of a user pays for the lookup. Expired entries are still
+served while they are refreshed in the background.
+"""
+
+import collections
+import logging
+import pwd
+import threading
+import time
+
+from flux_k8s import metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TTL = 600.0  # seconds before a cached GID is refreshed
+DEFAULT_MAXSIZE = 4096  # users whose GIDs are kept
+
+
+class GroupCache:
+    """Bounded, TTL-based cache mapping UIDs to primary GIDs.
+
+    A miss resolves the UID synchronously. A hit on an entry older than
+    ``ttl`` returns the cached GID and submits a refresh to ``executor``, so
+    that a slow directory only delays the first job of each user. The least
+    recently used entries are evicted beyond ``maxsize``.
+
+    :param executor: ``concurrent.futures.Executor`` to refresh entries in
+    :param ttl: seconds before an entry is refreshed
+    :param maxsize: maximum number of entries
+    :param getpwuid: function to resolve UIDs, for testing
+    """
+
+    def __init__(
+        self, executor, ttl=DEFAULT_TTL, maxsize=DEFAULT_MAXSIZE, getpwuid=pwd.getpwuid
+    ):
+        self._executor = executor
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._getpwuid = getpwuid
+        self._entries = collections.OrderedDict()  # uid -> (gid, fetched_at)
+        self._refreshing = set()  # uids with a refresh in progress
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def gid(self, uid):
+        """Return the primary GID of ``uid``.
+
+        :raises KeyError: if the UID is unknown
+        """
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None:
+                self._entries.move_to_end(uid)
+                gid, fetched_at = entry
+                if time.monotonic() - fetched_at < self._ttl:
+                    metrics.USER_LOOKUPS.labels("hit").inc()
+                    return gid
+                metrics.USER_LOOKUPS.labels("stale").inc()
+                if uid not in self._refreshing:
+                    self._refreshing.add(uid)
+                    self._executor.submit(self._refresh, uid)
+                return gid
+        metrics.USER_LOOKUPS.labels("miss").inc()
+        gid = self._getpwuid(uid).pw_gid
+        self._store(uid, gid)
+        return gid
+
+    def _store(self, uid, gid):
+        with self._lock:
+            self._entries[uid] = (gid, time.monotonic())
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, uid):
+        """Resolve ``uid`` again, keeping the cached GID if the lookup fails."""
+        try:
+            gid = self._getpwuid(uid).pw_gid
+        except KeyError:
+            with self._lock:
+                self._entries.pop(uid, None)
+        except Exception:
+            LOGGER.exception("Failed to refresh primary group of uid %s", uid)
+        else:
+            self._store(uid, gid)
+        finally:
+            with self._lock:
+                self._refreshing.discard(uid)
@@ -1,85 +1,424 @@
 """Module defining utilities for watching K8s resources."""
 
+import collections
+import os
+import queue
 import syslog
 import logging
+import threading
+import time
 
-from flux.constants import FLUX_MSGTYPE_REQUEST
+from flux.constants import FLUX_MSGTYPE_REQUEST, FLUX_POLLIN
 import kubernetes as k8s
 from kubernetes.client.rest import ApiException
 
+from flux_k8s import fastjson, metrics
 
 LOGGER = logging.getLogger(__name__)
 
 
+# number of objects fetched per page when relisting
+RELIST_PAGE_SIZE = 500
+# seconds a watch stream stays open before being reopened
+STREAM_TIMEOUT = 60
+# maximum events processed from one watch before moving on to the next
+BATCH_SIZE = 64
+# histogram buckets for watch lag, in seconds
+LAG_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+class ResourceVersionExpired(Exception):
+    """Raised when a watch's resourceVersion is too old for the API server."""
+
+
+class WatchError(Exception):
+    """Raised when a watch stream ends with an ERROR event other than a 410."""
+
+
+def _tombstone(obj):
+    """Return the parts of an object kept to report its deletion."""
+    metadata = obj["metadata"]
+    return {
+        "metadata": {
+            "name": metadata["name"],
+            "namespace": metadata.get("namespace"),
+            "resourceVersion": metadata.get("resourceVersion"),
+        },
+        "spec": obj.get("spec", {}),
+    }
+
+
+def _newer(resource_version, other):
+    """Return True if ``resource_version`` is newer than ``other``.
+
+    resourceVersions are opaque strings, but in practice are integers. If
+    either is not, treat any difference as newer.
+    """
+    try:
+        return int(resource_version) > int(other)
+    except (TypeError, ValueError):
+        return resource_version != other
+
+
+def transition_time(obj):
+    """Return the time of the latest recorded change to an object, or None.
+
+    Workflows record when their desiredState and ready status last changed;
+    every object records when each manager last wrote to it.
+    """
+    times = [
+        field["time"]
+        for field in obj["metadata"].get("managedFields") or ()
+        if field.get("time")
+    ]
+    status = obj.get("status") or {}
+    times.extend(
+        status[key] for key in ("desiredStateChange", "readyChange") if status.get(key)
+    )
+    if not times:
+        return None
+    return max(metrics.parse_timestamp(timestamp) for timestamp in times)
+
+
 class Watch:
-    """Represents a watch on a k8s resource."""
+    """Represents a watch on a k8s resource.
+
+    The watch requests bookmarks, so that its resourceVersion stays current
+    even when the watched objects do not change. If the resourceVersion
+    nevertheless expires (HTTP 410 Gone), the objects are relisted and
+    compared against the resourceVersions last seen for them, and only
+    objects which were added, modified, or deleted in the meantime are
+    passed to the callback. Events for versions of objects that have already
+    been seen are dropped.
+
+    Objects deleted while the watch was expired are reported with a DELETED
+    event whose object holds only the ``metadata`` and ``spec`` last seen.
+
+    If ``label_selector`` or ``field_selector`` is given, the API server only
+    sends events for matching objects.
+
+    Once started, the watch streams events from its own thread into a queue;
+    ``process_queue`` must then be called from the thread that owns the
+    callback's Flux handle to pass them to the callback.
+
+    While the watch is held (see ``hold``), events are recorded but only the
+    latest event of each object is kept, to be passed to the callback on
+    ``release``.
+    """
 
-    def __init__(self, api, crd, resource_version, callback, *args, **kwargs):
+    def __init__(
+        self,
+        api,
+        crd,
+        resource_version,
+        callback,
+        *args,
+        label_selector=None,
+        field_selector=None,
+        **kwargs,
+    ):
         self.api = api
         self.crd = crd
         self.resource_version = resource_version
         self.callback = callback
         self.cb_args = args
         self.cb_kwargs = kwargs
+        self.selectors = {}
+        if label_selector:
+            self.selectors["label_selector"] = label_selector
+        if field_selector:
+            self.selectors["field_selector"] = field_selector
+        self.relists = 0  # number of times the resourceVersion expired
+        self.streams = 0  # number of watch streams opened by the watch thread
+        self.errors = 0  # number of watch streams that failed
+        self.events = collections.Counter()  # events dispatched, by type
+        self.event_rate = metrics.RateCounter()
+        self.callback_duration = metrics.Histogram()
+        self.lag = metrics.Histogram(LAG_BUCKETS)  # change-to-callback delay
+        self._seen = {}  # maps object names to (resourceVersion, tombstone)
+        self._held = None  # maps object names to latest events while held
+        self._unannounced = set()  # held objects the callback has never seen
+        self._queue = queue.SimpleQueue()  # events streamed by the watch thread
+        self._thread = None
+        self._stop = threading.Event()
 
-    def watch(self):
-        """Watch resource, firing off callbacks.
+    def _open_stream(self, kwargs):
+        """Open a watch stream, decoding raw responses if fast decoding is enabled."""
+        if fastjson.ENABLED:
+            response = self.api.list_namespaced_custom_object(
+                *self.crd, _preload_content=False, **kwargs
+            )
+            return fastjson.stream_events(response)
+        return k8s.watch.Watch().stream(
+            self.api.list_namespaced_custom_object, *self.crd, **kwargs
+        )
 
-        When there are only old resources lying around and no new ones,
-        the resourceversion will be > 0 but too old for kubernetes to accept it.
+    def prime(self, objects):
+        """Record objects that the caller has already processed.
 
-        Some versions of kubernetes (newer ones) throw an exception, others
-        just return an ERROR event. Handle both cases by resetting the
-        resource_version to 0.
+        If the watch later has to relist, these objects are passed to the
+        callback only if they have changed.
+        """
+        for obj in objects:
+            self._seen[obj["metadata"]["name"]] = (
+                obj["metadata"]["resourceVersion"],
+                _tombstone(obj),
+            )
+
+    def _update_resource_version(self, resource_version):
+        if _newer(resource_version, self.resource_version):
+            self.resource_version = resource_version
+
+    def _dispatch(self, event):
+        """Record an event's object and pass the event to the callback.
+
+        Events for a version of an object no newer than one already passed
+        to the callback are dropped.
+        """
+        obj = event["object"]
+        name = obj["metadata"]["name"]
+        new = name not in self._seen
+        if event["type"] == "DELETED":
+            self._seen.pop(name, None)
+        else:
+            resource_version = obj["metadata"]["resourceVersion"]
+            seen = self._seen.get(name)
+            if seen is not None and not _newer(resource_version, seen[0]):
+                return
+            self._seen[name] = (resource_version, _tombstone(obj))
+            changed = transition_time(obj)
+            if changed is not None:
+                # clamp, since the API server's clock may be ahead of ours
+                self.lag.observe(max(0.0, time.time() - changed))
+        self.events[event["type"]] += 1
+        self.event_rate.add()
+        if self._held is not None:
+            self._hold(name, event, new)
+            return
+        start = time.perf_counter()
+        try:
+            self.callback(event, *self.cb_args, **self.cb_kwargs)
+        finally:
+            self.callback_duration.observe(time.perf_counter() - start)
+
+    def hold(self):
+        """Keep watching, but hold events back from the callback until released."""
+        if self._held is None:
+            self._held = {}
+
+    def _hold(self, name, event, new):
+        """Hold back the latest event of an object.
+
+        Objects created and deleted while held are forgotten altogether,
+        since the callback never saw them.
+        """
+        if new and name not in self._held:
+            self._unannounced.add(name)
+        if event["type"] == "DELETED" and name in self._unannounced:
+            self._unannounced.discard(name)
+            self._held.pop(name, None)
+        else:
+            self._held[name] = event
+
+    def release(self):
+        """Pass the latest held event of each object to the callback, in order."""
+        held, self._held = self._held, None
+        self._unannounced.clear()
+        for event in (held or {}).values():
+            start = time.perf_counter()
+            try:
+                self.callback(event, *self.cb_args, **self.cb_kwargs)
+            except Exception:
+                LOGGER.exception(
+                    "Error processing held %s watch event", self.crd.plural
+                )
+            finally:
+                self.callback_duration.observe(time.perf_counter() - start)
+
+    def stats(self):
+        """Return a dictionary of watch statistics.
+
+        ``lag`` is the delay between the latest change recorded in an object
+        and the callback for it firing, so it includes both the time spent
+        by kubernetes delivering the event and the time spent queued here.
+        """
+        return {
+            "events": dict(self.events),
+            "events_per_second": self.event_rate.rate(),
+            "queued": self._queue.qsize(),
+            "held": len(self._held or ()),
+            "streams": self.streams,
+            "reconnects_after_error": self.errors,
+            "relists": self.relists,
+            "lag": self.lag.snapshot(),
+            "callback_duration": self.callback_duration.snapshot(),
+        }
+
+    def _stream(self, handler, timeout):
+        """Pass events to ``handler`` until the stream times out.
+
+        Raise ResourceVersionExpired if the API server reports that the
+        resourceVersion is too old, whether by exception (newer versions of
+        kubernetes) or by an ERROR event (older ones), and WatchError for
+        any other ERROR event, such as a 403 or a 5xx Status.
         """
         kwargs = {
             "resource_version": self.resource_version,
             "watch": True,
-            "timeout_seconds": 1,
+            "timeout_seconds": timeout,
+            "allow_watch_bookmarks": True,
+            **self.selectors,
         }
+        if timeout > 1:
+            # the server ends the stream after `timeout` seconds; don't give up first
+            kwargs["_request_timeout"] = timeout + 30
         try:
-            stream = k8s.watch.Watch().stream(
-                self.api.list_namespaced_custom_object, *self.crd, **kwargs
-            )
+            for event in self._open_stream(kwargs):
+                if event["type"] == "ERROR":
+                    if event["object"].get("code") == 410:
+                        raise ResourceVersionExpired(event["object"].get("message"))
+                    raise WatchError(event["object"])
+                self._update_resource_version(
+                    event["object"]["metadata"]["resourceVersion"]
+                )
+                if event["type"] == "BOOKMARK":
+                    continue
+                handler(event)
         except ApiException as apiexc:
             if apiexc.status != 410:
                 raise
-            self.resource_version = kwargs["resource_version"] = 0
-            stream = k8s.watch.Watch().stream(
-                self.api.list_namespaced_custom_object, *self.crd, **kwargs
-            )
-        try:
-            for event in stream:
-                if event["type"] == "ERROR" and event["object"]["code"] == 410:
-                    LOGGER.debug(
-                        "Resource version too old in watch, restarting "
-                        "from resourceVersion = 0: %s",
-                        event["object"]["message"],
-                    )
-                    self.resource_version = 0
-                    self.watch()
-                    return
+            raise ResourceVersionExpired(apiexc.reason) from apiexc
+
+    def _list(self):
+        """List every object, returning a dict of objects and the resourceVersion."""
+        listed = {}
+        kwargs = {"limit": RELIST_PAGE_SIZE, **self.selectors}
+        while True:
+            response = fastjson.list_namespaced(self.api, self.crd, **kwargs)
+            for obj in response["items"]:
+                listed[obj["metadata"]["name"]] = obj
+            kwargs["_continue"] = response["metadata"].get("continue")
+            if not kwargs["_continue"]:
+                return listed, response["metadata"]["resourceVersion"]
+
+    def _apply_list(self, listed):
+        """Pass objects that changed since they were last seen to the callback."""
+        for name in set(self._seen) - set(listed):
+            self._dispatch({"type": "DELETED", "object": self._seen[name][1]})
+        for name, obj in listed.items():
+            seen = self._seen.get(name)
+            if seen is None:
+                self._dispatch({"type": "ADDED", "object": obj})
+            elif seen[0] != obj["metadata"]["resourceVersion"]:
+                self._dispatch({"type": "MODIFIED", "object": obj})
+
+    def _relist(self):
+        """Relist, dispatch changes, and resume watching from the list."""
+        self.relists += 1
+        listed, self.resource_version = self._list()
+        self._apply_list(listed)
+
+    def watch(self):
+        """Watch resource for one second, firing off callbacks directly.
+
+        When there are only old resources lying around and no new ones,
+        the resourceversion will be > 0 but too old for kubernetes to accept it.
+        In that case, relist and resume watching from the list.
+        """
+        while True:
+            try:
+                self._stream(self._dispatch, 1)
+            except ResourceVersionExpired as exc:
+                LOGGER.debug(
+                    "Resource version %s too old in watch, relisting: %s",
+                    self.resource_version,
+                    exc,
+                )
+                self._relist()
+            else:
+                return
+
+    def start(self, notify, retry_delay=5, timeout=STREAM_TIMEOUT):
+        """Start streaming events from a thread of the watch's own.
+
+        ``notify`` is called from the thread whenever events are queued.
+        Streams are reopened every ``timeout`` seconds, and ``retry_delay``
+        seconds after an error.
+        """
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(notify, retry_delay, timeout),
+            name=f"watch_{self.crd.plural}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watch thread once its current stream ends."""
+        self._stop.set()
+
+    def _run(self, notify, retry_delay, timeout):
+        """Queue events from successive streams until stopped."""
+
+        def enqueue(event):
+            self._queue.put(("event", event))
+            notify()
+
+        while not self._stop.is_set():
+            self.streams += 1
+            try:
+                self._stream(enqueue, timeout)
+            except ResourceVersionExpired as exc:
+                LOGGER.debug(
+                    "Resource version %s too old in %s watch, relisting: %s",
+                    self.resource_version,
+                    self.crd.plural,
+                    exc,
+                )
                 try:
-                    if int(event["object"]["metadata"]["resourceVersion"]) > int(
-                        self.resource_version
-                    ):
-                        self.resource_version = event["object"]["metadata"][
-                            "resourceVersion"
-                        ]
-                except (TypeError, ValueError):
-                    self.resource_version = event["object"]["metadata"][
-                        "resourceVersion"
-                    ]
-                self.callback(event, *self.cb_args, **self.cb_kwargs)
-        except ApiException as apiexc:
-            if apiexc.status != 410:
-                raise
-            self.resource_version = 0
-            self.watch()
+                    self.relists += 1
+                    listed, self.resource_version = self._list()
+                except Exception as list_exc:
+                    LOGGER.warning("Failed to relist %s: %s", self.crd.plural, list_exc)
+                    self._stop.wait(retry_delay)
+                else:
+                    self._queue.put(("list", listed))
+                    notify()
+            except Exception as exc:
+                self.errors += 1
+                LOGGER.warning("Failed to watch %s: %s", self.crd.plural, exc)
+                self._stop.wait(retry_delay)
 
+    def process_queue(self, max_items=None):
+        """Pass queued events to the callback.
 
-def _watch_cb(reactor, watcher, _r, watchers):
-    watchers.watch()
+        Return True if events remain queued because ``max_items`` was reached.
+        """
+        count = 0
+        while max_items is None or count < max_items:
+            try:
+                kind, item = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            count += 1
+            try:
+                if kind == "list":
+                    self._apply_list(item)
+                else:
+                    self._dispatch(item)
+            except Exception:
+                LOGGER.exception("Error processing %s watch event", self.crd.plural)
+        return not self._queue.empty()
+
+    def resync(self):
+        """Process queued events, then list and dispatch any changes.
+
+        On return, the callback has seen the state of every object as of the
+        time of the call.
+        """
+        self.process_queue()
+        listed, _ = self._list()
+        self._apply_list(listed)
 
 
 def _watch_test_cb(handle, _t, msg, watchers):
@@ -89,36 +428,151 @@ def _watch_test_cb(handle, _t, msg, watchers):
     handle.respond(msg)
 
 
+def _watch_stats_cb(handle, _t, msg, watchers):
+    """Respond to watch_stats RPC."""
+    try:
+        stats = watchers.stats()
+    except Exception as exc:
+        handle.respond(msg, {"success": False, "errstr": repr(exc)})
+        LOGGER.exception("Error in responding to dws.watch_stats RPC:")
+    else:
+        handle.respond(msg, {"success": True, "watches": stats})
+
+
+def _log_stats_cb(_reactor, _watcher, _r, watchers):
+    """Periodically log a summary of watch statistics."""
+    for watch in watchers.watches:
+        stats = watch.stats()
+        LOGGER.info(
+            "%s watch: %i events (%.2f/s), lag p50 %ss p99 %ss max %.1fs, "
+            "callback p99 %ss, %i queued, %i relists, %i errors",
+            watch.crd.plural,
+            sum(stats["events"].values()),
+            stats["events_per_second"],
+            stats["lag"]["p50"],
+            stats["lag"]["p99"],
+            stats["lag"]["max"],
+            stats["callback_duration"]["p99"],
+            stats["queued"],
+            stats["relists"],
+            stats["reconnects_after_error"],
+        )
+
+
+def _wakeup_cb(_handle, _watcher, fd, _revents, watchers):
+    """Drain the wakeup pipe and process queued events from every watch."""
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+    watchers.process_queues()
+
+
 class Watchers:
-    """Watch a group of resources."""
+    """Watch a group of resources.
 
-    def __init__(self, handle, watch_interval=5):
+    Every watch streams events from its own thread and connection. The
+    threads wake the reactor through a pipe, and queued events are then
+    processed on the reactor a bounded number at a time per watch, so that
+    a burst of events on one resource does not hold up the others.
+
+    Watch statistics are available through the ``dws.watch_stats`` RPC and
+    are logged every ``stats_interval`` seconds (never, if 0).
+    """
+
+    def __init__(self, handle, watch_interval=5, stats_interval=300):
         self.watches = []
+        self.held = False
         self.handle = handle
-        self.timer_fh_watch = handle.timer_watcher_create(
-            watch_interval, _watch_cb, repeat=watch_interval, args=self
+        self.retry_delay = watch_interval
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self.fd_watcher = handle.fd_watcher_create(
+            self._read_fd, _wakeup_cb, events=FLUX_POLLIN, args=self
         )
-        self.timer_fh_watch.start()
+        self.fd_watcher.start()
         # for testing purposes
         self.msg_fh_watch = handle.msg_watcher_create(
             _watch_test_cb, FLUX_MSGTYPE_REQUEST, "dws.watch_test", args=self
         )
         self.msg_fh_watch.start()
+        self.msg_fh_stats = handle.msg_watcher_create(
+            _watch_stats_cb, FLUX_MSGTYPE_REQUEST, "dws.watch_stats", args=self
+        )
+        self.msg_fh_stats.start()
+        self.stats_timer = None
+        if stats_interval > 0:
+            self.stats_timer = handle.timer_watcher_create(
+                stats_interval, _log_stats_cb, repeat=stats_interval, args=self
+            )
+            self.stats_timer.start()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.timer_fh_watch.stop()
-        self.timer_fh_watch.destroy()
+        for watch in self.watches:
+            watch.stop()
+        self.fd_watcher.stop()
+        self.fd_watcher.destroy()
         self.msg_fh_watch.stop()
         self.msg_fh_watch.destroy()
+        self.msg_fh_stats.stop()
+        self.msg_fh_stats.destroy()
+        if self.stats_timer is not None:
+            self.stats_timer.stop()
+            self.stats_timer.destroy()
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+    def _notify(self):
+        """Wake the reactor; called from watch threads."""
+        try:
+            os.write(self._write_fd, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full, so the reactor will wake anyway
 
     def add_watch(self, watch):
-        """Add a new resource to watch."""
+        """Add a new resource to watch and start watching it.
+
+        If the watchers are held, the new watch is held too.
+        """
+        if self.held:
+            watch.hold()
         self.watches.append(watch)
+        watch.start(self._notify, self.retry_delay)
+
+    def hold(self):
+        """Hold events of every watch back from the callbacks, see ``Watch.hold``.
+
+        A standby instance holds its watches, so that on taking over it only
+        has to act on the latest state of each object.
+        """
+        self.held = True
+        for watch in self.watches:
+            watch.hold()
+
+    def release(self):
+        """Pass the events held by every watch to the callbacks."""
+        self.held = False
+        for watch in self.watches:
+            watch.release()
+
+    def process_queues(self):
+        """Process up to BATCH_SIZE queued events from each watch in turn."""
+        pending = False
+        for watch in self.watches:
+            pending |= watch.process_queue(BATCH_SIZE)
+        if pending:
+            self._notify()
+
+    def stats(self):
+        """Return the statistics of every watch, keyed by resource plural."""
+        return {watch.crd.plural: watch.stats() for watch in self.watches}
 
     def watch(self):
-        """Watch all resources currently registered."""
+        """Bring every watch up to date with the current state of its resources."""
         for watch in self.watches:
-            watch.watch()
+            watch.resync()
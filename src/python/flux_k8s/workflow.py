@@ -1,14 +1,22 @@
 """Module defining classes and functions for storing and manipulating workflows."""
 
 import collections
+import functools
 import logging
 import enum
+import re
+import sys
+import time
 
 import flux
 import flux.job
 from flux.hostlist import Hostlist
 
-from flux_k8s import cleanup, crd, storage
+from kubernetes.client.rest import ApiException
+
+from flux_k8s import cleanup, config, crd, fastjson, keyed, metrics, storage
+from flux_k8s.timeline import Timeline
+from flux_k8s.ratelimit import Priority, priority
 
 
 LOGGER = logging.getLogger(__name__)
@@ -27,23 +35,72 @@ class WorkflowState(str, enum.Enum):
     TRANSIENTCONDITION = "TransientCondition"
 
 
+# matches #DW directives that move data between Lustre and the rabbits
+_STAGING_DIRECTIVE = re.compile(r"^\s*#DW\s+(copy_in|copy_out)\b")
+
+
+def staging_directives(dw_directives):
+    """Return the set of data movement directives (copy_in, copy_out) used."""
+    return {
+        match.group(1)
+        for match in map(_STAGING_DIRECTIVE.match, dw_directives)
+        if match is not None
+    }
+
+
 # Represents and holds information about a TransientCondition for a workflow
 TransientConditionInfo = collections.namedtuple(
     "TransientConditionInfo", ["last_time", "last_message", "prerun"]
 )
 
 
+DEFAULT_TTL = 3600.0  # seconds unneeded WorkflowInfo objects are kept
+
+
 class WorkflowInfo:
     """Represents and holds information about a specific workflow object.
 
-    The class offers methods for maintaining a set of instances.
+    The class offers methods for maintaining a registry of instances. Since
+    the service runs for months, instances use ``__slots__`` and allocate
+    rarely used fields only when needed, and instances that are no longer
+    needed are evicted after ``ttl`` seconds, even if the DELETED event of
+    their workflow never arrives. An instance is no longer needed once the
+    deletion of its workflow was requested, or, if it was created by ``get``
+    for a job with no known workflow, unless an event for its workflow
+    arrives in the meantime.
     """
 
+    __slots__ = (
+        "jobid",
+        "name",
+        "failure_tolerance",
+        "resources",
+        "toredown",
+        "deleted",
+        "epilog_removed",
+        "state_timer",
+        "teardown_timer",
+        "_failures",
+        "hlist",
+        "computes",
+        "timeline",
+        "staging",
+        "pending_timings",
+        "token",
+        "expires",
+    )
+
     save_datamovements = 0
+    ttl = DEFAULT_TTL
 
     _WORKFLOWINFO_CACHE = {}  # maps jobids to WorkflowInfo objects
+    _evicted = 0  # number of instances evicted
     _WORKFLOW_NAME_PREFIX = "fluxjob-"
     _WORKFLOW_NAME_FORMAT = _WORKFLOW_NAME_PREFIX + "{jobid}"
+    # labels applied to every workflow created by Flux, used to filter watches
+    LABEL = "flux-framework.readthedocs.io/wlm"
+    LABELS = {LABEL: "flux"}
+    LABEL_SELECTOR = f"{LABEL}=flux"
 
     @classmethod
     def add(cls, jobid, *args, **kwargs):
@@ -54,13 +111,48 @@ class WorkflowInfo:
 
     @classmethod
     def get(cls, jobid):
-        """Return an instance with the given jobid."""
-        return cls._WORKFLOWINFO_CACHE.setdefault(jobid, cls(jobid))
+        """Return an instance with the given jobid, creating it if needed.
+
+        A created instance expires unless ``keep`` is called on it.
+        """
+        try:
+            return cls._WORKFLOWINFO_CACHE[jobid]
+        except KeyError:
+            instance = cls._WORKFLOWINFO_CACHE[jobid] = cls(jobid)
+            instance.expire()
+            return instance
 
     @classmethod
     def remove(cls, jobid):
-        """Remove an instance with the given jobid."""
-        del cls._WORKFLOWINFO_CACHE[jobid]
+        """Remove an instance with the given jobid, if present."""
+        cls._WORKFLOWINFO_CACHE.pop(jobid, None)
+
+    @classmethod
+    def evict_expired(cls, now=None):
+        """Remove instances whose expiry time has passed; return how many."""
+        if now is None:
+            now = time.monotonic()
+        expired = [
+            jobid
+            for jobid, instance in cls._WORKFLOWINFO_CACHE.items()
+            if instance.expires is not None and instance.expires <= now
+        ]
+        for jobid in expired:
+            cls._WORKFLOWINFO_CACHE.pop(jobid).stop_timers()
+        cls._evicted += len(expired)
+        return len(expired)
+
+    @classmethod
+    def stats(cls):
+        """Return the number of instances and their approximate memory use."""
+        instances = cls._WORKFLOWINFO_CACHE.values()
+        return {
+            "entries": len(instances),
+            "expiring": sum(1 for instance in instances if instance.expires),
+            "evicted": cls._evicted,
+            "bytes": sys.getsizeof(cls._WORKFLOWINFO_CACHE)
+            + sum(instance.size() for instance in instances),
+        }
 
     @classmethod
     def get_name(cls, jobid):
@@ -88,20 +180,65 @@ class WorkflowInfo:
         self.deleted = False  # True if delete request has been sent to k8s
         self.epilog_removed = False  # True if jobtap epilog was already removed
         self.state_timer = None  # Flux timer-watcher for a state
-        self._failures = Hostlist()  # nodes that failed rabbit creation or mounting
+        self.teardown_timer = None  # Flux timer-watcher for `teardown_after`
+        self._failures = None  # nodes that failed rabbit creation or mounting
         self.hlist = None  # R hostlist for the job
+        self.computes = None  # hostnames last written to the Computes resource
+        self.timeline = Timeline()  # events of the job, saved at the end
+        self.staging = None  # set of copy_in/copy_out directives, None if unknown
+        self.pending_timings = {}  # KVS timing keys not yet written
+        self.token = None  # future for the workflow token secret, once prefetched
+        self.expires = None  # time.monotonic() deadline for eviction, if any
+
+    def keep(self):
+        """Keep the instance until ``expire`` is called."""
+        self.expires = None
+
+    def expire(self):
+        """Evict the instance ``ttl`` seconds from now."""
+        self.expires = time.monotonic() + self.ttl
+
+    def stop_timers(self):
+        """Stop any timers set for the workflow."""
+        for timer in (self.state_timer, self.teardown_timer):
+            if timer is not None:
+                timer.stop()
+
+    def size(self):
+        """Return the approximate memory used by the instance, in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.pending_timings)
+        size += sys.getsizeof(self.timeline.events)
+        for event in self.timeline.events:
+            size += sys.getsizeof(event) + sys.getsizeof(event[2])
+        return size
+
+    def stages(self, workflow, directive):
+        """Return True if a workflow has a ``copy_in`` or ``copy_out`` directive.
+
+        The directives are normally analyzed when the workflow is created; if
+        the service restarted since, analyze the workflow's directives instead.
+        """
+        if self.staging is None:
+            self.staging = staging_directives(workflow["spec"].get("dwDirectives", []))
+        return directive in self.staging
 
     def move_to_teardown(self, handle, k8s_api, workflow=None):
         """Move a workflow to the 'Teardown' desiredState."""
         if workflow is None:
-            workflow = k8s_api.get_namespaced_custom_object(
-                *crd.WORKFLOW_CRD, self.name
-            )
+            with priority(Priority.TEARDOWN):
+                workflow = fastjson.get_namespaced(k8s_api, crd.WORKFLOW_CRD, self.name)
         if self.state_timer is not None:
             self.state_timer.stop()  # if a timer is set for the current state, stop it
-        datamovements = self._get_datamovements(k8s_api)
-        save_workflow_to_kvs(handle, self.jobid, workflow, datamovements)
+        if self.staging is not None and not self.staging:
+            datamovements = []  # no copy_in or copy_out, nothing to fetch
+        else:
+            datamovements = self._get_datamovements(k8s_api)
+        save_workflow_to_kvs(
+            handle, self.jobid, workflow, datamovements, self.pending_timings
+        )
+        self.pending_timings = {}
         cleanup.teardown_workflow(workflow)
+        self.timeline.record("desired", state=WorkflowState.TEARDOWN.value)
         self.toredown = True
 
     def _get_datamovements(self, k8s_api):
@@ -114,16 +251,16 @@ class WorkflowInfo:
         if self.save_datamovements <= 0:
             return []
         try:
-            api_response = k8s_api.list_cluster_custom_object(
-                group=crd.DATAMOVEMENT_CRD.group,
-                version=crd.DATAMOVEMENT_CRD.version,
-                plural=crd.DATAMOVEMENT_CRD.plural,
-                limit=self.save_datamovements,
-                label_selector=(
-                    f"{crd.DWS_GROUP}/workflow.name={self.name},"
-                    f"{crd.DWS_GROUP}/workflow.namespace=default"
-                ),
-            )
+            with priority(Priority.BOOKKEEPING):
+                api_response = fastjson.list_cluster(
+                    k8s_api,
+                    crd.DATAMOVEMENT_CRD,
+                    limit=self.save_datamovements,
+                    label_selector=(
+                        f"{crd.DWS_GROUP}/workflow.name={self.name},"
+                        f"{crd.DWS_GROUP}/workflow.namespace=default"
+                    ),
+                )
         except Exception as exc:
             LOGGER.warning(
                 "Failed to fetch %s crds for workflow '%s': %s",
@@ -150,11 +287,28 @@ class WorkflowInfo:
         """Helper function for moving workflow to a desiredState."""
         if self.state_timer is not None:
             self.state_timer.stop()  # if a timer is set for the current state, stop it
+        self.record_desiredstate(
+            desiredstate, *self.patch_desiredstate(desiredstate, k8s_api)
+        )
+
+    def patch_desiredstate(self, desiredstate, k8s_api):
+        """Patch the workflow's desiredState; return the start time and latency.
+
+        Only the request is made, so this may be called from any thread.
+        """
+        start = time.time()
         k8s_api.patch_namespaced_custom_object(
             *crd.WORKFLOW_CRD,
             self.name,
             {"spec": {"desiredState": desiredstate}},
         )
+        return start, round(time.time() - start, 6)
+
+    def record_desiredstate(self, desiredstate, start, latency):
+        """Record a patch of the workflow's desiredState in its timeline."""
+        self.timeline.record(
+            "desired", start, state=WorkflowState(desiredstate).value, latency=latency
+        )
 
     def notify_of_node_failure(self, handle, nodes, k8s_api):
         """Post an event indicating that ``nodes`` lost their rabbit file system.
@@ -164,6 +318,8 @@ class WorkflowInfo:
         raise a ``ValueError``.
         """
         hlist = Hostlist(nodes).uniq()
+        if self._failures is None:
+            self._failures = Hostlist()
         self._failures.append(hlist)
         self._failures.uniq()
         if len(self._failures) <= self.failure_tolerance:
@@ -187,6 +343,20 @@ class WorkflowInfo:
 
         (Note this logic would break down for Lustre. However, if a rabbit fails to
         create a Lustre file system, that job fails immediately.)
+
+        The resource is first written when the workflow is moved to Setup, and
+        written again after Setup only if nodes have failed in the meantime.
+        """
+        computes = self.pending_computes(handle)
+        if computes is not None:
+            self.write_computes(k8s_api, workflow, computes)
+
+    def pending_computes(self, handle):
+        """Return the compute nodes the ``Computes`` resource should list.
+
+        Return None if the resource already lists them. The job's R is looked
+        up through ``handle`` if ``hlist`` is not set, so this must be called
+        on the reactor thread.
         """
         if self.hlist is None:  # may be set externally; if not, fetch R
             self.hlist = Hostlist(
@@ -194,25 +364,71 @@ class WorkflowInfo:
                     "execution"
                 ]["nodelist"]
             ).uniq()
-        self.hlist.delete(self._failures)
+        if self._failures is not None:
+            self.hlist.delete(self._failures)
+        computes = [
+            hostname
+            for hostname in self.hlist
+            if hostname not in storage.RABBITS_TO_HOSTLISTS
+        ]
+        if computes == self.computes:
+            return None
+        return computes
+
+    def write_computes(self, k8s_api, workflow, computes):
+        """Write ``computes`` to a workflow's ``Computes`` resource.
+
+        Only kubernetes is contacted, so this may be called on a worker thread.
+        """
         k8s_api.patch_namespaced_custom_object(
             crd.COMPUTE_CRD.group,
             crd.COMPUTE_CRD.version,
             workflow["status"]["computes"]["namespace"],
             crd.COMPUTE_CRD.plural,
             workflow["status"]["computes"]["name"],
-            {
-                "data": [
-                    {"name": hostname}
-                    for hostname in self.hlist
-                    if hostname not in storage.RABBITS_TO_HOSTLISTS
-                ]
-            },
+            {"data": [{"name": hostname} for hostname in computes]},
         )
+        self.computes = computes
 
 
-def save_workflow_to_kvs(handle, jobid, workflow, datamovements=None):
-    """Save a workflow to a job's KVS, ignoring errors."""
+def label_existing_workflows(k8s_api):
+    """Label workflows created by Flux before workflows were labeled.
+
+    Such workflows would otherwise be invisible to a watch filtered by
+    ``WorkflowInfo.LABEL_SELECTOR``. Return the number of workflows labeled.
+    """
+    labeled = 0
+    kwargs = {"label_selector": f"!{WorkflowInfo.LABEL}", "limit": 500}
+    while True:
+        api_response = fastjson.list_namespaced(k8s_api, crd.WORKFLOW_CRD, **kwargs)
+        for workflow in api_response["items"]:
+            name = workflow["metadata"]["name"]
+            if (
+                not WorkflowInfo.is_recognized(name)
+                or workflow["spec"].get("wlmID") != "flux"
+            ):
+                continue
+            try:
+                k8s_api.patch_namespaced_custom_object(
+                    *crd.WORKFLOW_CRD,
+                    name,
+                    {"metadata": {"labels": WorkflowInfo.LABELS}},
+                )
+            except ApiException as exc:
+                if exc.status != 404:
+                    raise
+            else:
+                labeled += 1
+        kwargs["_continue"] = api_response["metadata"].get("continue")
+        if not kwargs["_continue"]:
+            return labeled
+
+
+def save_workflow_to_kvs(handle, jobid, workflow, datamovements=None, timings=None):
+    """Save a workflow to a job's KVS, ignoring errors.
+
+    ``timings`` optionally maps additional timing keys to values to save.
+    """
     try:
         timing = workflow["status"]["elapsedTimeLastState"]
         state = workflow["status"]["state"].lower()
@@ -222,6 +438,8 @@ def save_workflow_to_kvs(handle, jobid, workflow, datamovements=None):
     try:
         with flux.job.job_kvs(handle, jobid) as kvsdir:
             kvsdir["rabbit_workflow"] = workflow
+            for key, value in (timings or {}).items():
+                kvsdir[key] = value
             if timing is not None and state is not None:
                 kvsdir[f"rabbit_{state}_timing"] = timing
             if datamovements is not None:
@@ -230,3 +448,366 @@ def save_workflow_to_kvs(handle, jobid, workflow, datamovements=None):
         LOGGER.exception(
             "Failed to update KVS for job %s: workflow is %s", jobid, workflow
         )
+
+
+def save_elapsed_time_to_kvs(handle, winfo, workflow, defer=False):
+    """Save the elapsedTime field to a job's KVS, ignoring errors.
+
+    Also record the time in the workflow state duration metrics.
+    If ``defer`` is True, hold the timing until the next save, so that
+    both are written in a single KVS commit.
+    """
+    try:
+        timing = workflow["status"]["elapsedTimeLastState"]
+        state = workflow["status"]["state"].lower()
+    except KeyError:
+        return
+    try:
+        metrics.WORKFLOW_STATE_DURATION.labels(state).observe(
+            metrics.parse_duration(timing)
+        )
+    except ValueError:
+        LOGGER.debug("Unrecognized elapsedTimeLastState %r", timing)
+    winfo.pending_timings[f"rabbit_{state}_timing"] = timing
+    if defer:
+        return
+    try:
+        with flux.job.job_kvs(handle, winfo.jobid) as kvsdir:
+            for key, value in winfo.pending_timings.items():
+                kvsdir[key] = value
+    except Exception:
+        LOGGER.exception(
+            "Failed to update KVS for job %s: workflow is %s", winfo.jobid, workflow
+        )
+    winfo.pending_timings = {}
+
+
+class Timing(enum.Enum):
+    """What to do with the elapsed time of a completed state."""
+
+    SAVE = "save"  # write it to the job's KVS
+    DEFER = "defer"  # write it to the job's KVS along with the next timing
+
+
+# objects the actions of transitions may need, passed to every action
+TransitionContext = collections.namedtuple(
+    "TransitionContext",
+    ["handle", "k8s_api", "secrets_api", "rabbit_manager", "disable_fluxion"],
+)
+
+
+class Transition:
+    """One step of the workflow lifecycle, taken when a state completes.
+
+    :param state: the WorkflowState whose completion triggers the transition
+    :param target: the desiredState to move the workflow to, if any
+    :param actions: callables ``action(ctx, workflow, winfo)`` run after the move
+    :param timing: a ``Timing`` for the elapsed time of ``state``, or None
+    :param timeout: name of the ConfigSnapshot attribute giving the seconds
+        the workflow may spend in ``target``, 0 for no limit
+    :param on_timeout: timer callback fired after ``timeout`` seconds, with
+        arguments ``(handle, k8s_api, winfo, ctx)``
+    :param empty_unless: data movement directive (``copy_in`` or ``copy_out``)
+        without which ``target`` has nothing to do
+    :param skippable: if ``target`` has nothing to do, skip it, taking its
+        own transition at once; otherwise the timing of ``state`` is
+        deferred so that it is written along with that of ``target``
+    """
+
+    __slots__ = (
+        "state",
+        "target",
+        "actions",
+        "timing",
+        "timeout",
+        "on_timeout",
+        "empty_unless",
+        "skippable",
+    )
+
+    def __init__(
+        self,
+        state,
+        target=None,
+        actions=(),
+        timing=None,
+        timeout=None,
+        on_timeout=None,
+        empty_unless=None,
+        skippable=False,
+    ):
+        self.state = WorkflowState(state)
+        self.target = None if target is None else WorkflowState(target)
+        self.actions = tuple(actions)
+        self.timing = timing
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.empty_unless = empty_unless
+        self.skippable = skippable
+
+
+class StateMachine:
+    """Drive workflows through their lifecycle according to a table of transitions.
+
+    ``advance`` is called with every workflow event. When the event shows that
+    a workflow completed a state, the transition for that state is taken: the
+    workflow is moved to the transition's target, its actions run, the timing
+    of the state is saved, and a timer is set for the target state. The
+    duration of each transition is recorded per state.
+
+    The number of workflows in a target state may be limited through the
+    `rabbit.transition_limits` config table; workflows completing the state
+    before it are then held until a slot frees up.
+
+    Requests to move workflows to a new desiredState are made through
+    ``executor``, so that they may run on worker threads; the rest of the
+    transition is completed on the reactor once the request is done. Events
+    of a workflow must therefore be passed to ``advance`` through
+    ``executor.run``, keyed by jobid.
+
+    :param transitions: iterable of ``Transition``, at most one per state
+    :param ctx: ``TransitionContext`` passed to actions
+    :param on_error: callable ``on_error(ctx, workflow, winfo)`` called when a
+        held or asynchronous transition fails; other transitions taken from
+        ``advance`` raise instead
+    :param executor: ``flux_k8s.keyed.KeyedExecutor`` to make requests with;
+        by default, they are made synchronously
+    :param resume: callable ``resume(ctx, workflow, winfo, elapsed)`` called
+        the first time a workflow is seen partway through a state, e.g. after
+        a restart, with the seconds since it was moved to the state, to
+        restore timers not declared by the transitions
+    """
+
+    def __init__(self, transitions, ctx, on_error=None, executor=None, resume=None):
+        self.transitions = {}
+        for transition in transitions:
+            if transition.state in self.transitions:
+                raise ValueError(f"duplicate transition for {transition.state}")
+            self.transitions[transition.state] = transition
+        self.ctx = ctx
+        self.on_error = on_error
+        self.executor = keyed.KeyedExecutor() if executor is None else executor
+        self.resume = resume
+        self._resumed = set()  # jobids whose timers have been restored
+        self._location = {}  # maps jobids to the state each workflow is working on
+        self._occupants = collections.defaultdict(set)  # state -> set of jobids
+        # maps states to the workflows waiting for a slot in them, in order
+        self._waiting = collections.defaultdict(dict)
+
+    def advance(self, workflow, winfo):
+        """Take the transition for the state the workflow just completed, if any."""
+        status = workflow["status"]
+        state = status.get("state")
+        complete = (
+            bool(status.get("ready")) and workflow["spec"]["desiredState"] == state
+        )
+        if complete or winfo.deleted:
+            self._occupy(winfo.jobid, None)
+        else:
+            self._occupy(winfo.jobid, WorkflowState(workflow["spec"]["desiredState"]))
+        if winfo.jobid not in self._resumed:
+            self._resumed.add(winfo.jobid)
+            if not complete and not winfo.deleted and not winfo.toredown:
+                self._resume(workflow, winfo)
+        if not complete:
+            return
+        transition = self.transitions.get(state)
+        if transition is None:
+            return
+        if winfo.toredown and transition.state != WorkflowState.TEARDOWN:
+            # in the event of an exception, the workflow will skip to 'teardown'.
+            # Without this early 'return', the machine may try to move a
+            # 'teardown' workflow to an earlier state because the 'teardown'
+            # update is still in the k8s update queue.
+            return
+        target = transition.target
+        if (
+            target is not None
+            and not self._skips(transition, workflow, winfo)
+            and self._full(target)
+        ):
+            self._waiting[target][winfo.jobid] = (workflow, winfo)
+            metrics.TRANSITIONS_HELD.labels(target.value).inc()
+            return
+        self._take(transition, workflow, winfo)
+        if transition.state == WorkflowState.TEARDOWN:
+            self.forget(winfo.jobid)
+
+    def forget(self, jobid):
+        """Stop tracking a workflow, e.g. once it has been deleted."""
+        for waiting in self._waiting.values():
+            waiting.pop(jobid, None)
+        self._resumed.discard(jobid)
+        self._occupy(jobid, None)
+
+    def prune(self, known):
+        """Stop tracking workflows whose jobids are not in ``known``."""
+        for jobid in [jobid for jobid in self._location if jobid not in known]:
+            self.forget(jobid)
+        self._resumed.intersection_update(known)
+        for waiting in self._waiting.values():
+            for jobid in [jobid for jobid in waiting if jobid not in known]:
+                del waiting[jobid]
+
+    def stats(self):
+        """Return the number of workflows in, and waiting for, each state."""
+        return {
+            "occupants": {
+                state.value: len(jobids)
+                for state, jobids in self._occupants.items()
+                if jobids
+            },
+            "waiting": {
+                state.value: len(waiting)
+                for state, waiting in self._waiting.items()
+                if waiting
+            },
+        }
+
+    def _limit(self, state):
+        return config.current().transition_limits.get(state.value, 0)
+
+    def _full(self, state):
+        limit = self._limit(state)
+        return limit > 0 and len(self._occupants[state]) >= limit
+
+    def _occupy(self, jobid, state):
+        """Record that a workflow is working on ``state`` (None for no state)."""
+        old = self._location.pop(jobid, None)
+        if old is not None:
+            self._occupants[old].discard(jobid)
+        if state is not None:
+            self._location[jobid] = state
+            self._occupants[state].add(jobid)
+        if old is not None and old != state:
+            self._release(old)
+
+    def _release(self, state):
+        """Take held transitions into ``state`` while it has free slots."""
+        waiting = self._waiting.get(state)
+        while waiting and not self._full(state):
+            jobid = next(iter(waiting))
+            workflow, winfo = waiting.pop(jobid)
+            if winfo.toredown or winfo.deleted:
+                continue
+            try:
+                self._take(
+                    self.transitions[workflow["status"]["state"]], workflow, winfo
+                )
+            except Exception:
+                LOGGER.exception("Failed to take held transition of job %s", jobid)
+                self._fail(workflow, winfo)
+
+    def _fail(self, workflow, winfo):
+        if self.on_error is not None:
+            self.on_error(self.ctx, workflow, winfo)
+
+    @staticmethod
+    def _empty(transition, workflow, winfo):
+        """Return True if the target of ``transition`` has nothing to do."""
+        return transition.empty_unless is not None and not winfo.stages(
+            workflow, transition.empty_unless
+        )
+
+    def _skips(self, transition, workflow, winfo):
+        """Return True if the target of ``transition`` is to be skipped."""
+        return transition.skippable and self._empty(transition, workflow, winfo)
+
+    def _take(self, transition, workflow, winfo, skipped=False):
+        """Take a transition; ``skipped`` if ``transition.state`` was skipped."""
+        start = time.perf_counter()
+        ctx = self.ctx
+        timing = None if skipped else transition.timing
+        target = transition.target
+        if target is not None and self._empty(transition, workflow, winfo):
+            if transition.skippable:
+                # the target state has nothing to do: take its transition now,
+                # which saves this state's timing along with its own writes
+                for action in transition.actions:
+                    action(ctx, workflow, winfo)
+                if timing is not None:
+                    save_elapsed_time_to_kvs(ctx.handle, winfo, workflow, defer=True)
+                self._take(self.transitions[target], workflow, winfo, skipped=True)
+                metrics.TRANSITION_DURATION.labels(transition.state.value).observe(
+                    time.perf_counter() - start
+                )
+                return
+            if timing is Timing.SAVE:
+                timing = Timing.DEFER
+        if winfo.state_timer is not None:
+            winfo.state_timer.stop()
+        if target is not None:
+            self._occupy(winfo.jobid, target)
+        if target == WorkflowState.TEARDOWN:
+            winfo.move_to_teardown(ctx.handle, ctx.k8s_api, workflow)
+        elif target is not None:
+            # complete the transition once the workflow has been patched
+            self.executor.submit(
+                winfo.jobid,
+                functools.partial(winfo.patch_desiredstate, target, ctx.k8s_api),
+                functools.partial(
+                    self._moved, transition, workflow, winfo, timing, start
+                ),
+            )
+            return
+        self._finish(transition, workflow, winfo, timing, start)
+
+    def _moved(self, transition, workflow, winfo, timing, start, future):
+        """Complete a transition once the desiredState patch is done."""
+        try:
+            winfo.record_desiredstate(transition.target, *future.result())
+            if winfo.toredown or winfo.deleted:
+                return  # the workflow was moved to Teardown in the meantime
+            self._finish(transition, workflow, winfo, timing, start)
+        except Exception:
+            LOGGER.exception("Failed to take transition of job %s", winfo.jobid)
+            self._fail(workflow, winfo)
+
+    def _arm(self, transition, winfo, elapsed):
+        """Set the timer for the target of a transition, ``elapsed`` seconds in."""
+        seconds = getattr(config.current(), transition.timeout)
+        if seconds > 0:
+            ctx = self.ctx
+            winfo.state_timer = ctx.handle.timer_watcher_create(
+                max(seconds - elapsed, 0.0),
+                transition.on_timeout,
+                args=(ctx.handle, ctx.k8s_api, winfo, ctx),
+            ).start()
+
+    def _resume(self, workflow, winfo):
+        """Restore the timers of a workflow first seen partway through a state.
+
+        The workflow was moved to the state by a previous instance of the
+        service, so the timer for the state is set for the time remaining
+        since the workflow's desiredState changed.
+        """
+        try:
+            elapsed = max(
+                time.time()
+                - metrics.parse_timestamp(workflow["status"]["desiredStateChange"]),
+                0.0,
+            )
+        except (KeyError, TypeError, ValueError):
+            elapsed = 0.0
+        desired = workflow["spec"]["desiredState"]
+        if winfo.state_timer is None:
+            for transition in self.transitions.values():
+                if transition.target == desired and transition.timeout is not None:
+                    self._arm(transition, winfo, elapsed)
+        if self.resume is not None:
+            self.resume(self.ctx, workflow, winfo, elapsed)
+
+    def _finish(self, transition, workflow, winfo, timing, start):
+        """Run the actions of a transition and save timings and timers."""
+        ctx = self.ctx
+        for action in transition.actions:
+            action(ctx, workflow, winfo)
+        if timing is not None:
+            save_elapsed_time_to_kvs(
+                ctx.handle, winfo, workflow, defer=timing is Timing.DEFER
+            )
+        if transition.timeout is not None:
+            self._arm(transition, winfo, 0.0)
+        metrics.TRANSITION_DURATION.labels(transition.state.value).observe(
+            time.perf_counter() - start
+        )
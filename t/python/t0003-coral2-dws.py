@@ -10,6 +10,8 @@
 # SPDX-License-Identifier: LGPL-3.0
 ###############################################################
 
+import base64
+import concurrent.futures
 import sys
 import unittest
 import unittest.mock
@@ -22,6 +24,7 @@ from pycotap import TAPTestRunner
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src" / "modules"))
 
 import coral2_dws
+from flux_k8s import ratelimit
 
 
 class Coral2DwsTests(unittest.TestCase):
@@ -54,5 +57,54 @@ class Coral2DwsTests(unittest.TestCase):
             ret = coral2_dws.parse_dw_directives(arg, presets)
             self.assertSequenceEqual(ret, exp)
 
+    def test_fetch_job_environment(self):
+        secrets_api = unittest.mock.Mock()
+        secrets_api.read_namespaced_secret.return_value.data = {
+            "token": base64.b64encode(b"abc").decode()
+        }
+        workflow = {
+            "status": {
+                "env": {"DW_JOB_x": "/mnt/x"},
+                "workflowToken": {"secretName": "s", "secretNamespace": "ns"},
+            }
+        }
+        winfo = unittest.mock.Mock(token=None)
+        coral2_dws.prefetch_workflow_token(secrets_api, winfo, workflow)
+        winfo.token.result()
+        variables = coral2_dws.fetch_job_environment(secrets_api, workflow, winfo.token)
+        self.assertEqual(variables["DW_WORKFLOW_TOKEN"], "abc")
+        self.assertEqual(variables["DW_JOB_x"], "/mnt/x")
+        secrets_api.read_namespaced_secret.assert_called_once_with("s", "ns")
+        # a failed prefetch falls back to reading the secret
+        failed = concurrent.futures.Future()
+        failed.set_exception(RuntimeError("secret not found"))
+        variables = coral2_dws.fetch_job_environment(secrets_api, workflow, failed)
+        self.assertEqual(variables["DW_WORKFLOW_TOKEN"], "abc")
+        self.assertEqual(secrets_api.read_namespaced_secret.call_count, 2)
+        # so does one that has not finished, rather than waiting on it
+        pending = concurrent.futures.Future()
+        variables = coral2_dws.fetch_job_environment(secrets_api, workflow, pending)
+        self.assertEqual(variables["DW_WORKFLOW_TOKEN"], "abc")
+        self.assertEqual(secrets_api.read_namespaced_secret.call_count, 3)
+
+    def test_submit_request_priority(self):
+        with ratelimit.priority(ratelimit.Priority.TEARDOWN):
+            future = coral2_dws.submit_request(ratelimit.current_priority)
+        self.assertEqual(future.result(), ratelimit.Priority.TEARDOWN)
+
+    def test_staging_directives(self):
+        directives = coral2_dws.parse_dw_directives(
+            "#DW jobdw type=xfs capacity=1GiB name=x "
+            "#DW copy_in source=/l/in destination=$DW_JOB_x/ "
+            "#DW copy_out source=$DW_JOB_x/ destination=/l/out",
+            {},
+        )
+        self.assertEqual(
+            coral2_dws.staging_directives(directives), {"copy_in", "copy_out"}
+        )
+        self.assertEqual(
+            coral2_dws.staging_directives(["#DW jobdw type=xfs name=copy_in"]), set()
+        )
+
 
 unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import threading
+import time
+import unittest
+import unittest.mock
+
+import urllib3
+from kubernetes.client.rest import ApiException
+
+from flux_k8s import client, fastjson, metrics, ratelimit, retry
+
+from pycotap import TAPTestRunner
+
+
+class RESTClientWrapperTests(unittest.TestCase):
+    """Tests for the RESTClientObject wrapper used by the ClientFactory."""
+
+    def test_default_timeout(self):
+        rest_mock = unittest.mock.Mock()
+        wrapper = client._RESTClientWrapper(rest_mock, 30)
+        wrapper.request("GET", "https://foo/bar")
+        rest_mock.request.assert_called_once_with(
+            "GET", "https://foo/bar", _request_timeout=30
+        )
+
+    def test_explicit_timeout(self):
+        rest_mock = unittest.mock.Mock()
+        wrapper = client._RESTClientWrapper(rest_mock, 30)
+        wrapper.request("GET", "https://foo/bar", _request_timeout=5)
+        rest_mock.request.assert_called_once_with(
+            "GET", "https://foo/bar", _request_timeout=5
+        )
+
+    def test_passthrough(self):
+        rest_mock = unittest.mock.Mock()
+        wrapper = client._RESTClientWrapper(rest_mock, 30)
+        self.assertIs(wrapper.pool_manager, rest_mock.pool_manager)
+
+    def test_retry_transient(self):
+        rest_mock = unittest.mock.Mock()
+        rest_mock.request.side_effect = [ApiException(status=503), "response"]
+        policy = retry.RetryPolicy(retries=2, base_delay=0)
+        wrapper = client._RESTClientWrapper(rest_mock, 30, policy=policy)
+        self.assertEqual(wrapper.request("PATCH", "https://foo/bar"), "response")
+        self.assertEqual(rest_mock.request.call_count, 2)
+
+    def test_no_retry(self):
+        policy = retry.RetryPolicy(retries=2, base_delay=0)
+        for method, exc in (
+            ("GET", ApiException(status=404)),
+            ("POST", ApiException(status=503)),
+        ):
+            rest_mock = unittest.mock.Mock()
+            rest_mock.request.side_effect = exc
+            wrapper = client._RESTClientWrapper(rest_mock, 30, policy=policy)
+            with self.assertRaises(ApiException):
+                wrapper.request(method, "https://foo/bar")
+            self.assertEqual(rest_mock.request.call_count, 1)
+
+    def test_reactor_fails_fast(self):
+        rest_mock = unittest.mock.Mock()
+        rest_mock.request.side_effect = ApiException(status=503)
+        policy = retry.RetryPolicy(retries=2, base_delay=0)
+        wrapper = client._RESTClientWrapper(
+            rest_mock, 30, policy=policy, reactor_timeout=5
+        )
+        patcher = unittest.mock.patch.object(client, "_REACTOR_THREAD")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client.set_reactor_thread()
+        with self.assertRaises(ApiException):
+            wrapper.request("GET", "https://foo/bar")
+        rest_mock.request.assert_called_once_with(
+            "GET", "https://foo/bar", _request_timeout=5
+        )
+        rest_mock.reset_mock()
+        rest_mock.request.side_effect = None
+        wrapper.request("GET", "https://foo/bar", _request_timeout=2)
+        rest_mock.request.assert_called_once_with(
+            "GET", "https://foo/bar", _request_timeout=2
+        )
+        # other threads still retry
+        rest_mock.reset_mock()
+        rest_mock.request.side_effect = [ApiException(status=503), "response"]
+        thread = threading.Thread(target=wrapper.request, args=("GET", "https://foo"))
+        thread.start()
+        thread.join()
+        self.assertEqual(rest_mock.request.call_count, 2)
+
+    def test_reactor_throttled(self):
+        rest_mock = unittest.mock.Mock()
+        limiter = ratelimit.PriorityLimiter(0.01, 1)
+        limiter.acquire()  # drain the bucket
+        wrapper = client._RESTClientWrapper(
+            rest_mock, 30, limiter=limiter, reactor_timeout=0.05
+        )
+        patcher = unittest.mock.patch.object(client, "_REACTOR_THREAD")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client.set_reactor_thread()
+        with self.assertRaises(ratelimit.ThrottledError):
+            wrapper.request("GET", "https://foo/bar")
+        rest_mock.request.assert_not_called()
+        self.assertEqual(limiter.queue_depth, 0)
+
+    def test_breaker_rejects(self):
+        rest_mock = unittest.mock.Mock()
+        rest_mock.request.side_effect = urllib3.exceptions.ProtocolError("boom")
+        breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        wrapper = client._RESTClientWrapper(rest_mock, 30, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(urllib3.exceptions.ProtocolError):
+                wrapper.request("GET", "https://foo/bar")
+        with self.assertRaises(retry.CircuitOpenError):
+            wrapper.request("GET", "https://foo/bar")
+        self.assertEqual(rest_mock.request.call_count, 2)
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_metrics(self):
+        url = (
+            "https://foo/apis/dataworkflowservices.github.io/v1alpha2/"
+            "namespaces/default/workflows/fluxjob-1?dryRun=All"
+        )
+        self.assertEqual(client._resource_of(url), "workflows")
+        self.assertEqual(client._resource_of("https://foo/api/v1/nodes"), "nodes")
+        self.assertEqual(
+            client._resource_of("https://foo/api/v1/namespaces/default"), "namespaces"
+        )
+        self.assertEqual(client._resource_of("https://foo/version"), "other")
+        rest_mock = unittest.mock.Mock()
+        rest_mock.request.side_effect = [
+            unittest.mock.Mock(status=200),
+            ApiException(status=404),
+        ]
+        wrapper = client._RESTClientWrapper(rest_mock, 30)
+        requests = metrics.K8S_REQUESTS
+        before = {
+            status: requests.labels("get", "workflows", status).get()
+            for status in (200, 404)
+        }
+        wrapper.request("GET", url)
+        with self.assertRaises(ApiException):
+            wrapper.request("GET", url)
+        for status in (200, 404):
+            self.assertEqual(
+                requests.labels("get", "workflows", status).get(), before[status] + 1
+            )
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """Tests for the retry.CircuitBreaker class."""
+
+    def test_half_open(self):
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure(urllib3.exceptions.TimeoutError())
+        self.assertEqual(breaker.state, retry.BreakerState.OPEN)
+        breaker.before_request()  # reset timeout elapsed, trial request allowed
+        self.assertEqual(breaker.state, retry.BreakerState.HALF_OPEN)
+        with self.assertRaises(retry.CircuitOpenError):
+            breaker.before_request()  # only one trial request at a time
+        breaker.record_success()
+        self.assertEqual(breaker.state, retry.BreakerState.CLOSED)
+
+    def test_failed_trial_doubles_timeout(self):
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=0.5)
+        breaker.record_failure(urllib3.exceptions.TimeoutError())
+        breaker._opened_at -= 1
+        breaker.before_request()
+        breaker.record_failure(urllib3.exceptions.TimeoutError())
+        self.assertEqual(breaker.state, retry.BreakerState.OPEN)
+        self.assertEqual(breaker.stats()["reset_timeout"], 1)
+        self.assertEqual(breaker.trips, 2)
+
+    def test_non_transient(self):
+        breaker = retry.CircuitBreaker(failure_threshold=1)
+        breaker.record_failure(ApiException(status=404))
+        self.assertEqual(breaker.state, retry.BreakerState.CLOSED)
+
+
+class ClientFactoryTests(unittest.TestCase):
+    """Tests for the ClientFactory class."""
+
+    def test_pool_stats_empty(self):
+        factory = client.ClientFactory()
+        self.assertEqual(factory.pool_stats()["connections"], 0)
+
+    def test_pool_stats(self):
+        factory = client.ClientFactory()
+        pool = unittest.mock.Mock(num_connections=2, num_requests=8)
+        api_client = unittest.mock.Mock()
+        api_client.rest_client.pool_manager.pools = {"key": pool}
+        factory._api_client = api_client
+        stats = factory.pool_stats()
+        self.assertEqual(stats["pools"], 1)
+        self.assertEqual(stats["connections"], 2)
+        self.assertEqual(stats["requests"], 8)
+        self.assertAlmostEqual(stats["reuse_ratio"], 0.75)
+
+    def test_shared_apis(self):
+        factory = client.ClientFactory()
+        factory._api_client = unittest.mock.Mock()
+        self.assertIs(factory.custom_objects_api(), factory.custom_objects_api())
+        self.assertIs(
+            factory.core_v1_api().api_client, factory.custom_objects_api().api_client
+        )
+
+    def test_keepalive_options(self):
+        options = client._keepalive_socket_options()
+        self.assertIn(
+            (client.socket.SOL_SOCKET, client.socket.SO_KEEPALIVE, 1), options
+        )
+
+
+class PriorityLimiterTests(unittest.TestCase):
+    """Tests for the ratelimit.PriorityLimiter class."""
+
+    def _wait_for_waiters(self, limiter, count):
+        deadline = time.monotonic() + 5
+        while limiter.queue_depth < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(limiter.queue_depth, count)
+
+    def test_burst(self):
+        limiter = ratelimit.PriorityLimiter(1, 5)
+        for _ in range(5):
+            self.assertLess(limiter.acquire(), 0.1)
+        self.assertEqual(limiter.stats()["granted"]["WORKFLOW"], 5)
+
+    def test_priority_order(self):
+        limiter = ratelimit.PriorityLimiter(20, 1)
+        limiter.acquire()  # drain the bucket
+        order = []
+
+        def acquire(prio):
+            limiter.acquire(prio)
+            order.append(prio)
+
+        threads = []
+        for count, prio in enumerate(
+            (ratelimit.Priority.BOOKKEEPING, ratelimit.Priority.TEARDOWN), start=1
+        ):
+            threads.append(threading.Thread(target=acquire, args=(prio,)))
+            threads[-1].start()
+            self._wait_for_waiters(limiter, count)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            order, [ratelimit.Priority.TEARDOWN, ratelimit.Priority.BOOKKEEPING]
+        )
+
+    def test_timeout(self):
+        limiter = ratelimit.PriorityLimiter(0.01, 1)
+        limiter.acquire()  # drain the bucket
+        start = time.monotonic()
+        with self.assertRaises(ratelimit.ThrottledError):
+            limiter.acquire(timeout=0.05)
+        self.assertLess(time.monotonic() - start, 1)
+        stats = limiter.stats()
+        self.assertEqual(stats["waiting"], 0)
+        self.assertEqual(stats["granted"]["WORKFLOW"], 1)
+
+    def test_priority_context(self):
+        self.assertEqual(ratelimit.current_priority(), ratelimit.Priority.WORKFLOW)
+        with ratelimit.priority(ratelimit.Priority.TEARDOWN):
+            self.assertEqual(ratelimit.current_priority(), ratelimit.Priority.TEARDOWN)
+        self.assertEqual(ratelimit.current_priority(), ratelimit.Priority.WORKFLOW)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            ratelimit.PriorityLimiter(0, 1)
+
+
+class CoalescerTests(unittest.TestCase):
+    """Tests for the ratelimit.Coalescer class."""
+
+    def test_coalesce(self):
+        coalescer = ratelimit.Coalescer()
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(None)
+            release.wait()
+            return "result"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(coalescer.run("key", func)))
+            for _ in range(3)
+        ]
+        threads[0].start()
+        while not calls:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        while coalescer.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 3)
+
+    def test_exception(self):
+        coalescer = ratelimit.Coalescer()
+        with self.assertRaises(RuntimeError):
+            coalescer.run("key", unittest.mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(coalescer.run("key", lambda: 5), 5)
+
+    def test_only_lists_coalesced(self):
+        class FakeAPI:
+            def list_namespaced_custom_object(self, *args, **kwargs):
+                return unittest.mock.Mock(data=b"{}")
+
+            def get_namespaced_custom_object(self, *args, **kwargs):
+                return unittest.mock.Mock(data=b"{}")
+
+        api = FakeAPI()
+        with unittest.mock.patch.object(ratelimit, "COALESCER") as coalescer:
+            coalescer.run.return_value = b"{}"
+            self.assertEqual(fastjson.call(api.get_namespaced_custom_object, "a"), {})
+            coalescer.run.assert_not_called()
+            fastjson.call(api.list_namespaced_custom_object, "a")
+            coalescer.run.assert_called_once()
+            # lists made on the reactor never wait on another thread's request
+            coalescer.reset_mock()
+            patcher = unittest.mock.patch.object(client, "_REACTOR_THREAD")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            client.set_reactor_thread()
+            self.assertEqual(fastjson.call(api.list_namespaced_custom_object, "a"), {})
+            coalescer.run.assert_not_called()
+
+
+unittest.main(testRunner=TAPTestRunner())
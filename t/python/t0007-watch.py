@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import threading
+import time
+import unittest
+import unittest.mock
+
+from kubernetes.client.rest import ApiException
+
+from flux_k8s import crd, fastjson, watch
+
+from pycotap import TAPTestRunner
+
+
+def make_obj(name, resource_version):
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": "default",
+            "resourceVersion": str(resource_version),
+        },
+        "spec": {"jobID": name},
+        "status": {"state": "Proposal"},
+    }
+
+
+class FakeAPI:
+    """Stand-in for a CustomObjectsApi serving canned watch events and lists."""
+
+    def __init__(self, streams, items=(), list_version="100"):
+        self.streams = list(streams)
+        self.items = list(items)
+        self.list_version = list_version
+        self.watch_kwargs = []
+
+    def list_namespaced_custom_object(self, *args, **kwargs):
+        if kwargs.get("watch"):
+            self.watch_kwargs.append(kwargs)
+            stream = self.streams.pop(0)
+            if isinstance(stream, Exception):
+                raise stream
+            return stream
+        return {
+            "metadata": {"resourceVersion": self.list_version},
+            "items": self.items,
+        }
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        fastjson.ENABLED = False
+        patcher = unittest.mock.patch.object(
+            watch.Watch,
+            "_open_stream",
+            lambda self, kw: self.api.list_namespaced_custom_object(*self.crd, **kw),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, fastjson, "ENABLED", True)
+
+    def callback(self, event):
+        self.events.append((event["type"], event["object"]["metadata"]["name"]))
+
+    def test_bookmarks(self):
+        api = FakeAPI(
+            [
+                [
+                    {"type": "ADDED", "object": make_obj("a", 5)},
+                    {
+                        "type": "BOOKMARK",
+                        "object": {"metadata": {"resourceVersion": "9"}},
+                    },
+                ]
+            ]
+        )
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.watch()
+        self.assertEqual(self.events, [("ADDED", "a")])
+        self.assertEqual(w.resource_version, "9")
+        self.assertTrue(api.watch_kwargs[0]["allow_watch_bookmarks"])
+
+    def test_relist_on_error_event(self):
+        api = FakeAPI(
+            [
+                [
+                    {"type": "ADDED", "object": make_obj("a", 5)},
+                    {"type": "ADDED", "object": make_obj("b", 6)},
+                    {"type": "ADDED", "object": make_obj("c", 7)},
+                ],
+                [{"type": "ERROR", "object": {"code": 410, "message": "too old"}}],
+                [],
+            ],
+            items=[make_obj("a", 5), make_obj("b", 8), make_obj("d", 9)],
+        )
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.watch()
+        self.events.clear()
+        w.watch()
+        self.assertEqual(
+            sorted(self.events), [("ADDED", "d"), ("DELETED", "c"), ("MODIFIED", "b")]
+        )
+        self.assertEqual(w.relists, 1)
+        self.assertEqual(w.resource_version, "100")
+        self.assertEqual(api.watch_kwargs[-1]["resource_version"], "100")
+
+    def test_relist_on_exception(self):
+        api = FakeAPI(
+            [ApiException(status=410), []],
+            items=[make_obj("a", 5), make_obj("b", 6)],
+        )
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 3, self.callback)
+        w.prime([make_obj("a", 5)])
+        w.watch()
+        self.assertEqual(self.events, [("ADDED", "b")])
+
+    def test_deleted_tombstone(self):
+        api = FakeAPI(
+            [
+                [{"type": "ADDED", "object": make_obj("a", 5)}],
+                ApiException(status=410),
+                [],
+            ]
+        )
+        deleted = []
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, deleted.append)
+        w.watch()
+        w.watch()
+        self.assertEqual(deleted[-1]["type"], "DELETED")
+        self.assertEqual(deleted[-1]["object"]["spec"], {"jobID": "a"})
+        self.assertNotIn("status", deleted[-1]["object"])
+
+    def test_hold(self):
+        api = FakeAPI(
+            [
+                [
+                    {"type": "ADDED", "object": make_obj("a", 5)},
+                    {"type": "ADDED", "object": make_obj("b", 6)},
+                    {"type": "MODIFIED", "object": make_obj("a", 7)},
+                    {"type": "ADDED", "object": make_obj("c", 8)},
+                    {"type": "DELETED", "object": make_obj("c", 9)},
+                ]
+            ]
+        )
+        received = []
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, received.append)
+        w.hold()
+        w.watch()
+        self.assertEqual(received, [])
+        # c was created and deleted while held, so it is forgotten
+        self.assertEqual(w.stats()["held"], 2)
+        w.release()
+        self.assertEqual(
+            [
+                (event["type"], event["object"]["metadata"]["resourceVersion"])
+                for event in received
+            ],
+            [("MODIFIED", "7"), ("ADDED", "6")],
+        )
+        self.assertEqual(w.stats()["held"], 0)
+
+    def test_hold_deleted_seen(self):
+        api = FakeAPI(
+            [
+                [{"type": "ADDED", "object": make_obj("a", 5)}],
+                [{"type": "DELETED", "object": make_obj("a", 6)}],
+            ]
+        )
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.watch()
+        w.hold()
+        w.watch()
+        # the callback saw a, so it must hear of its deletion
+        self.assertEqual(w.stats()["held"], 1)
+        w.release()
+        self.assertEqual(self.events, [("ADDED", "a"), ("DELETED", "a")])
+
+    def test_selectors(self):
+        api = FakeAPI([[]], items=[make_obj("a", 5)])
+        w = watch.Watch(
+            api, crd.WORKFLOW_CRD, 0, self.callback, label_selector="foo=bar"
+        )
+        w.watch()
+        self.assertEqual(api.watch_kwargs[0]["label_selector"], "foo=bar")
+        self.assertNotIn("field_selector", api.watch_kwargs[0])
+
+    def test_duplicate_versions_dropped(self):
+        api = FakeAPI(
+            [
+                [
+                    {"type": "ADDED", "object": make_obj("a", 5)},
+                    {"type": "MODIFIED", "object": make_obj("a", 5)},
+                    {"type": "MODIFIED", "object": make_obj("a", 4)},
+                    {"type": "MODIFIED", "object": make_obj("a", 6)},
+                ]
+            ]
+        )
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.watch()
+        self.assertEqual(self.events, [("ADDED", "a"), ("MODIFIED", "a")])
+
+    def test_thread(self):
+        api = FakeAPI(
+            [
+                [{"type": "ADDED", "object": make_obj("a", 5)}],
+                ApiException(status=410),
+            ],
+            items=[make_obj("a", 5), make_obj("b", 6)],
+        )
+        notified = threading.Semaphore(0)
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.start(notified.release, retry_delay=0.01, timeout=5)
+        self.addCleanup(w.stop)
+        # one notification for the event, one for the relist
+        for _ in range(2):
+            self.assertTrue(notified.acquire(timeout=5))
+        self.assertEqual(self.events, [])
+        self.assertFalse(w.process_queue())
+        self.assertEqual(self.events, [("ADDED", "a"), ("ADDED", "b")])
+        self.assertEqual(api.watch_kwargs[0]["timeout_seconds"], 5)
+
+    def test_error_event_backoff(self):
+        status = {"kind": "Status", "code": 403, "message": "forbidden"}
+        api = FakeAPI([[{"type": "ERROR", "object": status}]])
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        with self.assertRaises(watch.WatchError):
+            w.watch()
+        api = FakeAPI([[{"type": "ERROR", "object": status}]])
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.start(lambda: None, retry_delay=60, timeout=5)
+        self.addCleanup(w.stop)
+        deadline = time.monotonic() + 5
+        while not w.errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        # the stream is not reopened until the retry delay has passed
+        self.assertEqual(w.errors, 1)
+        self.assertEqual(len(api.watch_kwargs), 1)
+
+    def test_process_queue_bounded(self):
+        w = watch.Watch(FakeAPI([]), crd.WORKFLOW_CRD, 0, self.callback)
+        for i in range(3):
+            w._queue.put(("event", {"type": "ADDED", "object": make_obj(str(i), 1)}))
+        self.assertTrue(w.process_queue(2))
+        self.assertEqual(len(self.events), 2)
+        self.assertFalse(w.process_queue(2))
+        self.assertEqual(len(self.events), 3)
+
+    def test_resync(self):
+        api = FakeAPI([], items=[make_obj("a", 5)])
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w._queue.put(("event", {"type": "ADDED", "object": make_obj("b", 3)}))
+        w.resync()
+        self.assertEqual(
+            self.events, [("ADDED", "b"), ("DELETED", "b"), ("ADDED", "a")]
+        )
+
+    def test_stats(self):
+        obj = make_obj("a", 5)
+        obj["metadata"]["managedFields"] = [
+            {"manager": "dws", "time": "1970-01-01T00:00:00Z"},
+            {"manager": "flux", "time": "2000-01-01T00:00:00Z"},
+        ]
+        obj["status"]["desiredStateChange"] = "2001-01-01T00:00:00.500000Z"
+        self.assertEqual(watch.transition_time(obj), 978307200.5)
+        api = FakeAPI([[{"type": "ADDED", "object": obj}]])
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        w.watch()
+        stats = w.stats()
+        self.assertEqual(stats["events"], {"ADDED": 1})
+        self.assertEqual(stats["lag"]["count"], 1)
+        self.assertGreater(stats["lag"]["max"], 0)
+        self.assertEqual(stats["callback_duration"]["count"], 1)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_other_api_errors_raise(self):
+        api = FakeAPI([ApiException(status=500)])
+        w = watch.Watch(api, crd.WORKFLOW_CRD, 0, self.callback)
+        with self.assertRaises(ApiException):
+            w.watch()
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import os
+import tempfile
+import unittest
+
+from flux_k8s import metrics
+
+from pycotap import TAPTestRunner
+
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        hist = metrics.Histogram((1, 2))
+        snapshot = hist.snapshot()
+        self.assertEqual(snapshot["count"], 0)
+        self.assertEqual(snapshot["mean"], 0.0)
+        self.assertEqual(snapshot["p99"], 0.0)
+
+    def test_buckets(self):
+        hist = metrics.Histogram((1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            hist.observe(value)
+        snapshot = hist.snapshot()
+        self.assertEqual(snapshot["count"], 5)
+        self.assertEqual(snapshot["sum"], 16.0)
+        self.assertEqual(snapshot["max"], 10)
+        self.assertEqual(snapshot["buckets"], {"1": 2, "2": 3, "4": 4, "+Inf": 5})
+        self.assertEqual(hist.quantile(0.4), 1)
+        self.assertEqual(hist.quantile(0.5), 2)
+        self.assertEqual(hist.quantile(1.0), float("inf"))
+
+
+class TestRateCounter(unittest.TestCase):
+    def test_rate(self):
+        counter = metrics.RateCounter(window=10)
+        counter.add(5)
+        counter.add()
+        self.assertEqual(counter.total, 6)
+        self.assertAlmostEqual(counter.rate(), 0.6)
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def test_whole_seconds(self):
+        self.assertEqual(metrics.parse_timestamp("1970-01-01T00:01:00Z"), 60.0)
+
+    def test_fractional_seconds(self):
+        self.assertAlmostEqual(
+            metrics.parse_timestamp("1970-01-01T00:01:00.250000Z"), 60.25
+        )
+
+
+class TestParseDuration(unittest.TestCase):
+    def test_durations(self):
+        self.assertEqual(metrics.parse_duration("1.5s"), 1.5)
+        self.assertEqual(metrics.parse_duration("1h2m3s"), 3723.0)
+        self.assertAlmostEqual(metrics.parse_duration("250ms"), 0.25)
+        self.assertAlmostEqual(metrics.parse_duration("3µs"), 3e-6)
+
+    def test_invalid(self):
+        for duration in ("", "5", "1.5sx", "s"):
+            with self.assertRaises(ValueError):
+                metrics.parse_duration(duration)
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(
+            metrics.Counter("requests_total", "Requests.", ["topic"])
+        )
+        counter.labels("dws.create").inc()
+        counter.labels("dws.create").inc(2)
+        counter.labels('a"b').inc()
+        self.assertEqual(
+            self.registry.expose(),
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{topic="a\\"b"} 1\n'
+            'requests_total{topic="dws.create"} 3\n',
+        )
+        with self.assertRaises(ValueError):
+            counter.labels()
+        with self.assertRaises(ValueError):
+            self.registry.register(metrics.Counter("requests_total", ""))
+
+    def test_gauge_function(self):
+        gauge = self.registry.register(
+            metrics.Gauge("pending", "Pending.", ["type"], function=lambda: {})
+        )
+        gauge.function = lambda: {("delete",): 2, ("teardown",): 0}
+        lines = self.registry.expose().splitlines()
+        self.assertEqual(
+            lines[2:], ['pending{type="delete"} 2', 'pending{type="teardown"} 0']
+        )
+
+    def test_histogram(self):
+        hist = self.registry.register(
+            metrics.LabeledHistogram("latency_seconds", "Latency.", buckets=(1, 2))
+        )
+        hist.observe(0.5)
+        hist.observe(3)
+        lines = self.registry.expose().splitlines()
+        self.assertEqual(
+            lines[2:],
+            [
+                'latency_seconds_bucket{le="1"} 1',
+                'latency_seconds_bucket{le="2"} 1',
+                'latency_seconds_bucket{le="+Inf"} 2',
+                "latency_seconds_sum 3.5",
+                "latency_seconds_count 2",
+            ],
+        )
+
+    def test_write_textfile(self):
+        self.registry.register(metrics.Gauge("up", "Up.")).set(1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dws.prom")
+            self.registry.write_textfile(path)
+            self.registry.write_textfile(path)
+            self.assertEqual(os.listdir(tmpdir), ["dws.prom"])
+            with open(path, encoding="utf-8") as infile:
+                self.assertEqual(infile.read(), self.registry.expose())
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import unittest
+
+from flux_k8s import timeline
+
+from pycotap import TAPTestRunner
+
+
+def make_workflow(state, ready=True, desired=None):
+    return {
+        "spec": {"desiredState": desired or state},
+        "status": {
+            "state": state,
+            "ready": ready,
+            "elapsedTimeLastState": "1.5s",
+            "readyChange": "1970-01-01T00:00:10Z",
+        },
+    }
+
+
+class TestTimeline(unittest.TestCase):
+    def test_encode_decode(self):
+        tline = timeline.Timeline()
+        tline.record("rpc", 1.0, topic="dws.create")
+        tline.record("desired", 1.25, state="Proposal", latency=0.1)
+        encoded = tline.encode()
+        self.assertEqual(len(encoded.splitlines()), 2)
+        self.assertNotIn(" ", encoded)
+        self.assertEqual(
+            timeline.decode(encoded),
+            [
+                {"timestamp": 1.0, "name": "rpc", "context": {"topic": "dws.create"}},
+                {
+                    "timestamp": 1.25,
+                    "name": "desired",
+                    "context": {"state": "Proposal", "latency": 0.1},
+                },
+            ],
+        )
+
+    def test_observe_once(self):
+        tline = timeline.Timeline()
+        tline.observe(make_workflow("Setup", ready=False))
+        tline.observe(make_workflow("Setup", desired="DataIn"))
+        self.assertEqual(tline.events, [])
+        tline.observe(make_workflow("Setup"))
+        tline.observe(make_workflow("Setup"))
+        self.assertEqual(len(tline.events), 1)
+        _, name, context = tline.events[0]
+        self.assertEqual(name, "ready")
+        self.assertEqual(context["state"], "Setup")
+        self.assertEqual(context["elapsed"], 1.5)
+        self.assertGreater(context["lag"], 0)
+
+
+class TestSummarize(unittest.TestCase):
+    def test_summarize(self):
+        timelines = []
+        for offset in (0, 2):
+            tline = timeline.Timeline()
+            tline.record("desired", 10.0, state="Setup", latency=0.5)
+            tline.record("ready", 12.0 + offset, state="Setup", lag=0.25)
+            tline.record("desired", 13.0 + offset, state="DataIn")
+            timelines.append(timeline.decode(tline.encode()))
+        summary = timeline.summarize(timelines)
+        self.assertEqual(
+            list(summary["phases"]),
+            [("desired:Setup", "ready:Setup"), ("ready:Setup", "desired:DataIn")],
+        )
+        dws = summary["phases"][("desired:Setup", "ready:Setup")]
+        self.assertEqual(dws["count"], 2)
+        self.assertEqual(dws["total"], 6.0)
+        self.assertEqual(dws["max"], 4.0)
+        flux_phase = summary["phases"][("ready:Setup", "desired:DataIn")]
+        self.assertEqual(flux_phase["mean"], 1.0)
+        self.assertEqual(summary["details"][("latency", "desired:Setup")]["p50"], 0.5)
+        self.assertEqual(summary["details"][("lag", "ready:Setup")]["total"], 0.5)
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import unittest
+import unittest.mock
+
+from flux_k8s import config
+
+from pycotap import TAPTestRunner
+
+
+PRESETS = {
+    "preset1": "#DW jobdw type=xfs capacity=1GiB name=x #DW copy_in foo",
+    "preset2": ["#DW jobdw type=lustre capacity=1GiB name=y"],
+    "bad": 5,
+}
+
+
+def make_handle(conf):
+    handle = unittest.mock.Mock()
+    handle.attr_get.return_value = "1000"
+    handle.conf_get.return_value = conf
+    handle.rpc.return_value.get.return_value = conf
+    return handle
+
+
+class ConfigSnapshotTests(unittest.TestCase):
+    """Tests for the ConfigSnapshot class."""
+
+    def test_compile_presets(self):
+        compiled = config.compile_presets(PRESETS)
+        self.assertEqual(
+            compiled["preset1"],
+            ["#DW jobdw type=xfs capacity=1GiB name=x", "#DW copy_in foo"],
+        )
+        self.assertEqual(compiled["preset2"], PRESETS["preset2"])
+        self.assertEqual(compiled["bad"], 5)
+
+    def test_expand(self):
+        snapshot = config.ConfigSnapshot({"rabbit": {"presets": PRESETS}}, 1000)
+        expanded = snapshot.expand(" preset1 ")
+        self.assertEqual(len(expanded), 2)
+        self.assertIs(snapshot.expand(" preset1 "), expanded)
+        self.assertEqual(
+            snapshot.expand("#DW jobdw a #DW jobdw b"), ("#DW jobdw a", "#DW jobdw b")
+        )
+        with self.assertRaises(TypeError):
+            snapshot.expand("bad")
+
+    def test_typed_defaults(self):
+        snapshot = config.ConfigSnapshot({}, 0)
+        self.assertIs(snapshot.drain_compute_nodes, True)
+        self.assertIs(snapshot.soft_drain, True)
+        self.assertEqual(snapshot.setup_timeout, 0.0)
+        self.assertEqual(snapshot.tc_timeout, 10.0)
+        self.assertEqual(snapshot.save_datamovements, 0)
+
+    def test_typed_values(self):
+        snapshot = config.ConfigSnapshot(
+            {
+                "rabbit": {
+                    "drain_compute_nodes": False,
+                    "postrun_timeout": 30,
+                    "teardown_after": 4800.5,
+                    "save_datamovements": 5,
+                }
+            },
+            0,
+        )
+        self.assertIs(snapshot.drain_compute_nodes, False)
+        self.assertIsInstance(snapshot.postrun_timeout, float)
+        self.assertEqual(snapshot.postrun_timeout, 30.0)
+        self.assertEqual(snapshot.teardown_after, 4800.5)
+        self.assertEqual(snapshot.save_datamovements, 5)
+
+    def test_invalid(self):
+        for key, value in (
+            ("drain_compute_nodes", "false"),
+            ("soft_drain", 1),
+            ("setup_timeout", "10"),
+            ("prerun_timeout", True),
+            ("tc_timeout", -1),
+            ("save_datamovements", 2.5),
+            ("container_log_max_bytes", -1),
+            ("container_log_max_lines", 1.5),
+        ):
+            with self.assertRaisesRegex(ValueError, key):
+                config.ConfigSnapshot({"rabbit": {key: value}}, 0)
+
+    def test_pod_log_limits(self):
+        snapshot = config.ConfigSnapshot({}, 0)
+        self.assertEqual(snapshot.pod_log_limits, config.DEFAULT_POD_LOG_LIMITS)
+        snapshot = config.ConfigSnapshot(
+            {"rabbit": {"container_log_max_bytes": 0, "container_log_max_lines": 5}},
+            0,
+        )
+        self.assertEqual(snapshot.pod_log_limits, (0, 5, 0))
+
+    def test_restrict_persistent(self):
+        self.assertTrue(config.ConfigSnapshot({}, 0).restrict_persistent)
+        snapshot = config.ConfigSnapshot(
+            {"rabbit": {"restrict_persistent_creation": False}}, 0
+        )
+        self.assertFalse(snapshot.restrict_persistent)
+        with self.assertLogs("flux_k8s.config", "WARNING") as logs:
+            snapshot = config.ConfigSnapshot(
+                {"rabbit": {"restrict_persistent": False}}, 0
+            )
+        self.assertFalse(snapshot.restrict_persistent)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("deprecated", logs.output[0])
+
+
+class LoadTests(unittest.TestCase):
+    """Tests for loading and reloading snapshots."""
+
+    def setUp(self):
+        config._CURRENT = None
+
+    def test_current_unloaded(self):
+        with self.assertRaises(RuntimeError):
+            config.current()
+
+    def test_generations(self):
+        handle = make_handle({"rabbit": {"presets": PRESETS}})
+        first = config.load(handle)
+        self.assertIs(config.current(), first)
+        self.assertEqual(first.generation, 1)
+        self.assertEqual(first.owner_uid, 1000)
+        first.expand("preset1")
+        second = config.load(handle, {"rabbit": {}})
+        self.assertIs(config.current(), second)
+        self.assertEqual(second.generation, 2)
+        self.assertEqual(second.owner_uid, 1000)
+        self.assertEqual(second.expand("preset1"), ("#DW preset1",))
+        handle.attr_get.assert_called_once()
+
+    def test_watcher_poll(self):
+        handle = make_handle({"rabbit": {}})
+        config.load(handle)
+        reloads = []
+        watcher = config.ConfigWatcher(handle, on_reload=reloads.append)
+        future = unittest.mock.Mock()
+        future.get.return_value = {"rabbit": {}}
+        watcher._config_cb(future)
+        self.assertEqual(reloads, [])
+        future.get.return_value = {"rabbit": {"presets": PRESETS}}
+        watcher._config_cb(future)
+        self.assertEqual(len(reloads), 1)
+        self.assertIs(reloads[0], config.current())
+        self.assertEqual(config.current().generation, 2)
+        future.get.return_value = {"rabbit": {"setup_timeout": "10"}}
+        watcher._config_cb(future)
+        self.assertEqual(config.current().generation, 2)
+        self.assertEqual(len(reloads), 1)
+        future.get.side_effect = OSError
+        watcher._config_cb(future)
+        self.assertEqual(config.current().generation, 2)
+
+    def test_watcher_rpc(self):
+        handle = make_handle({"rabbit": {}})
+        config.load(handle)
+        watcher = config.ConfigWatcher(handle, interval=0)
+        watcher._reload_cb(handle, None, "msg", None)
+        handle.respond.assert_not_called()
+        future = handle.rpc.return_value
+        future.then.assert_called_once_with(watcher._reload_config_cb, "msg")
+        watcher._reload_config_cb(future, "msg")
+        handle.respond.assert_called_once_with(
+            "msg", {"success": True, "generation": 2}
+        )
+        future.get.return_value = {"rabbit": {"setup_timeout": "10"}}
+        with self.assertLogs("flux_k8s.config", "ERROR"):
+            watcher._reload_config_cb(future, "msg")
+        self.assertFalse(handle.respond.call_args.args[1]["success"])
+        self.assertEqual(config.current().generation, 2)
+        watcher.start()
+        handle.timer_watcher_create.assert_not_called()
+        with watcher:
+            pass
+        handle.msg_watcher_create.return_value.start.return_value.stop.assert_called()
+
+
+unittest.main(testRunner=TAPTestRunner())
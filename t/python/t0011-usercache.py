@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import types
+import unittest
+
+from flux_k8s import usercache
+
+from pycotap import TAPTestRunner
+
+
+class InlineExecutor:
+    """Executor running submitted functions only when told to."""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, func, *args):
+        self.pending.append((func, args))
+
+    def run(self):
+        pending, self.pending = self.pending, []
+        for func, args in pending:
+            func(*args)
+
+
+class FakeDirectory:
+    def __init__(self, gids):
+        self.gids = gids
+        self.lookups = 0
+
+    def getpwuid(self, uid):
+        self.lookups += 1
+        return types.SimpleNamespace(pw_gid=self.gids[uid])
+
+
+class GroupCacheTests(unittest.TestCase):
+    """Tests for the usercache.GroupCache class."""
+
+    def test_hit(self):
+        directory = FakeDirectory({1000: 100})
+        cache = usercache.GroupCache(
+            InlineExecutor(), ttl=60, getpwuid=directory.getpwuid
+        )
+        self.assertEqual(cache.gid(1000), 100)
+        self.assertEqual(cache.gid(1000), 100)
+        self.assertEqual(directory.lookups, 1)
+
+    def test_unknown(self):
+        directory = FakeDirectory({})
+        cache = usercache.GroupCache(
+            InlineExecutor(), ttl=60, getpwuid=directory.getpwuid
+        )
+        with self.assertRaises(KeyError):
+            cache.gid(1000)
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_refresh(self):
+        directory = FakeDirectory({1000: 100})
+        executor = InlineExecutor()
+        cache = usercache.GroupCache(executor, ttl=0, getpwuid=directory.getpwuid)
+        cache.gid(1000)
+        directory.gids[1000] = 200
+        # stale entries are served while a single refresh is pending
+        self.assertEqual(cache.gid(1000), 100)
+        self.assertEqual(cache.gid(1000), 100)
+        self.assertEqual(len(executor.pending), 1)
+        executor.run()
+        self.assertEqual(cache.gid(1000), 200)
+        self.assertEqual(directory.lookups, 2)
+        # users removed from the directory are dropped on refresh
+        del directory.gids[1000]
+        executor.run()
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        directory = FakeDirectory({uid: uid for uid in range(5)})
+        cache = usercache.GroupCache(
+            InlineExecutor(), ttl=60, maxsize=3, getpwuid=directory.getpwuid
+        )
+        for uid in range(4):
+            cache.gid(uid)
+        self.assertEqual(len(cache), 3)
+        cache.gid(1)
+        self.assertEqual(directory.lookups, 4)
+        cache.gid(0)
+        self.assertEqual(directory.lookups, 5)
+
+
+unittest.main(testRunner=TAPTestRunner())
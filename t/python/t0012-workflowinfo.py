@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import time
+import unittest
+import unittest.mock
+
+from flux_k8s import reconcile
+from flux_k8s.workflow import WorkflowInfo
+
+from pycotap import TAPTestRunner
+
+
+class WorkflowInfoRegistryTests(unittest.TestCase):
+    """Tests for the registry of WorkflowInfo objects."""
+
+    def setUp(self):
+        self._old_cache = WorkflowInfo._WORKFLOWINFO_CACHE
+        WorkflowInfo._WORKFLOWINFO_CACHE = {}
+
+    def tearDown(self):
+        WorkflowInfo._WORKFLOWINFO_CACHE = self._old_cache
+
+    def test_slots(self):
+        winfo = WorkflowInfo.add(1)
+        with self.assertRaises(AttributeError):
+            winfo.foo = 5
+        self.assertIsNone(winfo._failures)
+        self.assertIsNone(winfo.teardown_timer)
+
+    def test_get(self):
+        winfo = WorkflowInfo.add(1)
+        self.assertIs(WorkflowInfo.get(1), winfo)
+        self.assertIsNone(winfo.expires)
+        stray = WorkflowInfo.get(2)
+        self.assertIs(WorkflowInfo.get(2), stray)
+        self.assertIsNotNone(stray.expires)
+        WorkflowInfo.remove(2)
+        WorkflowInfo.remove(2)
+        self.assertEqual(list(WorkflowInfo.known_workflows()), [1])
+
+    def test_evict_expired(self):
+        kept = WorkflowInfo.add(1)
+        stray = WorkflowInfo.get(2)
+        stray.state_timer = unittest.mock.Mock()
+        rescued = WorkflowInfo.get(3)
+        rescued.keep()
+        deleted = WorkflowInfo.add(4)
+        deleted.expire()
+        self.assertEqual(WorkflowInfo.evict_expired(), 0)
+        evicted = WorkflowInfo.stats()["evicted"]
+        later = time.monotonic() + WorkflowInfo.ttl + 1
+        self.assertEqual(WorkflowInfo.evict_expired(later), 2)
+        self.assertEqual(sorted(WorkflowInfo.known_workflows()), [1, 3])
+        stray.state_timer.stop.assert_called_once()
+        self.assertIsNone(kept.expires)
+        stats = WorkflowInfo.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["expiring"], 0)
+        self.assertEqual(stats["evicted"], evicted + 2)
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_size(self):
+        winfo = WorkflowInfo.add(1)
+        size = winfo.size()
+        winfo.timeline.record("rpc", topic="dws.setup")
+        self.assertGreater(winfo.size(), size)
+
+    def test_reconciler_expires_unseen(self):
+        for jobid in (1, 2, 3, 4):
+            WorkflowInfo.add(jobid)
+        reconciler = reconcile.WorkflowReconciler(None, None, None)
+        reconciler._known = {1, 2, 3}
+        reconciler._active = {1}
+        reconciler._seen = {2}
+        reconciler._expire_unseen()
+        self.assertEqual(
+            [jobid for jobid in (1, 2, 3, 4) if WorkflowInfo.get(jobid).expires],
+            [3],
+        )
+        self.assertEqual(reconciler.stats()["expired"], 1)
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import datetime
+import unittest
+import unittest.mock
+
+from flux_k8s import config, workflow
+from flux_k8s.workflow import (
+    StateMachine,
+    Timing,
+    Transition,
+    TransitionContext,
+    WorkflowInfo,
+    WorkflowState,
+)
+
+from pycotap import TAPTestRunner
+
+
+def make_workflow(state, ready=True, desired=None, directives=()):
+    return {
+        "metadata": {"name": "fluxjob-1"},
+        "spec": {
+            "desiredState": desired or state,
+            "dwDirectives": list(directives),
+        },
+        "status": {"state": state, "ready": ready, "elapsedTimeLastState": "1s"},
+    }
+
+
+class StateMachineTests(unittest.TestCase):
+    """Tests for the table-driven workflow state machine."""
+
+    def setUp(self):
+        self.handle = unittest.mock.Mock()
+        self.k8s_api = unittest.mock.Mock()
+        self.ctx = TransitionContext(self.handle, self.k8s_api, None, None, False)
+        self.load({})
+        patcher = unittest.mock.patch.object(workflow, "save_elapsed_time_to_kvs")
+        self.save = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = unittest.mock.patch.object(WorkflowInfo, "move_to_teardown")
+        self.move_to_teardown = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load(self, rabbit):
+        config.load(self.handle, {"rabbit": rabbit})
+
+    def test_duplicate_transition(self):
+        with self.assertRaises(ValueError):
+            StateMachine(
+                [Transition("Setup", "DataIn"), Transition("Setup", "DataIn")], self.ctx
+            )
+
+    def test_transition(self):
+        action = unittest.mock.Mock()
+        timeout_cb = unittest.mock.Mock()
+        self.load({"prerun_timeout": 5})
+        machine = StateMachine(
+            [
+                Transition(
+                    WorkflowState.DATAIN,
+                    WorkflowState.PRERUN,
+                    actions=[action],
+                    timing=Timing.SAVE,
+                    timeout="prerun_timeout",
+                    on_timeout=timeout_cb,
+                )
+            ],
+            self.ctx,
+        )
+        winfo = WorkflowInfo(1)
+        machine.advance(make_workflow("DataIn", ready=False), winfo)
+        self.k8s_api.patch_namespaced_custom_object.assert_not_called()
+        self.assertEqual(machine.stats()["occupants"], {"DataIn": 1})
+        wkflow = make_workflow("DataIn")
+        machine.advance(wkflow, winfo)
+        self.k8s_api.patch_namespaced_custom_object.assert_called_once()
+        action.assert_called_once_with(self.ctx, wkflow, winfo)
+        self.save.assert_called_once_with(self.handle, winfo, wkflow, defer=False)
+        self.handle.timer_watcher_create.assert_called_once_with(
+            5.0, timeout_cb, args=(self.handle, self.k8s_api, winfo, self.ctx)
+        )
+        self.assertEqual(machine.stats()["occupants"], {"PreRun": 1})
+        machine.forget(1)
+        self.assertEqual(machine.stats()["occupants"], {})
+
+    def test_toredown(self):
+        action = unittest.mock.Mock()
+        machine = StateMachine(
+            [
+                Transition("PreRun", actions=[action]),
+                Transition("Teardown", actions=[action]),
+            ],
+            self.ctx,
+        )
+        winfo = WorkflowInfo(1)
+        winfo.toredown = True
+        machine.advance(make_workflow("PreRun"), winfo)
+        action.assert_not_called()
+        machine.advance(make_workflow("Teardown"), winfo)
+        action.assert_called_once()
+
+    def test_empty_state(self):
+        machine = StateMachine(
+            [
+                Transition(
+                    "Setup", "DataIn", timing=Timing.SAVE, empty_unless="copy_in"
+                ),
+                Transition(
+                    "PostRun",
+                    "DataOut",
+                    timing=Timing.SAVE,
+                    empty_unless="copy_out",
+                    skippable=True,
+                ),
+                Transition("DataOut", "Teardown"),
+            ],
+            self.ctx,
+        )
+        wkflow = make_workflow("Setup")
+        machine.advance(wkflow, WorkflowInfo(1))
+        self.k8s_api.patch_namespaced_custom_object.assert_called_once()
+        self.assertTrue(self.save.call_args.kwargs["defer"])
+        self.save.reset_mock()
+        wkflow = make_workflow("PostRun", directives=["#DW copy_out a"])
+        machine.advance(wkflow, WorkflowInfo(2))
+        self.move_to_teardown.assert_not_called()
+        self.assertFalse(self.save.call_args.kwargs["defer"])
+        self.save.reset_mock()
+        wkflow = make_workflow("PostRun")
+        machine.advance(wkflow, WorkflowInfo(3))
+        self.move_to_teardown.assert_called_once_with(self.handle, self.k8s_api, wkflow)
+        self.assertTrue(self.save.call_args.kwargs["defer"])
+        self.assertEqual(machine.stats()["occupants"]["Teardown"], 1)
+
+    def test_limits(self):
+        self.load({"transition_limits": {"PreRun": 1}})
+        on_error = unittest.mock.Mock()
+        action = unittest.mock.Mock(side_effect=[None, ValueError])
+        machine = StateMachine(
+            [Transition("DataIn", "PreRun", actions=[action])],
+            self.ctx,
+            on_error=on_error,
+        )
+        winfos = [WorkflowInfo(jobid) for jobid in (1, 2, 3, 4)]
+        for winfo in winfos:
+            machine.advance(make_workflow("DataIn"), winfo)
+        self.assertEqual(action.call_count, 1)
+        self.assertEqual(machine.stats()["waiting"], {"PreRun": 3})
+        winfos[2].toredown = True
+        # the first workflow leaves PreRun; the second takes its place but
+        # fails, keeping its slot until it is seen in Teardown
+        machine.advance(make_workflow("PostRun", ready=False), winfos[0])
+        self.assertEqual(action.call_count, 2)
+        on_error.assert_called_once()
+        self.assertIs(on_error.call_args.args[2], winfos[1])
+        self.assertEqual(machine.stats()["waiting"], {"PreRun": 2})
+        machine.prune({1, 2})
+        self.assertEqual(machine.stats()["waiting"], {})
+        self.assertEqual(machine.stats()["occupants"], {"PreRun": 1, "PostRun": 1})
+
+    def test_resume(self):
+        timeout_cb = unittest.mock.Mock()
+        resume = unittest.mock.Mock()
+        self.load({"prerun_timeout": 100})
+        machine = StateMachine(
+            [
+                Transition(
+                    WorkflowState.DATAIN,
+                    WorkflowState.PRERUN,
+                    timeout="prerun_timeout",
+                    on_timeout=timeout_cb,
+                )
+            ],
+            self.ctx,
+            resume=resume,
+        )
+        winfo = WorkflowInfo(1)
+        wkflow = make_workflow("PreRun", ready=False)
+        changed = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=30
+        )
+        wkflow["status"]["desiredStateChange"] = changed.strftime("%Y-%m-%dT%H:%M:%SZ")
+        machine.advance(wkflow, winfo)
+        self.handle.timer_watcher_create.assert_called_once()
+        seconds = self.handle.timer_watcher_create.call_args.args[0]
+        self.assertGreater(seconds, 65)
+        self.assertLessEqual(seconds, 70)
+        resume.assert_called_once()
+        self.assertEqual(resume.call_args.args[:3], (self.ctx, wkflow, winfo))
+        # the timers are only restored the first time a workflow is seen
+        machine.advance(wkflow, winfo)
+        self.handle.timer_watcher_create.assert_called_once()
+        resume.assert_called_once()
+        # nor for workflows being torn down
+        winfo = WorkflowInfo(2)
+        winfo.toredown = True
+        machine.advance(wkflow, winfo)
+        resume.assert_called_once()
+
+    def test_limits_config(self):
+        for limits in ({"Setup": 1}, {"PreRun": -1}, {"PreRun": True}, 5):
+            with self.assertRaises(ValueError):
+                config.ConfigSnapshot({"rabbit": {"transition_limits": limits}}, 0)
+        snapshot = config.ConfigSnapshot({"rabbit": {}}, 0)
+        self.assertEqual(snapshot.transition_limits, {})
+
+
+unittest.main(testRunner=TAPTestRunner())
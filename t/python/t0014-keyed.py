@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import threading
+import time
+import unittest
+import unittest.mock
+
+from flux_k8s import config
+from flux_k8s.keyed import KeyedExecutor
+from flux_k8s.workflow import (
+    StateMachine,
+    Transition,
+    TransitionContext,
+    WorkflowInfo,
+)
+
+from pycotap import TAPTestRunner
+
+
+class KeyedExecutorTests(unittest.TestCase):
+    """Tests for the KeyedExecutor class."""
+
+    def setUp(self):
+        self.executor = KeyedExecutor().start(unittest.mock.Mock(), 4)
+        self.addCleanup(self.executor.stop)
+
+    def wait(self):
+        """Commit finished work until no key is busy."""
+        deadline = time.monotonic() + 10
+        while self.executor.stats()["busy_keys"]:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+            self.executor.process()
+
+    def test_synchronous(self):
+        executor = KeyedExecutor()
+        order = []
+        executor.submit(
+            1,
+            lambda: order.append("work") or 5,
+            lambda future: order.append(future.result()),
+        )
+        executor.run(1, order.append, "run")
+        self.assertEqual(order, ["work", 5, "run"])
+        self.assertEqual(executor.stats()["submitted"], 0)
+
+    def test_order_per_key(self):
+        order = []
+        gate = threading.Event()
+        main = threading.current_thread()
+
+        def commit(future):
+            self.assertIs(threading.current_thread(), main)
+            order.append(future.result())
+
+        self.executor.submit(1, lambda: gate.wait(10) and "slow", commit)
+        self.executor.run(1, order.append, "held")
+        self.executor.submit(1, lambda: "next", commit)
+        self.executor.submit(2, lambda: "other", commit)
+        self.executor.run(3, order.append, "idle")
+        self.assertTrue(self.executor.busy(1))
+        while "other" not in order:
+            time.sleep(0.01)
+            self.executor.process()
+        self.assertEqual(order, ["idle", "other"])
+        gate.set()
+        self.wait()
+        self.assertEqual(order, ["idle", "other", "slow", "held", "next"])
+        self.assertEqual(self.executor.stats()["held"], 2)
+
+    def test_held_submission(self):
+        order = []
+        self.executor.submit(1, lambda: "first", lambda f: order.append(f.result()))
+
+        def held():
+            order.append("held")
+            self.executor.submit(
+                1, lambda: "nested", lambda f: order.append(f.result())
+            )
+
+        self.executor.run(1, held)
+        self.executor.run(1, order.append, "last")
+        self.wait()
+        self.assertEqual(order, ["first", "held", "nested", "last"])
+
+    def test_failure(self):
+        failures = []
+
+        def fail():
+            raise ValueError
+
+        self.executor.submit(
+            1, fail, lambda future: failures.append(future.exception())
+        )
+        self.wait()
+        self.assertIsInstance(failures[0], ValueError)
+
+    def test_state_machine(self):
+        handle = unittest.mock.Mock()
+        config.load(handle, {"rabbit": {}})
+        k8s_api = unittest.mock.Mock()
+        gate = threading.Event()
+        k8s_api.patch_namespaced_custom_object.side_effect = lambda *a: gate.wait(10)
+        action = unittest.mock.Mock()
+        machine = StateMachine(
+            [Transition("DataIn", "PreRun", actions=[action])],
+            TransitionContext(handle, k8s_api, None, None, False),
+            executor=self.executor,
+        )
+        winfos = [WorkflowInfo(1), WorkflowInfo(2)]
+        for winfo in winfos:
+            workflow = {
+                "spec": {"desiredState": "DataIn"},
+                "status": {"state": "DataIn", "ready": True},
+            }
+            self.executor.run(winfo.jobid, machine.advance, workflow, winfo)
+        # both patches are in progress at once, and nothing is committed yet
+        deadline = time.monotonic() + 10
+        while k8s_api.patch_namespaced_custom_object.call_count < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        action.assert_not_called()
+        winfos[1].toredown = True
+        gate.set()
+        self.wait()
+        action.assert_called_once()
+        self.assertIs(action.call_args.args[2], winfos[0])
+        for winfo in winfos:
+            self.assertEqual(winfo.timeline.events[-1][1], "desired")
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import errno
+import unittest
+import unittest.mock
+
+from flux_k8s.standby import ServiceHandoff
+
+from pycotap import TAPTestRunner
+
+
+class FakeFuture:
+    """Stand-in for the future returned by ``service_register``."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.callback = None
+
+    def then(self, callback):
+        self.callback = callback
+        return self
+
+    def get(self):
+        if self.error is not None:
+            raise OSError(self.error, "error")
+        return None
+
+
+class ServiceHandoffTests(unittest.TestCase):
+    """Tests for the ServiceHandoff class."""
+
+    def setUp(self):
+        self.handle = unittest.mock.Mock()
+        self.acquired = unittest.mock.Mock()
+        self.handoff = ServiceHandoff(self.handle, "dws", self.acquired).start()
+
+    def attempt(self, error=None):
+        """Fire the timer and complete the registration with ``error``."""
+        future = FakeFuture(error)
+        self.handle.service_register.return_value = future
+        self.handoff._attempt_cb(None, None, None, None)
+        return future
+
+    def test_start(self):
+        self.handle.timer_watcher_create.assert_called_once_with(
+            0, self.handoff._attempt_cb, repeat=0.2
+        )
+
+    def test_taken(self):
+        for _ in range(3):
+            future = self.attempt(errno.EEXIST)
+            future.callback(future)
+        self.assertEqual(self.handoff.attempts, 3)
+        self.assertFalse(self.handoff.acquired)
+        self.acquired.assert_not_called()
+        self.handle.service_register.assert_called_with("dws")
+
+    def test_acquire(self):
+        future = self.attempt(errno.EEXIST)
+        future.callback(future)
+        future = self.attempt()
+        future.callback(future)
+        self.assertTrue(self.handoff.acquired)
+        self.acquired.assert_called_once_with()
+        timer = self.handle.timer_watcher_create.return_value.start.return_value
+        timer.stop.assert_called_once_with()
+        # later firings of the timer do nothing
+        self.handoff._attempt_cb(None, None, None, None)
+        self.assertEqual(self.handoff.attempts, 2)
+
+    def test_pending(self):
+        future = self.attempt(errno.EEXIST)
+        self.handoff._attempt_cb(None, None, None, None)
+        self.assertEqual(self.handoff.attempts, 1)
+        future.callback(future)
+        self.attempt(errno.EEXIST)
+        self.assertEqual(self.handoff.attempts, 2)
+
+    def test_error(self):
+        future = self.attempt(errno.EPERM)
+        with self.assertLogs("flux_k8s.standby", "WARNING"):
+            future.callback(future)
+        self.assertFalse(self.handoff.acquired)
+        self.acquired.assert_not_called()
+
+
+unittest.main(testRunner=TAPTestRunner())
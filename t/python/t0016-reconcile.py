@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+import errno
+import os
+import unittest
+import unittest.mock
+
+import flux.constants
+import flux.job
+
+from flux_k8s import cleanup, fastjson, metrics, reconcile
+
+from pycotap import TAPTestRunner
+
+
+OLD = "2020-01-01T00:00:00Z"  # creation time of workflows past the grace period
+
+
+def make_workflow(jobid, desired="PreRun", state="PreRun"):
+    return {
+        "metadata": {"name": f"fluxjob-{jobid}", "creationTimestamp": OLD},
+        "spec": {"jobID": str(jobid), "desiredState": desired},
+        "status": {"state": state},
+    }
+
+
+class FakeJobList:
+    """Stand-in for the future returned by ``flux.job.job_list``.
+
+    Like the job-list module, it only returns the caller's own jobs unless
+    ``userid`` is ``FLUX_USERID_UNKNOWN``.
+    """
+
+    def __init__(self, jobs, userid=None, **_kwargs):
+        if userid is None:
+            userid = os.getuid()
+        self.jobs = [
+            job
+            for job in jobs
+            if userid == flux.constants.FLUX_USERID_UNKNOWN or job["userid"] == userid
+        ]
+        self.callback = None
+
+    def then(self, callback):
+        self.callback = callback
+        return self
+
+    def get(self):
+        if self.jobs is None:
+            raise OSError(errno.ENODATA, "end of stream")
+        jobs, self.jobs = self.jobs, None
+        return {"jobs": [{"id": job["id"]} for job in jobs]}
+
+    def reset(self):
+        self.callback(self)
+
+
+class WorkflowReconcilerTests(unittest.TestCase):
+    """Tests for the WorkflowReconciler class."""
+
+    def setUp(self):
+        self.handle = unittest.mock.Mock()
+        self.resync = unittest.mock.Mock()
+        self.reconciler = reconcile.WorkflowReconciler(
+            self.handle, unittest.mock.Mock(), self.resync
+        )
+        patcher = unittest.mock.patch.object(cleanup, "teardown_workflow")
+        self.teardown = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sweep(self, jobs, workflows):
+        """Run one sweep over ``workflows`` with ``jobs`` active."""
+        futures = []
+
+        def job_list(_handle, **kwargs):
+            futures.append(FakeJobList(jobs, **kwargs))
+            return futures[-1]
+
+        with unittest.mock.patch.object(flux.job, "job_list", job_list):
+            self.reconciler._sweep_cb(None, None, None, None)
+        futures[0].callback(futures[0])
+        with unittest.mock.patch.object(
+            fastjson,
+            "list_namespaced",
+            return_value={"items": workflows, "metadata": {}},
+        ):
+            self.reconciler._page_cb(None, None, None, None)
+
+    def test_other_users(self):
+        other = os.getuid() + 1
+        jobs = [
+            {"id": 1, "userid": os.getuid()},
+            {"id": 2, "userid": other},
+        ]
+        scanned = metrics.RECONCILE_SCANNED.labels().get()
+        torn_down = metrics.RECONCILE_ACTIONS.labels("torn_down").get()
+        self.sweep(jobs, [make_workflow(1), make_workflow(2), make_workflow(3)])
+        # only the workflow of the inactive job is torn down, never that of
+        # an active job belonging to another user
+        self.teardown.assert_called_once()
+        self.assertEqual(
+            self.teardown.call_args.args[0]["metadata"]["name"], "fluxjob-3"
+        )
+        stats = self.reconciler.stats()
+        self.assertEqual(stats["scanned"], 3)
+        self.assertEqual(stats["torn_down"], 1)
+        self.assertFalse(stats["in_progress"])
+        self.assertEqual(metrics.RECONCILE_SCANNED.labels().get(), scanned + 3)
+        self.assertEqual(
+            metrics.RECONCILE_ACTIONS.labels("torn_down").get(), torn_down + 1
+        )
+
+    def test_teardown_resynced(self):
+        workflow = make_workflow(4, desired="Teardown", state="Teardown")
+        self.sweep([], [workflow])
+        self.teardown.assert_not_called()
+        self.resync.assert_called_once_with({"type": "MODIFIED", "object": workflow})
+
+
+unittest.main(testRunner=TAPTestRunner())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+###############################################################
+# Copyright 2026 Lawrence Livermore National Security, LLC
+# (c.f. AUTHORS, NOTICE.LLNS, COPYING)
+#
+# This file is part of the Flux resource manager framework.
+# For details, see https://github.com/flux-framework.
+#
+# SPDX-License-Identifier: LGPL-3.0
+###############################################################
+
+"""Compare JSON decode times for realistically sized kubernetes objects.
+
+Decodes synthetic Workflow, Storage, and Servers resources, both as
+individual watch events and as list responses, using the kubernetes
+client's generic path, the standard library, and ``flux_k8s.fastjson``.
+"""
+
+import argparse
+import json
+import timeit
+
+import kubernetes as k8s
+
+from flux_k8s import fastjson
+
+
+def make_workflow(jobid, computes=64):
+    """Return a Workflow resource similar to those created by coral2_dws."""
+    return {
+        "apiVersion": "dataworkflowservices.github.io/v1alpha7",
+        "kind": "Workflow",
+        "metadata": {
+            "name": f"fluxjob-{jobid}",
+            "namespace": "default",
+            "resourceVersion": str(1000000 + jobid),
+            "uid": f"0d4c7f84-7f2b-4a73-9d4e-{jobid:012d}",
+            "finalizers": [
+                "flux-framework.readthedocs.io/workflow",
+                "nnf.cray.hpe.com/workflow",
+            ],
+            "labels": {"dataworkflowservices.github.io/owner.kind": "Workflow"},
+            "managedFields": [
+                {
+                    "apiVersion": "dataworkflowservices.github.io/v1alpha7",
+                    "fieldsType": "FieldsV1",
+                    "manager": manager,
+                    "operation": "Update",
+                    "time": "2026-01-01T00:00:00Z",
+                }
+                for manager in ("python", "nnf-sos", "dws")
+            ],
+        },
+        "spec": {
+            "desiredState": "PreRun",
+            "dwDirectives": [
+                f"#DW jobdw type=xfs capacity=1TiB name=project{i}" for i in range(4)
+            ]
+            + ["#DW copy_in source=/p/lustre/data destination=$DW_JOB_project0/"],
+            "jobID": f"f{jobid:x}",
+            "userID": 1000,
+            "groupID": 1000,
+            "wlmID": "flux",
+        },
+        "status": {
+            "state": "PreRun",
+            "ready": True,
+            "status": "Completed",
+            "elapsedTimeLastState": "12.345678s",
+            "env": {f"DW_JOB_project{i}": f"/mnt/nnf/{jobid}-{i}" for i in range(4)},
+            "computes": {"name": f"fluxjob-{jobid}", "namespace": "default"},
+            "directiveBreakdowns": [
+                {"name": f"fluxjob-{jobid}-{i}", "namespace": "default"}
+                for i in range(4)
+            ],
+            "drivers": [
+                {
+                    "driverID": "nnf",
+                    "taskID": f"task-{i}",
+                    "dwdIndex": i,
+                    "watchState": "PreRun",
+                    "completed": True,
+                    "status": "Completed",
+                    "message": "",
+                    "completeTime": "2026-01-01T00:00:00.000000Z",
+                }
+                for i in range(computes // 4)
+            ],
+        },
+    }
+
+
+def make_storage(index, computes=16):
+    """Return a Storage resource for a rabbit with ``computes`` compute nodes."""
+    return {
+        "apiVersion": "dataworkflowservices.github.io/v1alpha7",
+        "kind": "Storage",
+        "metadata": {
+            "name": f"rabbit{index}",
+            "namespace": "default",
+            "resourceVersion": str(2000000 + index),
+        },
+        "spec": {"state": "Enabled", "mode": "Live"},
+        "status": {
+            "status": "Ready",
+            "capacity": 39582418599936,
+            "type": "NVMe",
+            "access": {
+                "protocol": "PCIe",
+                "computes": [
+                    {"name": f"compute{index * computes + i}", "status": "Ready"}
+                    for i in range(computes)
+                ],
+                "servers": [{"name": f"rabbit{index}", "status": "Ready"}],
+            },
+            "devices": [
+                {
+                    "model": "KIOXIA KCM7DRJE1T92",
+                    "serialNumber": f"SN{index:04d}{i:02d}",
+                    "firmwareVersion": "1TCRS104",
+                    "capacity": 1920383410176,
+                    "status": "Ready",
+                }
+                for i in range(18)
+            ],
+        },
+    }
+
+
+def make_servers(jobid, rabbits=32):
+    """Return a Servers resource with allocations across ``rabbits`` rabbits."""
+    return {
+        "apiVersion": "dataworkflowservices.github.io/v1alpha7",
+        "kind": "Servers",
+        "metadata": {
+            "name": f"fluxjob-{jobid}-0",
+            "namespace": "default",
+            "resourceVersion": str(3000000 + jobid),
+        },
+        "spec": {
+            "allocationSets": [
+                {
+                    "allocationSize": 1099511627776,
+                    "label": "xfs",
+                    "storage": [
+                        {"name": f"rabbit{i}", "allocationCount": 4}
+                        for i in range(rabbits)
+                    ],
+                }
+            ]
+        },
+        "status": {
+            "ready": True,
+            "allocationSets": [
+                {
+                    "label": "xfs",
+                    "allocationSize": 1099511627776,
+                    "storage": {
+                        f"rabbit{i}": {"allocationSize": 1099511627776}
+                        for i in range(rabbits)
+                    },
+                }
+            ],
+        },
+    }
+
+
+def make_list(kind, items):
+    """Wrap ``items`` in a list response."""
+    return {
+        "apiVersion": "dataworkflowservices.github.io/v1alpha7",
+        "kind": f"{kind}List",
+        "metadata": {"resourceVersion": "4000000", "continue": ""},
+        "items": items,
+    }
+
+
+def bench(label, func, data, number):
+    """Time ``func`` over every string in ``data`` and print the result."""
+    elapsed = timeit.timeit(lambda: [func(item) for item in data], number=number)
+    per_item = elapsed / (number * len(data)) * 1e6
+    print(f"  {label:<12} {elapsed:9.4f}s total {per_item:10.2f}us/item")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--objects", type=int, default=500, help="objects per resource type"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timing iterations")
+    args = parser.parse_args()
+    watcher = k8s.watch.Watch()
+    resources = {
+        "Workflow": [make_workflow(i) for i in range(args.objects)],
+        "Storage": [make_storage(i) for i in range(args.objects)],
+        "Servers": [make_servers(i) for i in range(args.objects)],
+    }
+    print(f"fastjson backend: {fastjson.BACKEND}")
+    for kind, items in resources.items():
+        events = [json.dumps({"type": "MODIFIED", "object": obj}) for obj in items]
+        size = sum(len(event) for event in events) / len(events)
+        print(f"{kind} watch events (average {size:.0f} bytes):")
+        generic = bench(
+            "kubernetes",
+            lambda line: watcher.unmarshal_event(line, "object"),
+            events,
+            args.repeat,
+        )
+        bench("json", json.loads, events, args.repeat)
+        fast = bench("fastjson", fastjson.loads, events, args.repeat)
+        print(f"  speedup over kubernetes: {generic / fast:.2f}x")
+        listing = [json.dumps(make_list(kind, items))]
+        print(f"{kind} list response ({len(listing[0])} bytes):")
+        generic = bench("json", json.loads, listing, args.repeat)
+        fast = bench("fastjson", fastjson.loads, listing, args.repeat)
+        print(f"  speedup over json: {generic / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()